@@ -0,0 +1,356 @@
+"""
+Cost-aware admission control.
+
+Every conversion is priced before its transform starts: an estimate of the
+memory it will hold, from the upload size, page count, page area and DPI or
+pixel count. A request is admitted while its operation and the serving
+process are under their concurrency limits and the estimated memory of
+everything admitted stays within the budget. Otherwise it waits, first come
+first served, for at most ADMISSION_QUEUE_SECONDS and is then refused with
+503 and a Retry-After header; so is a request arriving when ADMISSION_MAX_WAITING
+others are already waiting. A request costing more than the whole budget is
+admitted alone rather than never.
+
+Cheap requests (PDF info) do not take part: they use a separate fast lane
+with its own concurrency limit and the "fast" executor pool, so heavy
+conversions can take neither their memory budget nor their workers.
+
+Settings (environment):
+
+    ADMISSION_MEMORY_MB       memory budget of admitted work per serving process
+                              (default: 60% of the memory limit / SERVER_WORKERS)
+    ADMISSION_MAX_ACTIVE      conversions admitted at once (default: 4 per core,
+                              at least 4)
+    ADMISSION_LIMITS          per-operation limits, e.g. "pdf.to_jpg=2,pdf.to_word=1"
+                              (default: twice the workers of the operation's pool)
+    ADMISSION_QUEUE_SECONDS   longest wait for admission before 503 (default 15)
+    ADMISSION_MAX_WAITING     waiting requests before new ones are refused (50)
+    ADMISSION_FAST_LANE       cheap requests served at once (default 16)
+
+Async jobs are admitted when a job worker picks them up and wait without a
+deadline; the job queue is already their bound.
+"""
+
+import asyncio
+import collections
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+from fastapi import HTTPException
+from PIL import Image
+
+import metrics
+from executor import CPU_SHARE, pools
+from server import memory_limit
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+_limit = memory_limit()
+ADMISSION_MEMORY_BYTES = int(os.environ.get("ADMISSION_MEMORY_MB") or 0) * MB or (
+    int(_limit * 0.6) // int(os.environ.get("SERVER_WORKERS") or 1)
+    if _limit
+    else 2048 * MB
+)
+ADMISSION_MAX_ACTIVE = int(
+    os.environ.get("ADMISSION_MAX_ACTIVE") or max(4, 4 * CPU_SHARE)
+)
+ADMISSION_QUEUE_SECONDS = float(os.environ.get("ADMISSION_QUEUE_SECONDS", "15"))
+ADMISSION_MAX_WAITING = int(os.environ.get("ADMISSION_MAX_WAITING", "50"))
+ADMISSION_FAST_LANE = int(os.environ.get("ADMISSION_FAST_LANE", "16"))
+
+# ---------- 成本估算 ----------
+
+# 每个请求的固定开销（请求对象、上传缓冲、worker 内的解释器状态增长）
+BASE_COST = 16 * MB
+# pypdf 解析后的对象树相对文件大小的膨胀
+PDF_EXPANSION = 4
+# 渲染：poppler 输出的 RGB 位图 + PIL 编码时的副本
+RENDER_BYTES_PER_PIXEL = 6
+# pdf2docx 在内存中保留整份文档的版面分析结果
+OFFICE_BYTES_PER_PAGE = 8 * MB
+# 图片：解码后的 RGBA、变换结果与编码缓冲
+IMAGE_BYTES_PER_PIXEL = 12
+
+
+def pdf_cost(file_bytes: int) -> int:
+    """pypdf transforms (merge, split, compress, watermark, protect, unlock)."""
+    return BASE_COST + file_bytes * PDF_EXPANSION
+
+
+def render_cost(
+    file_bytes: int, width: float, height: float, dpi: int, pages_in_flight: int
+) -> int:
+    """Rasterization of pages_in_flight pages of width x height points at dpi."""
+    pixels = width * height * (dpi / 72) ** 2
+    return pdf_cost(file_bytes) + int(pixels * RENDER_BYTES_PER_PIXEL) * pages_in_flight
+
+
+def office_cost(file_bytes: int, pages: int) -> int:
+    return pdf_cost(file_bytes) + pages * OFFICE_BYTES_PER_PAGE
+
+
+def image_pixels(path: str) -> int:
+    """Pixel count from the image header; the file size when it cannot be read."""
+    try:
+        with Image.open(path) as image:
+            return image.width * image.height
+    except Exception:
+        return os.path.getsize(path)
+
+
+def image_cost(paths: List[str], in_flight: Optional[int] = None) -> int:
+    """
+    Decoding and transforming the images at paths, all held at once, or at
+    most in_flight of them (the largest count).
+    """
+    pixels = sorted((image_pixels(path) for path in paths), reverse=True)
+    return BASE_COST + sum(pixels[:in_flight]) * IMAGE_BYTES_PER_PIXEL
+
+
+# ---------- 准入 ----------
+
+# 操作名 -> 执行它的进程池，未列出的按前缀归入 pdf / image
+OPERATION_POOLS = {"pdf.to_jpg": "render", "pdf.to_word": "office", "pdf.from_jpg": "image"}
+
+
+def _operation_limits(setting: str) -> Dict[str, int]:
+    limits = {}
+    for item in setting.split(","):
+        name, _, value = item.partition("=")
+        if not name.strip():
+            continue
+        try:
+            limits[name.strip()] = max(1, int(value))
+        except ValueError:
+            logger.warning(f"Ignoring invalid ADMISSION_LIMITS entry {item!r}")
+    return limits
+
+
+class _Waiter:
+    def __init__(self, operation: str, cost: int):
+        self.operation = operation
+        self.cost = cost
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class Grant:
+    """Admission of one conversion; release() returns its share of the budget."""
+
+    def __init__(self, controller: "Admission", operation: str, cost: int):
+        self.controller = controller
+        self.operation = operation
+        self.cost = cost
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class Ticket:
+    """
+    Admissions held by one request, released together once its response has
+    been sent (see admission_ticket in main.py), including streamed bodies.
+    """
+
+    def __init__(self, controller: "Admission"):
+        self.controller = controller
+        self.grants: List[Grant] = []
+
+    async def admit(self, operation: str, cost: int):
+        self.grants.append(await self.controller.acquire(operation, cost))
+
+    def release(self):
+        for grant in self.grants:
+            grant.release()
+        self.grants.clear()
+
+
+class Admission:
+    """Concurrency and memory budgets of the conversions in one serving process."""
+
+    def __init__(
+        self,
+        budget_bytes: int = ADMISSION_MEMORY_BYTES,
+        max_active: int = ADMISSION_MAX_ACTIVE,
+        limits: Optional[Dict[str, int]] = None,
+        queue_seconds: float = ADMISSION_QUEUE_SECONDS,
+        max_waiting: int = ADMISSION_MAX_WAITING,
+        fast_lane: int = ADMISSION_FAST_LANE,
+    ):
+        self.budget_bytes = budget_bytes
+        self.max_active = max_active
+        self.limits = limits if limits is not None else {}
+        self.queue_seconds = queue_seconds
+        self.max_waiting = max_waiting
+        self.fast_lane = fast_lane
+
+        self.active = 0
+        self.reserved = 0
+        self.by_operation: Dict[str, int] = collections.Counter()
+        self.waiting: Deque[_Waiter] = collections.deque()
+        self.fast_active = 0
+        self.fast_waiting: Deque[asyncio.Future] = collections.deque()
+        # 最近被接纳请求的平均占用时长，用于估算 Retry-After
+        self.hold_seconds = 1.0
+        self.counts = collections.Counter()
+
+    def limit(self, operation: str) -> int:
+        if operation in self.limits:
+            return self.limits[operation]
+        pool = OPERATION_POOLS.get(operation) or operation.partition(".")[0]
+        return 2 * pools.workers(pool)
+
+    def _fits(self, waiter: _Waiter) -> bool:
+        if self.by_operation[waiter.operation] >= self.limit(waiter.operation):
+            return False
+        if self.active >= self.max_active:
+            return False
+        # 超出整个预算的请求在空闲时单独运行
+        return self.active == 0 or self.reserved + waiter.cost <= self.budget_bytes
+
+    def _grant(self, operation: str, cost: int) -> Grant:
+        self.active += 1
+        self.reserved += cost
+        self.by_operation[operation] += 1
+        self.counts["admitted"] += 1
+        return Grant(self, operation, cost)
+
+    def _wake(self):
+        for waiter in list(self.waiting):
+            if waiter.future.done():
+                self.waiting.remove(waiter)
+                continue
+            if self._fits(waiter):
+                self.waiting.remove(waiter)
+                waiter.future.set_result(self._grant(waiter.operation, waiter.cost))
+            elif self.by_operation[waiter.operation] < self.limit(waiter.operation):
+                # 卡在全局预算上的请求之后不再放行更小的请求，避免大请求饿死
+                break
+
+    def _release(self, grant: Grant):
+        self.active -= 1
+        self.reserved -= grant.cost
+        self.by_operation[grant.operation] -= 1
+        held = time.monotonic() - grant.admitted_at
+        self.hold_seconds = 0.8 * self.hold_seconds + 0.2 * held
+        self._wake()
+
+    def retry_after(self) -> int:
+        """Seconds until the waiting requests are likely to have been admitted."""
+        rounds = math.ceil((len(self.waiting) + 1) / max(1, self.max_active))
+        return max(1, min(120, math.ceil(self.hold_seconds * rounds)))
+
+    def _overloaded(self, operation: str, reason: str) -> HTTPException:
+        self.counts[f"rejected_{reason}"] += 1
+        metrics.admission_rejected.inc(operation=operation, reason=reason)
+        logger.warning(
+            f"Shedding {operation}: {reason}, {self.active} active, "
+            f"{len(self.waiting)} waiting, {self.reserved // MB} MB reserved"
+        )
+        return HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    async def acquire(
+        self, operation: str, cost: int, timeout: Optional[float] = -1
+    ) -> Grant:
+        """
+        Admit a conversion of the given estimated memory cost.
+
+        Waits at most timeout seconds (default ADMISSION_QUEUE_SECONDS, None
+        for no deadline) and raises 503 when it cannot start by then.
+        """
+        if timeout == -1:
+            timeout = self.queue_seconds
+        waiter = _Waiter(operation, cost)
+        self.waiting.append(waiter)
+        self._wake()
+        if waiter.future.done():
+            return waiter.future.result()
+        if timeout is not None and len(self.waiting) > self.max_waiting:
+            self.waiting.remove(waiter)
+            raise self._overloaded(operation, "queue_full")
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except BaseException as e:
+            if waiter in self.waiting:
+                self.waiting.remove(waiter)
+            if waiter.future.done():
+                # 接纳与超时或取消同时发生，归还刚分到的额度
+                waiter.future.result().release()
+            else:
+                waiter.future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._overloaded(operation, "timeout")
+            raise
+        finally:
+            metrics.observe_stage("queue", time.perf_counter() - started)
+        return waiter.future.result()
+
+    @asynccontextmanager
+    async def fast(self):
+        """Fast lane for cheap requests, independent of the conversion budget."""
+        if self.fast_active < self.fast_lane:
+            self.fast_active += 1
+        elif len(self.fast_waiting) >= self.max_waiting:
+            raise self._overloaded("fast", "queue_full")
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.fast_waiting.append(future)
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.queue_seconds)
+            except BaseException as e:
+                if future in self.fast_waiting:
+                    self.fast_waiting.remove(future)
+                if future.done():
+                    self._fast_release()
+                else:
+                    future.cancel()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self._overloaded("fast", "timeout")
+                raise
+        try:
+            yield
+        finally:
+            self._fast_release()
+
+    def _fast_release(self):
+        # 名额直接交给下一个等待者，没有等待者时才归还
+        while self.fast_waiting:
+            future = self.fast_waiting.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+        self.fast_active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "waiting": len(self.waiting),
+            "max_active": self.max_active,
+            "reserved_bytes": self.reserved,
+            "budget_bytes": self.budget_bytes,
+            "by_operation": {name: n for name, n in self.by_operation.items() if n},
+            "fast_lane": {"active": self.fast_active, "waiting": len(self.fast_waiting)},
+            "admitted": self.counts["admitted"],
+            "rejected": {
+                "queue_full": self.counts["rejected_queue_full"],
+                "timeout": self.counts["rejected_timeout"],
+            },
+        }
+
+
+admission = Admission(limits=_operation_limits(os.environ.get("ADMISSION_LIMITS", "")))
@@ -0,0 +1,11 @@
+"""
+Benchmark harness for the PDF Master API.
+
+    python -m benchmarks.inputs --out /tmp/pdfmaster-bench/inputs   # inputs only
+    python -m benchmarks.run --concurrency 4 --requests 40          # load + report
+
+See benchmarks/run.py for options; reports are written as JSON (default
+/tmp/pdfmaster-bench/results/) and can be compared with --baseline.
+Run from the service directory; httpx is the only extra dependency
+(benchmarks/requirements.txt).
+"""
@@ -0,0 +1,135 @@
+"""
+Synthetic benchmark inputs.
+
+PDFs are built with reportlab (N pages of text, optionally with an embedded
+raster image per page, like a scan), images with PIL in a chosen size and
+format. Content is seeded so every run produces the same bytes.
+
+    python -m benchmarks.inputs --out DIR [--pages 20] [--image-size 1600x1200]
+"""
+
+import argparse
+import os
+import random
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+SEED = 20240101
+
+
+def make_image(
+    size: Tuple[int, int], format: str = "JPEG", seed: int = SEED
+) -> bytes:
+    """A photo-like image: gradient background, shapes and noise."""
+    rng = random.Random(seed)
+    width, height = size
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(10, max(11, min(width, height) // 4))
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    image = Image.blend(image, noise, 0.15)
+
+    if format.upper() == "PNG":
+        image = image.convert("RGBA")
+    buffer = BytesIO()
+    save_kwargs = {"quality": 90} if format.upper() in ("JPEG", "WEBP") else {}
+    image.save(buffer, format=format.upper(), **save_kwargs)
+    return buffer.getvalue()
+
+
+def make_pdf(
+    pages: int,
+    image_size: Optional[Tuple[int, int]] = None,
+    seed: int = SEED,
+) -> bytes:
+    """A PDF with pages of text; image_size embeds one raster image per page."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    rng = random.Random(seed)
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "pdf", "master", "bench"]
+
+    for page in range(pages):
+        if image_size:
+            image = ImageReader(BytesIO(make_image(image_size, seed=seed + page)))
+            c.drawImage(image, 40, height / 2, width - 80, height / 2 - 40)
+        c.setFont("Helvetica", 10)
+        y = height / 2 - 20 if image_size else height - 60
+        while y > 40:
+            line = " ".join(rng.choice(words) for _ in range(14))
+            c.drawString(40, y, line)
+            y -= 14
+        c.drawString(width / 2, 20, f"{page + 1}")
+        c.showPage()
+
+    c.save()
+    return buffer.getvalue()
+
+
+def protect(pdf: bytes, password: str) -> bytes:
+    from pypdf import PdfReader, PdfWriter
+
+    writer = PdfWriter()
+    for page in PdfReader(BytesIO(pdf)).pages:
+        writer.add_page(page)
+    writer.encrypt(password)
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def generate(
+    directory: str,
+    pages: int = 20,
+    image_size: Tuple[int, int] = (1600, 1200),
+    password: str = "bench",
+) -> Dict[str, str]:
+    """Write the standard input set to directory, return name -> path."""
+    os.makedirs(directory, exist_ok=True)
+    inputs = {
+        "text.pdf": make_pdf(pages),
+        "scan.pdf": make_pdf(pages, image_size),
+        "small.pdf": make_pdf(2, seed=SEED + 1),
+        "photo.jpg": make_image(image_size, "JPEG"),
+        "photo.png": make_image(image_size, "PNG"),
+        "photo.webp": make_image(image_size, "WEBP"),
+    }
+    inputs["protected.pdf"] = protect(inputs["small.pdf"], password)
+
+    paths = {}
+    for name, data in inputs.items():
+        path = os.path.join(directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        paths[name] = path
+    return paths
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--out", default="/tmp/pdfmaster-bench/inputs")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--image-size", type=parse_size, default=(1600, 1200))
+    args = parser.parse_args()
+
+    for name, path in generate(args.out, args.pages, args.image_size).items():
+        print(f"{name:16} {os.path.getsize(path):>10} bytes  {path}")
+
+
+if __name__ == "__main__":
+    main()
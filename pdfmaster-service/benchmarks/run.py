@@ -0,0 +1,503 @@
+"""
+Load driver and JSON reports.
+
+Starts the service under uvicorn (or targets an already running one with
+--url), replays each endpoint scenario at the requested concurrency and
+writes throughput, latency percentiles and peak RSS per scenario:
+
+    python -m benchmarks.run [--only merge,to_jpg] [--concurrency 4]
+                             [--requests 40] [--baseline OLD.json]
+
+Measuring starts once /ready reports the pool warm-up finished. The spawned
+server runs with the result cache disabled so repeated requests measure real
+work (--cache keeps it on to measure hits). Peak RSS covers the
+uvicorn process and its pool workers and is read from /proc, so it needs
+Linux and a server started here or identified with --server-pid.
+
+With --baseline, scenarios whose throughput drops or p95 latency grows by
+more than --tolerance are reported and the exit status is 1.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.inputs import generate, parse_size
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = "/tmp/pdfmaster-bench"
+PASSWORD = "bench"
+
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+
+# 场景名 -> 请求定义；files 中的文件名对应 benchmarks.inputs.generate 的输出
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "merge": {
+        "path": "/api/v1/pdf/merge",
+        "files": [("files", "text.pdf"), ("files", "scan.pdf")],
+    },
+    "split_all": {
+        "path": "/api/v1/pdf/split",
+        "files": [("file", "text.pdf")],
+        "data": {"split_mode": "all"},
+    },
+    "split_range": {
+        "path": "/api/v1/pdf/split",
+        "files": [("file", "text.pdf")],
+        "data": {"split_mode": "range", "pages": "1-5"},
+    },
+    "split_every": {
+        "path": "/api/v1/pdf/split",
+        "files": [("file", "scan.pdf")],
+        "data": {"split_mode": "every", "every": "5"},
+    },
+    "compress": {
+        "path": "/api/v1/pdf/compress",
+        "files": [("file", "scan.pdf")],
+        "params": {"quality": 50},
+    },
+    "info": {"path": "/api/v1/pdf/info", "files": [("file", "text.pdf")]},
+    "pdf_watermark": {
+        "path": "/api/v1/pdf/watermark",
+        "files": [("file", "text.pdf")],
+        "data": {"text": "DRAFT", "position": "tile", "angle": "45", "opacity": "0.2"},
+    },
+    "to_jpg": {
+        "path": "/api/v1/pdf/to-jpg",
+        "files": [("file", "text.pdf")],
+        "data": {"dpi": "100"},
+    },
+    "from_jpg": {
+        "path": "/api/v1/pdf/from-jpg",
+        "files": [("files", "photo.jpg"), ("files", "photo.png")],
+    },
+    "to_word": {"path": "/api/v1/pdf/to-word", "files": [("file", "small.pdf")]},
+    "protect": {
+        "path": "/api/v1/pdf/protect",
+        "files": [("file", "small.pdf")],
+        "data": {"password": PASSWORD},
+    },
+    "unlock": {
+        "path": "/api/v1/pdf/unlock",
+        "files": [("file", "protected.pdf")],
+        "data": {"password": PASSWORD},
+    },
+    "image_compress": {
+        "path": "/api/v1/image/compress",
+        "files": [("file", "photo.png")],
+        "params": {"quality": 70},
+    },
+    "image_resize": {
+        "path": "/api/v1/image/resize",
+        "files": [("file", "photo.jpg")],
+        "data": {"width": "800"},
+    },
+    "image_convert": {
+        "path": "/api/v1/image/convert",
+        "files": [("file", "photo.jpg")],
+        "params": {"target_format": "webp"},
+    },
+    "image_rotate": {
+        "path": "/api/v1/image/rotate",
+        "files": [("file", "photo.jpg")],
+        "data": {"angle": "90"},
+    },
+    "image_crop": {
+        "path": "/api/v1/image/crop",
+        "files": [("file", "photo.jpg")],
+        "data": {"x": "100", "y": "100", "width": "600", "height": "400"},
+    },
+    "image_watermark": {
+        "path": "/api/v1/image/watermark",
+        "files": [("file", "photo.jpg")],
+        "data": {"text": "PDF Master", "position": "bottom-right"},
+    },
+    "image_variants": {
+        "path": "/api/v1/image/variants",
+        "files": [("file", "photo.jpg")],
+        "data": {"widths": "320,640,1280", "formats": "webp,jpg"},
+    },
+    "image_pipeline": {
+        "path": "/api/v1/image/pipeline",
+        "files": [("file", "photo.jpg")],
+        "data": {
+            "operations": json.dumps(
+                [
+                    {"op": "resize", "width": 800},
+                    {"op": "rotate", "angle": 90},
+                    {"op": "watermark", "text": "PDF Master"},
+                    {"op": "compress", "quality": 80},
+                ]
+            )
+        },
+    },
+}
+
+
+# ---------- RSS 采样 ----------
+
+
+def _process_tree(pid: int) -> List[int]:
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class RssSampler:
+    """Background thread tracking the peak RSS of a process and its children."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> int:
+        rss = sum(_rss_bytes(pid) for pid in _process_tree(self.pid))
+        self.peak = max(self.peak, rss)
+        return rss
+
+    def reset(self) -> int:
+        """Start a new peak window at the current RSS."""
+        self.peak = 0
+        return self.sample()
+
+    def start(self):
+        if self.pid and os.path.isdir("/proc"):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+
+# ---------- 服务进程 ----------
+
+
+def start_server(port: int, cache: bool, env_overrides: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.setdefault("TEMP_DIR", os.path.join(BENCH_DIR, "tmp"))
+    if not cache:
+        env.update({"CACHE_MEMORY_MB": "0", "CACHE_MEMORY_ITEM_KB": "0", "CACHE_DISK_MB": "0"})
+    env.update(env_overrides)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=SERVICE_DIR,
+        env=env,
+    )
+
+
+def stop_server(server: subprocess.Popen):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+async def wait_ready(url: str, timeout: float = 180):
+    # /ready 在预热完成后才返回 200，避免首个场景测到冷启动的导入
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{url}/ready")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"Server at {url} did not become ready in {timeout}s")
+
+
+# ---------- 压测 ----------
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(q / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def build_request(scenario: Dict[str, Any], inputs: Dict[str, bytes]) -> Dict[str, Any]:
+    files = [
+        (field, (name, inputs[name], CONTENT_TYPES[os.path.splitext(name)[1]]))
+        for field, name in scenario["files"]
+    ]
+    return {
+        "files": files,
+        "data": scenario.get("data", {}),
+        "params": scenario.get("params", {}),
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    url: str,
+    scenario: Dict[str, Any],
+    inputs: Dict[str, bytes],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    sampler: RssSampler,
+) -> Dict[str, Any]:
+    request = build_request(scenario, inputs)
+    bytes_in = sum(len(data) for _, (_, data, _) in request["files"])
+
+    async def send() -> httpx.Response:
+        return await client.post(f"{url}{scenario['path']}", **request)
+
+    for _ in range(warmup):
+        await send()
+
+    baseline_rss = sampler.reset()
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    bytes_out = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, bytes_out
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await send()
+                status = str(response.status_code)
+                bytes_out += len(response.content)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if status != "200")
+    return {
+        "path": scenario["path"],
+        "requests": len(latencies),
+        "errors": errors,
+        "status": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2),
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2),
+        },
+        "bytes_in_per_request": bytes_in,
+        "bytes_out": bytes_out,
+        "rss_bytes": (
+            {"start": baseline_rss, "peak": sampler.peak} if sampler.enabled else None
+        ),
+    }
+
+
+# ---------- 报告 ----------
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SERVICE_DIR,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print a comparison table and return the names of regressed scenarios."""
+    regressions = []
+    print(f"\n{'scenario':18} {'rps':>16} {'p95 ms':>20}")
+    for name, result in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        rps_delta = result["throughput_rps"] / old["throughput_rps"] - 1 if old["throughput_rps"] else 0.0
+        p95_delta = result["latency_ms"]["p95"] / old["latency_ms"]["p95"] - 1 if old["latency_ms"]["p95"] else 0.0
+        regressed = rps_delta < -tolerance or p95_delta > tolerance
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:18} {result['throughput_rps']:>8.2f} ({rps_delta:+6.1%})"
+            f" {result['latency_ms']['p95']:>10.1f} ({p95_delta:+6.1%})"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+def print_summary(report: Dict[str, Any]):
+    print(f"\n{'scenario':18} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7} {'peak RSS':>10}")
+    for name, result in report["scenarios"].items():
+        latency = result["latency_ms"]
+        rss = result["rss_bytes"]
+        peak = f"{rss['peak'] / 2**20:.0f} MB" if rss else "-"
+        print(
+            f"{name:18} {result['throughput_rps']:>8.2f} {latency['p50']:>9.1f}"
+            f" {latency['p95']:>9.1f} {latency['p99']:>9.1f} {result['errors']:>7} {peak:>10}"
+        )
+
+
+async def main_async(args) -> int:
+    input_dir = os.path.join(BENCH_DIR, "inputs")
+    paths = generate(input_dir, args.pages, args.image_size, PASSWORD)
+    inputs = {name: open(path, "rb").read() for name, path in paths.items()}
+
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    server = None
+    url = args.url
+    pid = args.server_pid
+    if not url:
+        env = dict(item.split("=", 1) for item in args.env)
+        server = start_server(args.port, args.cache, env)
+        url = f"http://127.0.0.1:{args.port}"
+        pid = server.pid
+
+    sampler = RssSampler(pid)
+    try:
+        await wait_ready(url)
+        sampler.start()
+        report = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "commit": git_commit(),
+                "url": url,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "pages": args.pages,
+                "image_size": list(args.image_size),
+                "cache": args.cache,
+                "env": args.env,
+            },
+            "scenarios": {},
+        }
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+            for name in names:
+                print(f"Running {name} ...", flush=True)
+                report["scenarios"][name] = await run_scenario(
+                    client,
+                    url,
+                    SCENARIOS[name],
+                    inputs,
+                    args.requests,
+                    args.concurrency,
+                    args.warmup,
+                    sampler,
+                )
+        report["peak_rss_bytes"] = (
+            max(r["rss_bytes"]["peak"] for r in report["scenarios"].values())
+            if sampler.enabled
+            else None
+        )
+    finally:
+        sampler.stop()
+        if server is not None:
+            stop_server(server)
+
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_summary(report)
+    print(f"\nReport written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nRegressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF Master API load benchmark")
+    parser.add_argument("--url", help="benchmark a running server instead of starting one")
+    parser.add_argument("--server-pid", type=int, help="pid of --url server, for RSS")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--only", help="comma-separated scenarios (default: all)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20, help="per scenario")
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured requests first")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--image-size", type=parse_size, default=(1600, 1200))
+    parser.add_argument("--cache", action="store_true", help="keep the result cache on")
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="KEY=VALUE",
+        help="extra environment for the spawned server (repeatable)",
+    )
+    parser.add_argument("--output", help="report path (default: timestamped under /tmp)")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main_async(args)))
+
+
+if __name__ == "__main__":
+    main()
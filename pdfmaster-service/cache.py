@@ -0,0 +1,283 @@
+"""
+Content-addressed result cache.
+
+A result is keyed on the SHA-256 of every input (computed while the upload is
+spooled, see ingest.py) plus the operation name and its normalized
+parameters, so a resubmitted file is answered without touching pypdf or PIL.
+
+Two LRU tiers, both size-bounded:
+
+    CACHE_MEMORY_MB        small results kept in process memory (64)
+    CACHE_MEMORY_ITEM_KB   largest result eligible for the memory tier (1024)
+    CACHE_DISK_MB          results hard-linked under TEMP_DIR/cache (1024)
+
+The serving processes of server.py share the cache directory but each one
+evicts only the entries in its own index, so each gets CACHE_DISK_MB /
+SERVER_WORKERS of it. The directory is not counted against TEMP_DIR_QUOTA_MB
+(see scratch.py): the volume needs room for both.
+
+The cache key doubles as a strong ETag; If-None-Match short-circuits to 304.
+Streamed ZIP archives (split, to-jpg, image batches and variants) are teed to
+scratch while they are sent and stored once complete. Requests carrying
+passwords (protect/unlock) are never cached.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from fastapi.responses import Response
+
+import metrics
+from output import MemoryResponse, SendfileResponse, content_disposition
+from scratch import TEMP_DIR
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+CACHE_MEMORY_BYTES = int(os.environ.get("CACHE_MEMORY_MB", "64")) * MB
+CACHE_MEMORY_ITEM_BYTES = int(os.environ.get("CACHE_MEMORY_ITEM_KB", "1024")) * 1024
+# 各服务进程各自淘汰，按进程均分磁盘层（server.py 在导入前设置 SERVER_WORKERS）
+CACHE_DISK_BYTES = (
+    int(os.environ.get("CACHE_DISK_MB", "1024"))
+    * MB
+    // int(os.environ.get("SERVER_WORKERS") or 1)
+)
+
+
+def etag(key: str) -> str:
+    return f'"{key}"'
+
+
+def etag_matches(if_none_match: Optional[str], key: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag(key) in tags or f"W/{etag(key)}" in tags
+
+
+class ResultCache:
+    """Two-tier (memory + disk) LRU cache of finished responses."""
+
+    def __init__(
+        self,
+        directory: str,
+        memory_bytes: int = CACHE_MEMORY_BYTES,
+        memory_item_bytes: int = CACHE_MEMORY_ITEM_BYTES,
+        disk_bytes: int = CACHE_DISK_BYTES,
+    ):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.memory_item_bytes = memory_item_bytes
+        self.disk_bytes = disk_bytes
+
+        # key -> (meta, body)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._memory_used = 0
+        # key -> meta（含 size）
+        self._disk: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._disk_used = 0
+        self._lock = threading.Lock()
+
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = {"memory": 0, "disk": 0}
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    # ---------- 键 ----------
+
+    @staticmethod
+    def key(operation: str, digests: List[str], params: Dict[str, Any]) -> str:
+        material = json.dumps(
+            {"op": operation, "inputs": digests, "params": params},
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    # ---------- 读 ----------
+
+    def lookup(self, key: str, if_none_match: Optional[str] = None) -> Optional[Response]:
+        """Response for a cached result (or 304), None on a miss."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                meta, body = self._memory[key]
+                tier = "memory"
+            elif key in self._disk and os.path.exists(self._path(key)):
+                self._disk.move_to_end(key)
+                meta, body = self._disk[key], None
+                tier = "disk"
+            else:
+                meta = None
+        if meta is None:
+            # 可能是其他服务进程写入的结果：读取其 sidecar 并加入本进程索引
+            meta, body, tier = self._adopt(key), None, "disk"
+        with self._lock:
+            if meta is None:
+                self.misses += 1
+                metrics.cache_lookups.inc(result="miss")
+                return None
+            self.hits[tier] += 1
+        metrics.cache_lookups.inc(result=f"hit_{tier}")
+
+        headers = {**meta["headers"], "ETag": etag(key), "X-Cache": "HIT"}
+        if etag_matches(if_none_match, key):
+            self.not_modified += 1
+            metrics.cache_lookups.inc(result="not_modified")
+            return Response(status_code=304, headers={"ETag": etag(key)})
+
+        if body is not None:
+            if meta["filename"]:
+                headers["Content-Disposition"] = content_disposition(meta["filename"])
+            return MemoryResponse(body, media_type=meta["media_type"], headers=headers)
+
+        return SendfileResponse(
+            self._path(key),
+            filename=meta["filename"],
+            media_type=meta["media_type"],
+            headers=headers,
+        )
+
+    # ---------- 写 ----------
+
+    def store_file(
+        self,
+        key: str,
+        path: str,
+        media_type: str,
+        filename: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        """Add the result at path; blocking, run it in the io pool."""
+        size = os.path.getsize(path)
+        meta = {
+            "media_type": media_type,
+            "filename": filename,
+            "headers": headers or {},
+            "size": size,
+        }
+
+        if size <= self.memory_item_bytes:
+            with open(path, "rb") as f:
+                self._put_memory(key, meta, f.read())
+
+        if size <= self.disk_bytes:
+            target = self._path(key)
+            try:
+                # 同一文件系统上硬链接，零拷贝
+                os.link(path, target)
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copyfile(path, target)
+            with open(target + ".json", "w") as f:
+                json.dump(meta, f)
+            self._put_disk(key, meta)
+
+    def store_bytes(
+        self,
+        key: str,
+        body: bytes,
+        media_type: str,
+        headers: Optional[Dict[str, str]] = None,
+        filename: Optional[str] = None,
+    ):
+        """Add a small in-memory result (e.g. JSON or a thumbnail); memory tier only."""
+        meta = {
+            "media_type": media_type,
+            "filename": filename,
+            "headers": headers or {},
+            "size": len(body),
+        }
+        if len(body) <= self.memory_item_bytes:
+            self._put_memory(key, meta, body)
+
+    def _put_memory(self, key: str, meta: Dict[str, Any], body: bytes):
+        with self._lock:
+            if key in self._memory:
+                self._memory_used -= len(self._memory.pop(key)[1])
+            self._memory[key] = (meta, body)
+            self._memory_used += len(body)
+            while self._memory_used > self.memory_bytes and self._memory:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+                self.evictions["memory"] += 1
+
+    def _put_disk(self, key: str, meta: Dict[str, Any]):
+        evicted = []
+        with self._lock:
+            if key in self._disk:
+                self._disk_used -= self._disk.pop(key)["size"]
+            self._disk[key] = meta
+            self._disk_used += meta["size"]
+            while self._disk_used > self.disk_bytes and self._disk:
+                old_key, old_meta = self._disk.popitem(last=False)
+                self._disk_used -= old_meta["size"]
+                self.evictions["disk"] += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            for path in (self._path(old_key), self._path(old_key) + ".json"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    # ---------- 内部 ----------
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _adopt(self, key: str) -> Optional[Dict[str, Any]]:
+        if len(key) != 64 or not key.isalnum():
+            return None
+        try:
+            with open(self._path(key) + ".json") as f:
+                meta = json.load(f)
+            os.stat(self._path(key))
+        except (OSError, ValueError):
+            return None
+        self._put_disk(key, meta)
+        return meta
+
+    def _load_index(self):
+        """Rebuild the disk index from sidecar files left by earlier processes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[: -len(".json")]
+            try:
+                with open(self._path(name)) as f:
+                    meta = json.load(f)
+                mtime = os.path.getmtime(self._path(key))
+            except (OSError, ValueError):
+                continue
+            entries.append((mtime, key, meta))
+        for _, key, meta in sorted(entries):
+            self._disk[key] = meta
+            self._disk_used += meta["size"]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits["memory"] + self.hits["disk"] + self.misses
+        return {
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_ratio": round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+            "not_modified": self.not_modified,
+            "evictions": dict(self.evictions),
+            "memory": {"entries": len(self._memory), "bytes": self._memory_used},
+            "disk": {"entries": len(self._disk), "bytes": self._disk_used},
+        }
+
+
+result_cache = ResultCache(os.path.join(TEMP_DIR, "cache"))
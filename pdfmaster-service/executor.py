@@ -0,0 +1,306 @@
+"""
+Executor layer: runs blocking PDF/image transforms off the event loop.
+
+CPU-heavy work (pypdf, PIL, poppler, pdf2docx) goes to per-operation process
+pools so one uvicorn process can use every core; short blocking I/O goes to a
+thread pool. Each pool is sized independently via environment variables:
+
+    EXECUTOR_PDF_WORKERS      pypdf merge/split/compress/protect/unlock/info
+    EXECUTOR_IMAGE_WORKERS    PIL image handlers
+    EXECUTOR_RENDER_WORKERS   PDF -> image rasterization
+    EXECUTOR_OFFICE_WORKERS   PDF -> Word (pdf2docx)
+    EXECUTOR_FAST_WORKERS     cheap pypdf reads (info) kept apart from heavy
+                              conversions (default 1, see admission.py)
+    EXECUTOR_IO_WORKERS       thread pool for file I/O
+    EXECUTOR_MAX_TASKS_PER_CHILD  tasks before a pool process is replaced,
+                              bounding slow RSS growth in PIL / pdf2docx
+                              (default 500, 0 = never; not with fork)
+    EXECUTOR_START_METHOD     forkserver (default), spawn or fork
+
+With forkserver, pool processes are forked from a server process that has
+already imported pypdf, PIL, reportlab and the transform modules, so a new
+or replaced pool worker starts without re-importing them and the workers
+share those pages copy-on-write.
+
+Under the multi-process server (server.py, SERVER_WORKERS processes) the
+process pool defaults are divided between the serving processes so the
+total stays at about one worker per core.
+"""
+
+import asyncio
+import collections
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+
+import metrics
+import profiler
+
+logger = logging.getLogger(__name__)
+
+CPU_COUNT = os.cpu_count() or 1
+
+
+def _env_int(name: str, default: int, minimum: int = 1) -> int:
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return max(minimum, int(value))
+    except ValueError:
+        logger.warning(f"Invalid {name}={value!r}, using {default}")
+        return default
+
+
+# 每个服务进程分到的 CPU 数（server.py 在导入前设置 SERVER_WORKERS）
+CPU_SHARE = max(1, CPU_COUNT // _env_int("SERVER_WORKERS", 1))
+MAX_TASKS_PER_CHILD = _env_int("EXECUTOR_MAX_TASKS_PER_CHILD", 500, minimum=0)
+
+# forkserver 预先导入的模块（pdf2image / pdf2docx 较重且只有部分池用到，仍按需导入）
+FORKSERVER_PRELOAD = ["pdf_ops", "image_ops", "watermark"]
+
+# 操作名 -> (池类型, 默认 worker 数)
+POOL_SPECS = {
+    "pdf": ("process", CPU_SHARE),
+    "image": ("process", CPU_SHARE),
+    "render": ("process", max(1, CPU_SHARE // 2)),
+    "office": ("process", max(1, CPU_SHARE // 2)),
+    "fast": ("process", 1),
+    "io": ("thread", min(32, CPU_COUNT * 4)),
+}
+
+
+class _Pool:
+    """One named executor plus its in-flight bookkeeping."""
+
+    def __init__(self, name: str, kind: str, workers: int):
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def executor(self) -> Executor:
+        # 延迟创建，避免在 import 阶段 fork / spawn 子进程
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    method = os.environ.get("EXECUTOR_START_METHOD", "forkserver")
+                    context = multiprocessing.get_context(method)
+                    if method == "forkserver":
+                        context.set_forkserver_preload(FORKSERVER_PRELOAD)
+                    options = {}
+                    if MAX_TASKS_PER_CHILD and method != "fork":
+                        options["max_tasks_per_child"] = MAX_TASKS_PER_CHILD
+                    # 每个 worker 启动 profiler watcher，供 /admin/profile 采样
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=context,
+                        initializer=profiler.start_watcher,
+                        initargs=(self.name,),
+                        **options,
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix=f"pdfmaster-{self.name}",
+                    )
+                logger.info(
+                    f"Started {self.kind} pool '{self.name}' with {self.workers} workers"
+                )
+            return self._executor
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "running": min(self.in_flight, self.workers),
+            "queued": max(0, self.in_flight - self.workers),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def shutdown(self, wait: bool = False, executor: Optional[Executor] = None):
+        """Drop the executor; given executor, only if it is still the current one."""
+        with self._lock:
+            if self._executor is None or executor not in (None, self._executor):
+                return
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def kill(self):
+        """
+        Kill the pool's worker processes and drop the pool.
+
+        For a task stuck in a C call that no in-worker timeout can interrupt.
+        ProcessPoolExecutor cannot replace a single worker, so the other tasks
+        of this pool fail with BrokenProcessPool; the next call starts a new
+        pool. Thread pools cannot be interrupted and are left running.
+        """
+        with self._lock:
+            executor = self._executor
+            if self.kind != "process" or executor is None:
+                return
+            self._executor = None
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class WorkerPools:
+    """Registry of per-operation pools used by every endpoint."""
+
+    def __init__(self):
+        self._pools: Dict[str, _Pool] = {}
+        for name, (kind, default) in POOL_SPECS.items():
+            workers = _env_int(f"EXECUTOR_{name.upper()}_WORKERS", default)
+            self._pools[name] = _Pool(name, kind, workers)
+
+    async def run(self, operation: str, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) in the pool registered for operation.
+
+        Functions sent to a process pool must be module-level and their
+        arguments picklable.
+        """
+        pool = self._pools[operation]
+        loop = asyncio.get_running_loop()
+        pool.in_flight += 1
+        executor = None
+        try:
+            executor = pool.executor()
+            if pool.kind == "thread":
+                result = await loop.run_in_executor(
+                    executor, partial(fn, *args, **kwargs)
+                )
+            else:
+                # 进程池任务在 worker 内计时，报告随结果一起返回
+                submitted = time.time()
+                result, report = await loop.run_in_executor(
+                    executor,
+                    partial(metrics.run_reported, fn, *args, **kwargs),
+                )
+                metrics.record_task(operation, fn.__name__, submitted, report)
+            pool.completed += 1
+            return result
+        except BrokenProcessPool:
+            # worker 被杀（如 OOM），丢弃整个池，下次调用重新创建
+            pool.failed += 1
+            metrics.errors_total.inc(
+                route=metrics.current_route(), type="BrokenProcessPool"
+            )
+            logger.error(f"Process pool '{operation}' broken, recreating")
+            # 池可能已被 kill 并重新创建，只丢弃出错的那个
+            pool.shutdown(executor=executor)
+            raise
+        except Exception as e:
+            pool.failed += 1
+            metrics.errors_total.inc(route=metrics.current_route(), type=type(e).__name__)
+            raise
+        finally:
+            pool.in_flight -= 1
+
+    async def run_limited(
+        self, operation: str, seconds: Optional[float], fn: Callable, *args, **kwargs
+    ) -> Any:
+        """
+        Like run, but give up after seconds (None or 0: no limit).
+
+        On expiry the pool's workers are killed (see _Pool.kill) so a task
+        stuck in a C call does not hold a worker forever, and
+        asyncio.TimeoutError is raised.
+        """
+        if not seconds:
+            return await self.run(operation, fn, *args, **kwargs)
+        pool = self._pools[operation]
+        try:
+            return await asyncio.wait_for(
+                self.run(operation, fn, *args, **kwargs), seconds
+            )
+        except asyncio.TimeoutError:
+            pool.failed += 1
+            metrics.errors_total.inc(route=metrics.current_route(), type="TimeoutError")
+            logger.error(
+                f"{fn.__name__} exceeded {seconds}s in pool '{operation}', "
+                f"killing its workers"
+            )
+            pool.kill()
+            raise
+
+    def workers(self, operation: str) -> int:
+        return self._pools[operation].workers
+
+    def queue_depth(self) -> int:
+        return sum(p.stats()["queued"] for p in self._pools.values())
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats() for name, pool in self._pools.items()}
+
+    def shutdown(self, wait: bool = False):
+        """Stop every pool; wait=True joins the worker processes (process exit)."""
+        for pool in self._pools.values():
+            pool.shutdown(wait)
+
+
+async def pipeline(
+    calls: Iterable[Callable[[], Awaitable[Any]]], depth: int
+) -> AsyncIterator[Any]:
+    """
+    Run calls with at most depth in flight and yield their results in order.
+
+    Lets a producer (e.g. page batches in a process pool) run ahead of a
+    consumer streaming results to the client while memory stays bounded.
+    Closing the iterator cancels anything still pending.
+    """
+    pending = collections.deque()
+    calls = iter(calls)
+    try:
+        for call in calls:
+            pending.append(asyncio.ensure_future(call()))
+            if len(pending) >= depth:
+                break
+        while pending:
+            result = await pending.popleft()
+            call = next(calls, None)
+            if call is not None:
+                pending.append(asyncio.ensure_future(call()))
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def prime(results: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """
+    Await the first item of results before returning an equivalent iterator.
+
+    Errors from the first batch then surface while the HTTP status can still
+    change, instead of truncating an already-started streaming response.
+    """
+    try:
+        first = await results.__anext__()
+    except StopAsyncIteration:
+        first = None
+        empty = True
+    else:
+        empty = False
+
+    async def chained():
+        if not empty:
+            yield first
+        async for item in results:
+            yield item
+
+    return chained()
+
+
+pools = WorkerPools()
@@ -0,0 +1,557 @@
+"""
+Blocking image transforms.
+
+Like pdf_ops, these run inside executor pools, take scratch-file paths from
+ingest.py and must stay module-level with picklable arguments. Each encodes
+its result through a SpooledOutput (see output.py), in memory when small and
+under temp_dir otherwise, and returns a dict describing the output for the
+HTTP layer.
+
+    IMAGE_ENCODE_THREADS    threads per worker encoding variants (default 4;
+                            PIL releases the GIL while encoding)
+"""
+
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+import watermark
+from metrics import count, stage
+from output import SpooledOutput
+from pdf_ops import InvalidInputError
+
+OUTPUT_FORMATS = ["jpg", "jpeg", "png", "webp", "gif", "bmp", "tiff"]
+
+# 缩小时先整数倍 reduce 到目标尺寸的 REDUCING_GAP 倍，再做 LANCZOS 滤波；
+# JPEG 的 draft 解码也只缩到这个尺寸为止（与 PIL thumbnail 的默认值一致）
+REDUCING_GAP = 2.0
+
+IMAGE_ENCODE_THREADS = int(os.environ.get("IMAGE_ENCODE_THREADS", "4"))
+
+Size = Tuple[int, int]
+
+
+def _open_scaled(
+    input_path: str, fit: Optional[Callable[[Size], Size]] = None
+) -> Tuple[Image.Image, Size, Size]:
+    """
+    Open and decode input_path, timed as the parse stage.
+
+    fit maps the original size to the size the caller will downscale to. JPEGs
+    are then decoded at the smallest DCT scale (1/2, 1/4, 1/8) that still
+    covers REDUCING_GAP times that size, so a large photo bound for a
+    thumbnail is never decoded at full resolution. Returns the image, the
+    original size and the target size.
+    """
+    with stage("parse"):
+        image = Image.open(input_path)
+        original_size = image.size
+        target = fit(original_size) if fit else original_size
+        if image.format == "JPEG" and target != original_size:
+            image.draft(
+                image.mode,
+                (int(target[0] * REDUCING_GAP), int(target[1] * REDUCING_GAP)),
+            )
+        image.load()
+    count(pixels=image.width * image.height)
+    return image, original_size, target
+
+
+def _open_image(input_path: str) -> Image.Image:
+    """Open and decode input_path at full resolution."""
+    return _open_scaled(input_path)[0]
+
+
+def _flatten_alpha(image: Image.Image) -> Image.Image:
+    # 转换 RGBA 到 RGB（如果是 JPEG）
+    if image.mode in ("RGBA", "P"):
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(
+            image, mask=image.split()[-1] if image.mode == "RGBA" else None
+        )
+        return background
+    return image
+
+
+def _source_format_output(image: Image.Image, prefix: str, temp_dir: str):
+    """Output path, save kwargs and media type that keep the source format."""
+    output_id = str(uuid.uuid4())
+    ext = image.format.lower() if image.format else "jpg"
+    if ext == "jpeg":
+        ext = "jpg"
+    output_path = os.path.join(temp_dir, f"{prefix}_{output_id}.{ext}")
+
+    save_kwargs = {"format": image.format or "JPEG"}
+    if save_kwargs["format"] in ("JPEG", "WEBP"):
+        save_kwargs["quality"] = 95
+
+    media_type = (
+        f"image/{image.format.lower().replace('jpeg', 'jpg')}"
+        if image.format
+        else "image/jpeg"
+    )
+    return output_path, save_kwargs, media_type
+
+
+def _save(image: Image.Image, output_path: str, **save_kwargs) -> Dict[str, Any]:
+    """Encode image, timed as the encode stage; output_path is only written when large."""
+    output = SpooledOutput(output_path)
+    with stage("encode"):
+        image.save(output, **save_kwargs)
+    return output.result()
+
+
+def _fit_size(
+    size: Size,
+    width: Optional[int],
+    height: Optional[int],
+    maintain_aspect: bool = True,
+) -> Size:
+    original_width, original_height = size
+
+    # 计算新尺寸
+    new_width = width
+    new_height = height
+
+    if maintain_aspect:
+        if width and not height:
+            ratio = width / original_width
+            new_height = int(original_height * ratio)
+            new_width = width
+        elif height and not width:
+            ratio = height / original_height
+            new_width = int(original_width * ratio)
+            new_height = height
+        elif width and height:
+            # 保持比例，适应指定框
+            ratio = min(width / original_width, height / original_height)
+            new_width = int(original_width * ratio)
+            new_height = int(original_height * ratio)
+    else:
+        new_width = width or original_width
+        new_height = height or original_height
+
+    # 确保 new_width 和 new_height 不为 None
+    final_width = new_width if new_width is not None else original_width
+    final_height = new_height if new_height is not None else original_height
+    return final_width, final_height
+
+
+def _bounded_size(size: Size, max_dimension: Optional[int]) -> Size:
+    """size scaled down so its longer side is at most max_dimension."""
+    if not max_dimension or max(size) <= max_dimension:
+        return size
+    ratio = max_dimension / max(size)
+    return max(1, round(size[0] * ratio)), max(1, round(size[1] * ratio))
+
+
+def _resize(image: Image.Image, size: Size) -> Image.Image:
+    if image.size == size:
+        return image
+    return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def _rotate(image: Image.Image, angle: int) -> Image.Image:
+    if angle == 90:
+        return image.rotate(-90, expand=True)
+    elif angle == 180:
+        return image.rotate(-180, expand=True)
+    elif angle == 270:
+        return image.rotate(-270, expand=True)
+    return image.rotate(-angle, expand=True)
+
+
+def _crop(
+    image: Image.Image, x: int, y: int, width: Optional[int], height: Optional[int]
+) -> Image.Image:
+    img_width, img_height = image.size
+    crop_width = width or img_width
+    crop_height = height or img_height
+
+    box = (x, y, x + crop_width, y + crop_height)
+    return image.crop(box)
+
+
+def compress_image(
+    input_path: str,
+    quality: int,
+    format: Optional[str],
+    temp_dir: str,
+    max_dimension: Optional[int] = None,
+) -> Dict[str, Any]:
+    image, original_size, size = _open_scaled(
+        input_path, lambda size: _bounded_size(size, max_dimension)
+    )
+    source_format = image.format
+    image = _resize(image, size)
+
+    # 确定输出格式 - 默认转为JPEG以获得更好的压缩效果
+    if format:
+        output_format = format.upper()
+    else:
+        # 如果原图是PNG且需要压缩，转为JPEG以获得更好的压缩率
+        original_format = (source_format or "JPEG").upper()
+        if original_format == "PNG":
+            output_format = "JPEG"  # PNG转为JPEG以支持质量压缩
+        else:
+            output_format = original_format
+
+    if output_format == "JPG":
+        output_format = "JPEG"
+
+    if output_format == "JPEG":
+        image = _flatten_alpha(image)
+
+    # 压缩并保存
+    output_id = str(uuid.uuid4())
+    ext = output_format.lower().replace("jpeg", "jpg")
+    output_path = os.path.join(temp_dir, f"compressed_{output_id}.{ext}")
+
+    save_kwargs = {"format": output_format}
+    if output_format in ("JPEG", "WEBP"):
+        save_kwargs["quality"] = quality
+        save_kwargs["optimize"] = True
+    elif output_format == "PNG":
+        save_kwargs["optimize"] = True
+
+    return {
+        **_save(image, output_path, **save_kwargs),
+        "ext": ext,
+        "media_type": f"image/{output_format.lower().replace('jpeg', 'jpg')}",
+        "original_width": original_size[0],
+        "original_height": original_size[1],
+        "width": image.width,
+        "height": image.height,
+    }
+
+
+def resize_image(
+    input_path: str,
+    width: Optional[int],
+    height: Optional[int],
+    maintain_aspect: bool,
+    temp_dir: str,
+) -> Dict[str, Any]:
+    image, (original_width, original_height), size = _open_scaled(
+        input_path, lambda size: _fit_size(size, width, height, maintain_aspect)
+    )
+    resized_image = _resize(image, size)
+    final_width, final_height = size
+
+    output_path, save_kwargs, media_type = _source_format_output(
+        image, "resized", temp_dir
+    )
+    return {
+        **_save(resized_image, output_path, **save_kwargs),
+        "media_type": media_type,
+        "original_width": original_width,
+        "original_height": original_height,
+        "width": final_width,
+        "height": final_height,
+    }
+
+
+def convert_image(input_path: str, target_format: str, temp_dir: str) -> Dict[str, Any]:
+    image = _open_image(input_path)
+
+    # 处理格式转换
+    output_format = target_format.upper()
+    if output_format == "JPG":
+        output_format = "JPEG"
+
+    if output_format == "JPEG":
+        image = _flatten_alpha(image)
+
+    output_id = str(uuid.uuid4())
+    ext = target_format.replace("jpeg", "jpg")
+    output_path = os.path.join(temp_dir, f"converted_{output_id}.{ext}")
+
+    save_kwargs = {"format": output_format}
+    if output_format in ("JPEG", "WEBP"):
+        save_kwargs["quality"] = 95
+        save_kwargs["optimize"] = True
+
+    return {
+        **_save(image, output_path, **save_kwargs),
+        "ext": ext,
+        "media_type": f"image/{target_format.replace('jpg', 'jpeg')}",
+    }
+
+
+def rotate_image(input_path: str, angle: int, temp_dir: str) -> Dict[str, Any]:
+    image = _open_image(input_path)
+    rotated = _rotate(image, angle)
+
+    output_path, save_kwargs, media_type = _source_format_output(
+        image, "rotated", temp_dir
+    )
+    return {**_save(rotated, output_path, **save_kwargs), "media_type": media_type}
+
+
+def crop_image(
+    input_path: str,
+    x: int,
+    y: int,
+    width: Optional[int],
+    height: Optional[int],
+    temp_dir: str,
+) -> Dict[str, Any]:
+    image = _open_image(input_path)
+    cropped = _crop(image, x, y, width, height)
+
+    output_path, save_kwargs, media_type = _source_format_output(
+        image, "cropped", temp_dir
+    )
+    return {**_save(cropped, output_path, **save_kwargs), "media_type": media_type}
+
+
+def watermark_image(
+    input_path: str, options: Dict[str, Any], temp_dir: str
+) -> Dict[str, Any]:
+    """Watermark with the shared engine (text or logo, see watermark.py)."""
+    image = _open_image(input_path)
+    watermarked = watermark.apply(image, options)
+
+    output_path, save_kwargs, media_type = _source_format_output(
+        image, "watermarked", temp_dir
+    )
+    if save_kwargs["format"] == "JPEG":
+        watermarked = _flatten_alpha(watermarked)
+    return {**_save(watermarked, output_path, **save_kwargs), "media_type": media_type}
+
+
+# ---------- 链式处理：一次解码、多步操作、一次编码 ----------
+
+# 操作名 -> 允许的参数及类型；convert / compress 只决定最终编码
+PIPELINE_OPERATIONS = {
+    "resize": {"width": int, "height": int, "maintain_aspect": bool},
+    "crop": {"x": int, "y": int, "width": int, "height": int},
+    "rotate": {"angle": int},
+    "watermark": {
+        "text": str,
+        "position": str,
+        "opacity": float,
+        "scale": float,
+        "angle": int,
+        "color": str,
+    },
+    "convert": {"format": str},
+    "compress": {"quality": int, "format": str},
+}
+ENCODE_OPERATIONS = ("convert", "compress")
+MAX_PIPELINE_STEPS = 32
+
+
+def parse_pipeline(spec: str) -> List[Dict[str, Any]]:
+    """Validate a JSON list of {"op": name, **params} steps."""
+    try:
+        steps = json.loads(spec)
+    except ValueError:
+        raise InvalidInputError("Operations must be a JSON list")
+    if not isinstance(steps, list) or not steps:
+        raise InvalidInputError("Operations must be a non-empty JSON list")
+    if len(steps) > MAX_PIPELINE_STEPS:
+        raise InvalidInputError(f"At most {MAX_PIPELINE_STEPS} operations allowed")
+
+    for number, step in enumerate(steps, 1):
+        op = step.get("op") if isinstance(step, dict) else None
+        if op not in PIPELINE_OPERATIONS:
+            raise InvalidInputError(
+                f"Step {number}: op must be one of {', '.join(PIPELINE_OPERATIONS)}"
+            )
+        params = PIPELINE_OPERATIONS[op]
+        for name, value in step.items():
+            if name == "op" or value is None:
+                continue
+            kind = params.get(name)
+            if kind is None:
+                raise InvalidInputError(f"Step {number}: unknown parameter '{name}' for {op}")
+            # bool 是 int 的子类，单独排除；float 参数也接受整数
+            accepted = (int, float) if kind is float else kind
+            if not isinstance(value, accepted) or (
+                kind is not bool and isinstance(value, bool)
+            ):
+                raise InvalidInputError(f"Step {number}: '{name}' must be {kind.__name__}")
+
+        if op == "resize" and not (step.get("width") or step.get("height")):
+            raise InvalidInputError(f"Step {number}: resize needs width or height")
+        if any((step.get(name) or 0) < 0 for name in ("x", "y", "width", "height")):
+            raise InvalidInputError(f"Step {number}: sizes and offsets must be positive")
+        if step.get("format") and step["format"].lower() not in OUTPUT_FORMATS:
+            raise InvalidInputError(
+                f"Step {number}: format must be one of {', '.join(OUTPUT_FORMATS)}"
+            )
+        if step.get("quality") is not None and not 1 <= step["quality"] <= 100:
+            raise InvalidInputError(f"Step {number}: quality must be 1-100")
+        if op == "watermark":
+            try:
+                watermark.check_options(step)
+            except ValueError as e:
+                raise InvalidInputError(f"Step {number}: {e}")
+
+    return steps
+
+
+def _apply_steps(input_path: str, steps: List[Dict[str, Any]]):
+    """Decode once and apply every step in memory, return the image and save settings."""
+    # 第一步变换是缩小时，按其目标尺寸做降采样解码
+    first = next((step for step in steps if step["op"] not in ENCODE_OPERATIONS), None)
+    fit = None
+    if first is not None and first["op"] == "resize":
+        fit = partial(
+            _fit_size,
+            width=first.get("width"),
+            height=first.get("height"),
+            maintain_aspect=first.get("maintain_aspect", True),
+        )
+    image, original_size, first_size = _open_scaled(input_path, fit)
+    output_format = image.format or "JPEG"
+    quality = None
+
+    for step in steps:
+        op = step["op"]
+        if op == "resize":
+            # draft 解码后图像已变小，首步尺寸须按原图计算
+            if step is first:
+                size = first_size
+            else:
+                size = _fit_size(
+                    image.size,
+                    step.get("width"),
+                    step.get("height"),
+                    step.get("maintain_aspect", True),
+                )
+            image = _resize(image, size)
+        elif op == "crop":
+            image = _crop(
+                image, step.get("x", 0), step.get("y", 0), step.get("width"), step.get("height")
+            )
+        elif op == "rotate":
+            image = _rotate(image, step.get("angle", 90))
+        elif op == "watermark":
+            image = watermark.apply(image, step)
+        else:
+            output_format = step.get("format") or output_format
+            quality = step.get("quality", quality)
+
+    output_format = output_format.upper().replace("JPG", "JPEG")
+    if output_format == "JPEG":
+        image = _flatten_alpha(image)
+        if image.mode not in ("RGB", "L", "CMYK"):
+            image = image.convert("RGB")
+
+    # 只在最后编码一次；未指定 compress 时与单步接口一致（q95）
+    save_kwargs = {"format": output_format}
+    if output_format in ("JPEG", "WEBP"):
+        save_kwargs["quality"] = quality or 95
+    if quality is not None and output_format in ("JPEG", "WEBP", "PNG"):
+        save_kwargs["optimize"] = True
+
+    ext = output_format.lower().replace("jpeg", "jpg")
+    output = {
+        "ext": ext,
+        "media_type": Image.MIME.get(output_format, f"image/{ext}"),
+        "original_width": original_size[0],
+        "original_height": original_size[1],
+        "width": image.width,
+        "height": image.height,
+    }
+    return image, save_kwargs, output
+
+
+def run_pipeline(
+    input_path: str, steps: List[Dict[str, Any]], temp_dir: str
+) -> Dict[str, Any]:
+    image, save_kwargs, output = _apply_steps(input_path, steps)
+
+    output_path = os.path.join(temp_dir, f"pipeline_{uuid.uuid4()}.{output['ext']}")
+    return {**output, **_save(image, output_path, **save_kwargs)}
+
+
+def pipeline_entries(
+    input_path: str, steps: List[Dict[str, Any]], name: str
+) -> List[Tuple[str, bytes]]:
+    """run_pipeline for batch mode: the result as a single in-memory ZIP entry."""
+    image, save_kwargs, output = _apply_steps(input_path, steps)
+
+    buffer = BytesIO()
+    with stage("encode"):
+        image.save(buffer, **save_kwargs)
+
+    return [(f"{name}.{output['ext']}", buffer.getvalue())]
+
+
+# ---------- 多尺寸响应式图片 ----------
+
+VARIANT_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP", "png": "PNG"}
+
+
+def _encode(image: Image.Image, format: str, quality: int) -> bytes:
+    if format == "JPEG":
+        image = _flatten_alpha(image)
+    save_kwargs = {"format": format, "optimize": True}
+    if format in ("JPEG", "WEBP"):
+        save_kwargs["quality"] = quality
+    buffer = BytesIO()
+    image.save(buffer, **save_kwargs)
+    return buffer.getvalue()
+
+
+def image_variants(
+    input_path: str, widths: List[int], formats: List[str], quality: int, name: str
+) -> List[Tuple[str, bytes]]:
+    """
+    Responsive variants of one image as ZIP entries, plus a manifest.json.
+
+    The source is decoded once (draft-scaled for the largest width), each
+    width is resized from the next larger variant rather than the original,
+    and all width x format encodes run on IMAGE_ENCODE_THREADS threads.
+    Widths above the source width are clamped to it, never upscaled.
+    """
+    image, original_size, _ = _open_scaled(
+        input_path, lambda size: _fit_size(size, min(max(widths), size[0]), None)
+    )
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert(
+            "RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB"
+        )
+
+    # 从大到小逐级缩放，每级以上一级为源
+    variants = []
+    current = image
+    for width in sorted({min(width, original_size[0]) for width in widths}, reverse=True):
+        current = _resize(current, _fit_size(original_size, width, None))
+        variants.append(current)
+
+    exts = dict.fromkeys(format.replace("jpeg", "jpg") for format in formats)
+    jobs = [
+        (variant, VARIANT_FORMATS[ext], ext) for variant in variants for ext in exts
+    ]
+    with stage("encode"), ThreadPoolExecutor(
+        max_workers=max(1, min(IMAGE_ENCODE_THREADS, len(jobs)))
+    ) as executor:
+        encoded = list(
+            executor.map(lambda job: _encode(job[0], job[1], quality), jobs)
+        )
+
+    entries, manifest = [], []
+    for (variant, _, ext), data in zip(jobs, encoded):
+        entry = f"{name}-{variant.width}w.{ext}"
+        entries.append((entry, data))
+        manifest.append(
+            {
+                "name": entry,
+                "width": variant.width,
+                "height": variant.height,
+                "format": ext,
+                "size": len(data),
+            }
+        )
+    entries.append(("manifest.json", json.dumps(manifest, indent=2).encode()))
+    return entries
@@ -0,0 +1,367 @@
+"""
+Memory-bounded upload ingestion.
+
+Uploads are copied chunk by chunk into scratch files under TEMP_DIR and the
+transforms open those files instead of receiving the whole payload as bytes.
+Limits are enforced while the body streams in:
+
+    MAX_UPLOAD_FILE_MB      per uploaded file (default 200)
+    MAX_UPLOAD_REQUEST_MB   per request body, all files together (default 500)
+
+An oversized request is rejected with 413 from its Content-Length header, or
+as soon as the streamed body crosses the limit, before it is fully received.
+Multipart bodies are parsed as they stream in (SpoolingRoute): each file part
+is written once, straight into its scratch file, and a part crossing the
+per-file limit is rejected with 413 at that point.
+Inputs referenced by object key (see storage.py) are fetched into the same
+scratch files, under the per-file limit; completed resumable uploads (see
+uploads.py) are hard-linked in.
+"""
+
+import hashlib
+import logging
+import mimetypes
+import os
+import shutil
+import time
+import uuid
+from typing import Callable, Dict, List
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from multipart.multipart import parse_options_header
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+import metrics
+from executor import pools
+from scratch import TEMP_DIR, scratch
+from uploads import UploadedInput
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+CHUNK_SIZE = 1 * MB
+
+MAX_UPLOAD_FILE_BYTES = int(os.environ.get("MAX_UPLOAD_FILE_MB", "200")) * MB
+MAX_UPLOAD_REQUEST_BYTES = int(os.environ.get("MAX_UPLOAD_REQUEST_MB", "500")) * MB
+
+
+def _too_large(limit: int, what: str) -> HTTPException:
+    return HTTPException(
+        status_code=413, detail=f"{what} exceeds the {limit // MB} MB limit"
+    )
+
+
+def _write_chunk(out, digest, chunk: bytes):
+    # hashlib 处理大块数据时释放 GIL，与写盘一起放在 io 线程
+    digest.update(chunk)
+    out.write(chunk)
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link(source: str, path: str):
+    # 同一文件系统上硬链接，零拷贝；上传本身保留，可供后续请求再用
+    try:
+        os.link(source, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except OSError:
+        shutil.copyfile(source, path)
+        return
+    # 链接沿用上传完成时的 mtime，刷新它以免被 TTL 清理提前删除
+    os.utime(path)
+
+
+class SpooledPart:
+    """
+    File of one multipart upload part, written straight into TEMP_DIR.
+
+    Deleted on close unless the request's UploadSpool kept it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self.kept = False
+        self._file = open(path, "w+b")
+
+    def write(self, data: bytes) -> int:
+        # UploadFile 在线程池中调用，哈希与写盘都不占用事件循环
+        self.digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def keep(self, path: str):
+        """Close the part and move it to path, which the caller now owns."""
+        self._file.close()
+        shutil.move(self.path, path)
+        self.path = path
+        self.kept = True
+
+    def close(self):
+        self._file.close()
+        if not self.kept:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class SpoolingMultiPartParser(MultiPartParser):
+    """Starlette's multipart parser, with file parts spooled to TEMP_DIR and capped."""
+
+    def __init__(
+        self,
+        *args,
+        directory: str = TEMP_DIR,
+        max_file_bytes: int = MAX_UPLOAD_FILE_BYTES,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self._parts: List[SpooledPart] = []
+        self._part_bytes = 0
+
+    def on_headers_finished(self):
+        super().on_headers_finished()
+        upload = self._current_part.file
+        if upload is not None:
+            # 父类建的 SpooledTemporaryFile 还没写入，换成 TEMP_DIR 下的文件
+            upload.file.close()
+            upload.file = SpooledPart(
+                os.path.join(self.directory, f"upload_{uuid.uuid4()}.part")
+            )
+            self._parts.append(upload.file)
+            self._part_bytes = 0
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        upload = self._current_part.file
+        if upload is not None:
+            self._part_bytes += end - start
+            if self._part_bytes > self.max_file_bytes:
+                raise _too_large(self.max_file_bytes, f"File {upload.filename}")
+        super().on_part_data(data, start, end)
+
+    async def parse(self):
+        try:
+            return await super().parse()
+        except BaseException:
+            for part in self._parts:
+                part.close()
+            raise
+
+
+class SpoolingRequest(Request):
+    """Request whose multipart form is parsed by SpoolingMultiPartParser."""
+
+    async def _get_form(self, *, max_files=1000, max_fields=1000):
+        if self._form is None:
+            content_type, _ = parse_options_header(self.headers.get("Content-Type"))
+            if content_type == b"multipart/form-data":
+                # 接收 body 之前先检查临时目录配额
+                scratch.ensure_capacity()
+                started = time.perf_counter()
+                parser = SpoolingMultiPartParser(
+                    self.headers,
+                    self.stream(),
+                    max_files=max_files,
+                    max_fields=max_fields,
+                )
+                try:
+                    self._form = await parser.parse()
+                except MultiPartException as exc:
+                    raise HTTPException(status_code=400, detail=exc.message)
+                metrics.observe_stage("upload", time.perf_counter() - started)
+        return await super()._get_form(max_files=max_files, max_fields=max_fields)
+
+
+class SpoolingRoute(APIRoute):
+    """Route class (app.router.route_class) handing endpoints a SpoolingRequest."""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def spooling_handler(request: Request):
+            return await handler(SpoolingRequest(request.scope, request.receive))
+
+        return spooling_handler
+
+
+class StoredObject:
+    """An input referenced by object key, accepted wherever an upload is."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.filename = os.path.basename(key)
+        self.content_type = mimetypes.guess_type(self.filename)[0]
+
+
+class UploadSpool:
+    """
+    Scratch files for the uploads of one request.
+
+    Use as an async context manager; every spooled file is deleted on exit.
+    """
+
+    def __init__(self, directory: str, max_file_bytes: int = MAX_UPLOAD_FILE_BYTES):
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        self.paths: List[str] = []
+        self.digests: Dict[str, str] = {}
+        self.sizes: Dict[str, int] = {}
+
+    async def __aenter__(self) -> "UploadSpool":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.cleanup()
+
+    async def add(self, file: UploadFile, suffix: str = "") -> str:
+        """Take over a spooled upload (or copy file chunk by chunk), return its path."""
+        if isinstance(file, StoredObject):
+            return await self.add_object(file.key, suffix)
+        if isinstance(file, UploadedInput):
+            return await self.add_upload(file, suffix)
+        if not suffix and file.filename:
+            suffix = os.path.splitext(file.filename)[1].lower()
+        path = os.path.join(self.directory, f"upload_{uuid.uuid4()}{suffix}")
+        if isinstance(file.file, SpooledPart):
+            # 解析 body 时已写入 TEMP_DIR，改名即可
+            part = file.file
+            await pools.run("io", part.keep, path)
+            self.paths.append(path)
+            self.digests[path] = part.digest.hexdigest()
+            self.sizes[path] = part.size
+            return path
+        self.paths.append(path)
+
+        started = time.perf_counter()
+        size = 0
+        digest = hashlib.sha256()
+        with open(path, "wb") as out:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_file_bytes:
+                    raise _too_large(self.max_file_bytes, f"File {file.filename}")
+                await pools.run("io", _write_chunk, out, digest, chunk)
+
+        await file.close()
+        self.digests[path] = digest.hexdigest()
+        self.sizes[path] = size
+        metrics.observe_stage("upload", time.perf_counter() - started)
+        return path
+
+    async def add_object(self, key: str, suffix: str = "") -> str:
+        """Fetch an object from storage into a scratch file and return its path."""
+        from storage import object_storage
+
+        object_storage.check_input_key(key)
+        suffix = suffix or os.path.splitext(key)[1].lower()
+        path = os.path.join(self.directory, f"upload_{uuid.uuid4()}{suffix}")
+        self.paths.append(path)
+
+        started = time.perf_counter()
+        size = await pools.run(
+            "io", object_storage.download, key, path, self.max_file_bytes
+        )
+        self.digests[path] = await pools.run("io", _file_digest, path)
+        self.sizes[path] = size
+        metrics.observe_stage("upload", time.perf_counter() - started)
+        return path
+
+    async def add_upload(self, upload: UploadedInput, suffix: str = "") -> str:
+        """Link a completed resumable upload into the spool and return its path."""
+        if upload.size > self.max_file_bytes:
+            raise _too_large(self.max_file_bytes, f"File {upload.filename}")
+        suffix = suffix or os.path.splitext(upload.filename)[1].lower()
+        path = os.path.join(self.directory, f"upload_{uuid.uuid4()}{suffix}")
+        await pools.run("io", _link, upload.path, path)
+        self.paths.append(path)
+        self.digests[path] = upload.digest
+        self.sizes[path] = upload.size
+        return path
+
+    def digest(self, path: str) -> str:
+        """SHA-256 of a spooled upload, computed while it was copied."""
+        return self.digests[path]
+
+    def total_bytes(self) -> int:
+        """Size of every file spooled for this request."""
+        return sum(self.sizes.values())
+
+    def detach(self, path: str):
+        """Hand path over to the caller; it will no longer be deleted on exit."""
+        self.paths.remove(path)
+
+    def release(self) -> List[str]:
+        """Hand every spooled file over to the caller (e.g. a queued job)."""
+        paths = list(self.paths)
+        self.paths.clear()
+        return paths
+
+    def cleanup(self):
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove upload {path}: {str(e)}")
+        self.paths.clear()
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware capping the size of request bodies while they stream."""
+
+    def __init__(self, app, max_request_bytes: int = MAX_UPLOAD_REQUEST_BYTES):
+        self.app = app
+        self.max_request_bytes = max_request_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit():
+            if int(content_length) > self.max_request_bytes:
+                error = _too_large(self.max_request_bytes, "Request body")
+                response = JSONResponse(
+                    status_code=error.status_code, content={"detail": error.detail}
+                )
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_request_bytes:
+                    # 在 body 解析阶段抛出，FastAPI 会原样返回 413
+                    raise _too_large(self.max_request_bytes, "Request body")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,420 @@
+"""
+Asynchronous job queue for long-running conversions.
+
+Heavy endpoints (merge, split, compress, to-jpg, to-word) accept ?async=true:
+the upload is spooled, a job is queued and 202 is returned at once with the
+job id. Clients poll GET /api/v1/jobs/{id} for status and progress, download
+GET /api/v1/jobs/{id}/result when it has succeeded, and DELETE the job to
+cancel it or discard its result. A result already in the result cache is
+still answered directly with 200.
+
+Settings (environment):
+
+    JOB_WORKERS              jobs running concurrently (default 2)
+    JOB_MAX_QUEUED           queued jobs before new ones are refused (100)
+    JOB_RESULT_TTL_SECONDS   how long finished jobs and results are kept
+                             (default TEMP_FILE_TTL_SECONDS; results are moved
+                             to TEMP_DIR/jobs, which the scratch sweeper skips,
+                             so it may be longer)
+    JOB_DRAIN_SECONDS        how long shutdown waits for queued and running
+                             jobs before cancelling them (default 30)
+
+Jobs are dequeued by priority (high, normal, low), FIFO within a priority.
+The transforms themselves still run in the executor pools, so job workers
+only bound how many conversions are in flight at once.
+
+A job runs in the serving process that accepted it. Its state is mirrored to
+TEMP_DIR/jobs/{id}.json so that any process of a multi-process server (see
+server.py) can answer status and result requests; a cancel arriving at
+another process leaves a {id}.cancel marker the owner picks up.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from fastapi import HTTPException
+
+from executor import pools
+from pdf_ops import InvalidInputError
+from scratch import TEMP_DIR, TEMP_FILE_TTL_SECONDS, scratch
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", "100"))
+JOB_RESULT_TTL_SECONDS = int(
+    os.environ.get("JOB_RESULT_TTL_SECONDS", str(TEMP_FILE_TTL_SECONDS))
+)
+JOB_DRAIN_SECONDS = float(os.environ.get("JOB_DRAIN_SECONDS", "30"))
+JOB_STATE_DIR = os.path.join(TEMP_DIR, "jobs")
+
+# 进度写入共享状态文件的最短间隔
+STATE_SAVE_INTERVAL = 1.0
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class Job:
+    """
+    One queued conversion.
+
+    run is an async callable taking the job (for progress reports) and
+    returning {"path", "media_type", "filename", "headers"}; inputs are the
+    scratch files the job owns and deletes once it has finished.
+    """
+
+    def __init__(
+        self,
+        operation: str,
+        run: Callable[["Job"], Awaitable[Dict[str, Any]]],
+        inputs: List[str],
+        priority: str,
+        save: Optional[Callable[["Job"], None]] = None,
+    ):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.priority = priority
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.error: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        self._run = run
+        self._inputs = inputs
+        self._task: Optional[asyncio.Task] = None
+        self._save = save
+        self._saved_at = 0.0
+
+    def progress(self, done: int, total: int):
+        """Report progress in whatever unit the operation counts (pages, batches)."""
+        self.done = done
+        self.total = total
+        if self._save and time.monotonic() - self._saved_at >= STATE_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        if self._save:
+            self._saved_at = time.monotonic()
+            self._save(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.status == SUCCEEDED:
+            fraction = 1.0
+        elif self.total:
+            fraction = round(self.done / self.total, 3)
+        else:
+            fraction = 0.0
+        info = {
+            "id": self.id,
+            "operation": self.operation,
+            "status": self.status,
+            "priority": self.priority,
+            "progress": {"done": self.done, "total": self.total, "fraction": fraction},
+            "created_at": _iso(self.created_at),
+            "started_at": _iso(self.started_at),
+            "finished_at": _iso(self.finished_at),
+        }
+        if self.error:
+            info["error"] = self.error
+        if self.status == SUCCEEDED:
+            info["result_url"] = f"/api/v1/jobs/{self.id}/result"
+        return info
+
+
+class JobSnapshot:
+    """Read-only view of a job owned by another serving process."""
+
+    def __init__(self, state: Dict[str, Any]):
+        self.id = state["id"]
+        self.status = state["status"]
+        self.result = state.get("result")
+        self.owner = state.get("owner")
+        self._info = {k: v for k, v in state.items() if k not in ("result", "owner")}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._info)
+
+
+def _alive(pid: Optional[int]) -> bool:
+    try:
+        os.kill(pid, 0)
+    except (TypeError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """Bounded priority queue of jobs drained by a fixed set of worker tasks."""
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        max_queued: int = JOB_MAX_QUEUED,
+        result_ttl: int = JOB_RESULT_TTL_SECONDS,
+    ):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+
+        self._jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self.counts = {SUCCEEDED: 0, FAILED: 0, CANCELLED: 0, "rejected": 0}
+
+        os.makedirs(JOB_STATE_DIR, exist_ok=True)
+
+    # ---------- 共享状态 ----------
+
+    @staticmethod
+    def _state_path(job_id: str, suffix: str = ".json") -> str:
+        return os.path.join(JOB_STATE_DIR, job_id + suffix)
+
+    def _save(self, job: Job):
+        state = {**job.to_dict(), "result": job.result, "owner": os.getpid()}
+        path = self._state_path(job.id)
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(state, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not save state of job {job.id}: {str(e)}")
+
+    def _load(self, job_id: str) -> Optional[JobSnapshot]:
+        # job id 来自 URL，只接受 uuid hex，避免路径穿越
+        if len(job_id) != 32 or not job_id.isalnum():
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return JobSnapshot(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _keep(self, job: Job, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Move a result out of reach of the scratch sweeper, for result_ttl."""
+        path = self._state_path(job.id, ".result")
+        shutil.move(result["path"], path)
+        return {**result, "path": path}
+
+    def _forget(self, job_id: str):
+        for suffix in (".json", ".cancel", ".result"):
+            try:
+                os.remove(self._state_path(job_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    # ---------- 提交 / 查询 ----------
+
+    def submit(
+        self,
+        operation: str,
+        run: Callable[[Job], Awaitable[Dict[str, Any]]],
+        inputs: List[str],
+        priority: str = "normal",
+    ) -> Job:
+        if self.queued() >= self.max_queued:
+            scratch.remove(*inputs)
+            self.counts["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Job queue is full, please retry shortly",
+                headers={"Retry-After": "30"},
+            )
+
+        job = Job(operation, run, inputs, priority, self._save)
+        self._jobs[job.id] = job
+        job.save()
+        self._queue.put_nowait((PRIORITIES[priority], next(self._seq), job))
+        logger.info(f"Queued job {job.id}: {operation}, priority {priority}")
+        return job
+
+    def get(self, job_id: str) -> Union[Job, JobSnapshot]:
+        job = self._jobs.get(job_id) or self._load(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    def cancel(self, job_id: str) -> Union[Job, JobSnapshot]:
+        """Cancel a queued or running job; a finished job is discarded with its result."""
+        job = self.get(job_id)
+        if isinstance(job, JobSnapshot):
+            if job.status in FINISHED:
+                self._discard(job)
+            else:
+                # 由所属进程在下一次检查时取消
+                with open(self._state_path(job.id, ".cancel"), "w"):
+                    pass
+            return job
+        if job.status == QUEUED:
+            # 仍在队列中，worker 取出时跳过
+            self._finish(job, CANCELLED)
+        elif job.status == RUNNING:
+            job._task.cancel()
+        else:
+            self._discard(job)
+        return job
+
+    def queued(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    # ---------- 执行 ----------
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.status != QUEUED:
+                continue
+
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.save()
+            job._task = asyncio.get_running_loop().create_task(job._run(job))
+            # 等待而不直接 await，取消单个任务不会打断 worker 循环
+            await asyncio.wait([job._task])
+
+            if job._task.cancelled():
+                self._finish(job, CANCELLED)
+                continue
+            error = job._task.exception()
+            if error is None:
+                try:
+                    job.result = self._keep(job, job._task.result())
+                except OSError as e:
+                    error = e
+            if error is None:
+                self._finish(job, SUCCEEDED)
+            elif isinstance(error, InvalidInputError):
+                self._finish(job, FAILED, str(error))
+            elif isinstance(error, HTTPException):
+                self._finish(job, FAILED, str(error.detail))
+            else:
+                logger.error(f"Job {job.id} ({job.operation}) failed: {str(error)}")
+                self._finish(job, FAILED, f"Internal server error: {str(error)}")
+
+    def _finish(self, job: Job, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        job._task = None
+        self.counts[status] += 1
+        scratch.remove(*job._inputs)
+        job._inputs = []
+        job.save()
+        logger.info(
+            f"Job {job.id} {status} after {job.finished_at - job.created_at:.1f}s"
+        )
+
+    def _discard(self, job: Union[Job, JobSnapshot]):
+        self._jobs.pop(job.id, None)
+        self._forget(job.id)
+        if job.result:
+            scratch.remove(job.result["path"])
+            job.result = None
+
+    async def _expire_forever(self):
+        while True:
+            await asyncio.sleep(min(60, self.result_ttl))
+            cutoff = time.time() - self.result_ttl
+            for job in list(self._jobs.values()):
+                if job.status in FINISHED and job.finished_at < cutoff:
+                    self._discard(job)
+            await pools.run("io", self._expire_orphans, cutoff)
+
+    def _expire_orphans(self, cutoff: float):
+        """Remove stale state left by processes that exited (recycled or crashed)."""
+        with os.scandir(JOB_STATE_DIR) as entries:
+            for entry in entries:
+                job_id = entry.name.split(".")[0]
+                if job_id in self._jobs:
+                    continue
+                try:
+                    if entry.stat().st_mtime >= cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                job = self._load(job_id)
+                if job is None or job.status in FINISHED or not _alive(job.owner):
+                    self._forget(job_id)
+
+    async def _watch_forever(self):
+        # 处理其他进程转交的取消请求，以及在其他进程被丢弃的已完成任务
+        while True:
+            await asyncio.sleep(1)
+            for job in list(self._jobs.values()):
+                if job.status in FINISHED:
+                    if not os.path.exists(self._state_path(job.id)):
+                        self._jobs.pop(job.id, None)
+                elif os.path.exists(self._state_path(job.id, ".cancel")):
+                    os.remove(self._state_path(job.id, ".cancel"))
+                    self.cancel(job.id)
+
+    # ---------- 生命周期 ----------
+
+    def start(self):
+        if self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(loop.create_task(self._expire_forever()))
+        self._tasks.append(loop.create_task(self._watch_forever()))
+
+    def active(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+
+    async def stop(self, drain_seconds: float = JOB_DRAIN_SECONDS):
+        """Let queued and running jobs finish for up to drain_seconds, cancel the rest."""
+        deadline = time.monotonic() + drain_seconds
+        if self._tasks and self.active():
+            logger.info(f"Draining {self.active()} jobs")
+        while self._tasks and self.active() and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+
+        for job in self._jobs.values():
+            if job.status in (QUEUED, RUNNING):
+                if job._task is not None:
+                    job._task.cancel()
+                self._finish(job, CANCELLED, "Cancelled by server shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        statuses = [job.status for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "queued": statuses.count(QUEUED),
+            "running": statuses.count(RUNNING),
+            "retained": len(statuses),
+            "finished": dict(self.counts),
+            "max_queued": self.max_queued,
+        }
+
+
+jobs = JobQueue()
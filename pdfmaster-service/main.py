@@ -1,15 +1,40 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Header, Query, Request
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pypdf import PdfReader, PdfWriter
-from PIL import Image
-from io import BytesIO
+import asyncio
+import hmac
+import math
 import os
 import uuid
 from datetime import datetime
-from typing import List, Optional
+from functools import partial
+from typing import List, Optional, Tuple
 import logging
 
+import image_ops
+import metrics
+import pdf_ops
+import profiler
+import watermark
+from admission import Ticket, admission, image_cost, office_cost, pdf_cost, render_cost
+from cache import etag, result_cache
+from executor import pipeline, pools, prime
+from ingest import SpoolingRoute, StoredObject, UploadLimitMiddleware, UploadSpool
+from jobs import PRIORITIES, jobs
+from output import SendfileResponse, output_response
+from pdf_ops import InvalidInputError
+from scratch import TEMP_DIR, scratch
+from storage import (
+    DELIVERIES,
+    STORAGE_DELIVERY,
+    STORAGE_MIN_BYTES,
+    STORAGE_URL_TTL_SECONDS,
+    object_storage,
+)
+from uploads import uploads
+from warmup import engine_available, warmup
+from zipstream import write_zip, zip_response
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,6 +44,8 @@ app = FastAPI(
     description="Professional PDF processing API for developers",
     version="1.0.0",
 )
+# multipart 上传边接收边写入 TEMP_DIR（见 ingest.py）
+app.router.route_class = SpoolingRoute
 
 # CORS 配置
 app.add_middleware(
@@ -35,12 +62,476 @@ app.add_middleware(
         "X-Original-Height",
         "X-New-Width",
         "X-New-Height",
+        "ETag",
+        "X-Cache",
+        "Location",
+        "Accept-Ranges",
+        "Content-Range",
+        "Upload-Offset",
+        "Upload-Length",
+        "Server-Timing",
     ],
 )
 
-# 临时文件目录
-TEMP_DIR = "/tmp/pdfmaster"
-os.makedirs(TEMP_DIR, exist_ok=True)
+# 上传大小限制（流式检查，超限直接 413）
+app.add_middleware(UploadLimitMiddleware)
+
+# 指标采集放在最外层，413 等中间件直接返回的响应也计入
+app.add_middleware(metrics.MetricsMiddleware)
+
+# ZIP 流式输出：每批页数与预取批数
+SPLIT_BATCH_PAGES = int(os.environ.get("SPLIT_BATCH_PAGES", "16"))
+RENDER_BATCH_PAGES = int(os.environ.get("RENDER_BATCH_PAGES", "4"))  # 150 DPI 时
+ZIP_PREFETCH_BATCHES = int(os.environ.get("ZIP_PREFETCH_BATCHES", "2"))
+
+# 合并：文件数上限；超过 MERGE_CHUNK_FILES 时分块并行合并再汇总
+MAX_MERGE_FILES = int(os.environ.get("MAX_MERGE_FILES", "500"))
+MERGE_CHUNK_FILES = int(os.environ.get("MERGE_CHUNK_FILES", "32"))
+
+# 转 Word：每批页数（各批在 office 进程池中并行解析）与每页的超时；
+# worker 内的超时打断不了卡在 C 调用里的批次，超出宽限时间后从外部结束该池
+WORD_BATCH_PAGES = int(os.environ.get("WORD_BATCH_PAGES", "4"))
+WORD_PAGE_TIMEOUT_SECONDS = float(os.environ.get("WORD_PAGE_TIMEOUT_SECONDS", "60"))
+WORD_TIMEOUT_GRACE_SECONDS = float(os.environ.get("WORD_TIMEOUT_GRACE_SECONDS", "30"))
+
+# 响应式图片：单次请求最多的宽度档位
+MAX_VARIANT_WIDTHS = int(os.environ.get("MAX_VARIANT_WIDTHS", "16"))
+
+async def upload_spool():
+    """Per-request scratch files for uploads, removed once the response is sent."""
+    # 临时目录接近配额时直接拒绝新任务
+    scratch.ensure_capacity()
+    async with UploadSpool(TEMP_DIR) as spool:
+        yield spool
+
+
+async def input_file(
+    file: Optional[UploadFile] = File(None),
+    upload_id: Optional[str] = Form(None),
+    key: Optional[str] = Form(None),
+):
+    """
+    The file to work on: an upload, a completed resumable upload (see uploads.py)
+    or an object key (see storage.py).
+    """
+    if upload_id:
+        return await pools.run("io", uploads.input, upload_id)
+    if key:
+        return StoredObject(key)
+    if file is None:
+        raise HTTPException(
+            status_code=400, detail="One of file, upload_id or key is required"
+        )
+    return file
+
+
+async def input_files(
+    files: List[UploadFile] = File(None),
+    upload_ids: List[str] = Form(None),
+    keys: List[str] = Form(None),
+):
+    """Uploaded files, then completed resumable uploads, then object keys."""
+    resumed = [
+        await pools.run("io", uploads.input, upload_id) for upload_id in upload_ids or []
+    ]
+    return (files or []) + resumed + [StoredObject(key) for key in keys or []]
+
+
+def result_delivery(delivery: Optional[str] = Query(None)) -> Optional[str]:
+    """How the client wants the result, None for the server default (see storage.py)."""
+    if delivery is None:
+        return None
+    if delivery not in DELIVERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid delivery. Supported: {', '.join(DELIVERIES)}",
+        )
+    if delivery != "direct" and not object_storage.enabled:
+        raise HTTPException(status_code=400, detail="Object storage is not configured")
+    return delivery
+
+
+async def admission_ticket():
+    """Admission of the request's conversions, released once the response is sent."""
+    ticket = Ticket(admission)
+    try:
+        yield ticket
+    finally:
+        ticket.release()
+
+
+async def cache_result(
+    key: str,
+    path: str,
+    media_type: str,
+    filename: Optional[str] = None,
+    headers: Optional[dict] = None,
+) -> dict:
+    """Store a finished result in the cache and return response headers with its ETag."""
+    headers = headers or {}
+    await pools.run(
+        "io", result_cache.store_file, key, path, media_type, filename, headers
+    )
+    return {**headers, "ETag": etag(key), "X-Cache": "MISS"}
+
+
+async def cache_output(
+    key: str, output: dict, filename: str, headers: Optional[dict] = None
+) -> dict:
+    """cache_result for an encoded image; results kept in memory are cached from memory."""
+    if "path" in output:
+        return await cache_result(
+            key, output["path"], output["media_type"], filename, headers
+        )
+    headers = headers or {}
+    result_cache.store_bytes(
+        key, output["body"], output["media_type"], headers, filename
+    )
+    return {**headers, "ETag": etag(key), "X-Cache": "MISS"}
+
+
+def cached_zip_response(
+    key: str,
+    batches,
+    filename: str,
+    headers: Optional[dict] = None,
+    cleanup: Tuple[str, ...] = (),
+) -> Response:
+    """
+    zip_response that tees the archive to scratch while streaming it and caches
+    it once complete; cleanup paths are removed after the response is sent.
+    """
+    headers = headers or {}
+    if not result_cache.disk_bytes:
+        # 磁盘层关闭时 ZIP 无处缓存，不必边发送边写盘
+        return zip_response(
+            batches,
+            filename=filename,
+            headers=headers,
+            background=scratch.cleanup(*cleanup),
+        )
+    tee = os.path.join(TEMP_DIR, f"zip_{uuid.uuid4()}.zip")
+
+    async def store():
+        await cache_result(key, tee, "application/zip", filename, headers)
+
+    return zip_response(
+        batches,
+        filename=filename,
+        headers={**headers, "ETag": etag(key), "X-Cache": "MISS"},
+        background=scratch.cleanup(tee, *cleanup),
+        tee=tee,
+        on_complete=store,
+    )
+
+
+def image_response(result: dict, filename: str, headers: dict) -> Response:
+    """Send an encoded image: its bytes, or its spilled scratch file (see output.py)."""
+    background = scratch.cleanup(result["path"]) if "path" in result else None
+    return output_response(result, filename, result["media_type"], headers, background)
+
+
+async def recompress_pdf_images(input_path: str, quality: int) -> dict:
+    """Re-encode a PDF's images in parallel across the image pool, return the replacements."""
+    images = await pools.run("pdf", pdf_ops.find_images, input_path)
+    if not images:
+        return {}
+
+    # 按像素量贪心分组，每个 worker 一组
+    shares = [[] for _ in range(min(len(images), pools.workers("image")))]
+    loads = [0] * len(shares)
+    for image in sorted(images, key=lambda image: image["pixels"], reverse=True):
+        i = loads.index(min(loads))
+        shares[i].append(image)
+        loads[i] += image["pixels"]
+
+    replacements = {}
+    for result in await asyncio.gather(
+        *(
+            pools.run("image", pdf_ops.recompress_images, input_path, share, quality)
+            for share in shares
+        )
+    ):
+        replacements.update(result)
+    logger.info(f"Recompressed {len(replacements)} of {len(images)} PDF images")
+    return replacements
+
+
+async def watermark_form(
+    text: str = Form(""),
+    position: str = Form("center"),
+    opacity: float = Form(0.5),
+    scale: Optional[float] = Form(None),
+    angle: int = Form(0),
+    color: str = Form("white"),
+    logo: Optional[UploadFile] = File(None),
+    spool: UploadSpool = Depends(upload_spool),
+) -> dict:
+    """Watermark options shared by the image and PDF endpoints (see watermark.py)."""
+    options = {
+        "text": text,
+        "position": position,
+        "opacity": opacity,
+        "scale": scale,
+        "angle": angle,
+        "color": color,
+    }
+    try:
+        watermark.check_options(options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if logo is not None and logo.filename:
+        logo_path = await spool.add(logo)
+        # 按内容摘要缓存 logo 图层，与临时文件路径无关
+        options.update(logo_path=logo_path, logo_key=spool.digest(logo_path))
+    return options
+
+
+def watermark_cache_params(options: dict) -> dict:
+    return {name: value for name, value in options.items() if name != "logo_path"}
+
+
+async def merge_in_stages(sources: list, output_path: str) -> int:
+    """
+    Merge (filename, path, pages) sources into output_path, return the page count.
+
+    Above MERGE_CHUNK_FILES sources, chunks are parsed and merged into
+    intermediate files in parallel across the pdf pool and the intermediates
+    merged at the end, so no worker holds more than one chunk of sources.
+    """
+    parts = []
+    try:
+        while len(sources) > MERGE_CHUNK_FILES:
+            size = min(
+                MERGE_CHUNK_FILES, math.ceil(len(sources) / pools.workers("pdf"))
+            )
+            chunks = [sources[i : i + size] for i in range(0, len(sources), size)]
+            paths = [
+                os.path.join(TEMP_DIR, f"merge_part_{uuid.uuid4()}.pdf")
+                for _ in chunks
+            ]
+            parts.extend(paths)
+            # 等所有分块结束再抛出首个错误，避免清理时仍有 worker 在写
+            results = await asyncio.gather(
+                *(
+                    pools.run("pdf", pdf_ops.merge_pdfs, chunk, path)
+                    for chunk, path in zip(chunks, paths)
+                ),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            logger.info(f"Merged {len(sources)} sources into {len(paths)} parts")
+            sources = [
+                (f"part {i + 1}", path, None) for i, path in enumerate(paths)
+            ]
+
+        return await pools.run("pdf", pdf_ops.merge_pdfs, sources, output_path)
+    finally:
+        scratch.remove(*parts)
+
+
+async def word_in_batches(
+    input_path: str, selected: List[int], output_path: str, on_progress=None
+):
+    """
+    Convert the selected pages (1-based) of input_path into one .docx.
+
+    Batches of WORD_BATCH_PAGES pages are laid out in parallel across the
+    office pool and stored as parsed JSON, then assembled in page order by one
+    worker. on_progress(done, total) counts pages as batches finish. Each
+    batch may take WORD_PAGE_TIMEOUT_SECONDS per page; a timeout or error
+    cancels the batches still queued. A batch that does not return within its
+    limit plus WORD_TIMEOUT_GRACE_SECONDS (stuck in a C call) has the office
+    pool's workers killed; both cases raise ConversionTimeout.
+    """
+    indices = [page - 1 for page in selected]
+    batches = [
+        indices[i : i + WORD_BATCH_PAGES]
+        for i in range(0, len(indices), WORD_BATCH_PAGES)
+    ]
+
+    async def run_batch(batch: List[int], fn, *args):
+        limit = WORD_PAGE_TIMEOUT_SECONDS and (
+            WORD_PAGE_TIMEOUT_SECONDS * len(batch) + WORD_TIMEOUT_GRACE_SECONDS
+        )
+        try:
+            await pools.run_limited(
+                "office", limit, fn, *args, WORD_PAGE_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            raise pdf_ops.ConversionTimeout(
+                pdf_ops.timeout_message(batch, WORD_PAGE_TIMEOUT_SECONDS)
+            )
+
+    if len(batches) == 1:
+        await run_batch(
+            indices, pdf_ops.pdf_to_word, input_path, output_path, indices
+        )
+        if on_progress:
+            on_progress(len(indices), len(indices))
+        return
+
+    parts = [
+        os.path.join(TEMP_DIR, f"word_part_{uuid.uuid4()}.json") for _ in batches
+    ]
+    done = 0
+
+    async def parse(batch: List[int], path: str):
+        nonlocal done
+        await run_batch(batch, pdf_ops.parse_word_pages, input_path, batch, path)
+        done += len(batch)
+        if on_progress:
+            on_progress(done, len(indices))
+
+    tasks = [
+        asyncio.ensure_future(parse(batch, path))
+        for batch, path in zip(batches, parts)
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        errors = [task.exception() for task in tasks if task.done() and task.exception()]
+        if errors:
+            # 超时会结束 office 池，同池的其他批次随之报 BrokenProcessPool，优先报告超时
+            raise next(
+                (e for e in errors if isinstance(e, pdf_ops.ConversionTimeout)),
+                errors[0],
+            )
+        await pools.run("office", pdf_ops.make_word, input_path, parts, output_path)
+    finally:
+        # 排队中的批次直接取消；已在运行的批次受超时约束，
+        # 其迟到的中间文件由 scratch 按 TTL 清理
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        scratch.remove(*parts)
+
+
+def async_job(
+    run_async: bool = Query(False, alias="async"),
+    priority: str = Query("normal"),
+) -> Optional[str]:
+    """Job priority for ?async=true requests, None when the client waits for the result."""
+    if not run_async:
+        return None
+    if priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid priority. Supported: {', '.join(PRIORITIES)}",
+        )
+    return priority
+
+
+def queue_job(
+    operation: str, run, spool: UploadSpool, priority: str, cost: int
+) -> JSONResponse:
+    """
+    Hand the spooled uploads over to a new job and answer 202 with its status.
+
+    The job is admitted with its estimated cost once a job worker starts it.
+    """
+
+    async def admitted(job):
+        grant = await admission.acquire(operation, cost, timeout=None)
+        try:
+            return await run(job)
+        finally:
+            grant.release()
+
+    job = jobs.submit(operation, admitted, spool.release(), priority)
+    return JSONResponse(
+        status_code=202,
+        content=job.to_dict(),
+        headers={"Location": f"/api/v1/jobs/{job.id}"},
+    )
+
+
+async def result_response(
+    result: dict, delivery: Optional[str] = None, background=None
+) -> Response:
+    """
+    Send a finished result, or upload it to object storage and send a presigned
+    link instead. Without an explicit delivery, results under STORAGE_MIN_KB go
+    out directly and a failed upload falls back to sending the file.
+    """
+    explicit = delivery is not None
+    if not explicit:
+        delivery = "direct"
+        if (
+            object_storage.enabled
+            and os.path.getsize(result["path"]) >= STORAGE_MIN_BYTES
+        ):
+            delivery = STORAGE_DELIVERY
+
+    if delivery != "direct":
+        key = object_storage.result_key(result)
+        try:
+            await pools.run(
+                "io",
+                object_storage.upload,
+                result["path"],
+                key,
+                result["media_type"],
+                result["filename"],
+            )
+            url = await pools.run("io", object_storage.download_url, key)
+        except Exception as e:
+            if explicit:
+                raise
+            logger.warning(f"Upload of {key} failed, sending directly: {str(e)}")
+        else:
+            if delivery == "redirect":
+                return RedirectResponse(
+                    url,
+                    status_code=303,
+                    headers=result["headers"],
+                    background=background,
+                )
+            return JSONResponse(
+                {
+                    "url": url,
+                    "key": key,
+                    "filename": result["filename"],
+                    "media_type": result["media_type"],
+                    "size": os.path.getsize(result["path"]),
+                    "expires_in": STORAGE_URL_TTL_SECONDS,
+                },
+                headers=result["headers"],
+                background=background,
+            )
+
+    return SendfileResponse(
+        result["path"],
+        filename=result["filename"],
+        media_type=result["media_type"],
+        headers=result["headers"],
+        background=background,
+    )
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    scratch.start()
+    jobs.start()
+    uploads.start()
+    metrics.loop_lag.start()
+    metrics.flusher.start()
+    profiler.start_watcher()
+    await warmup.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_pools():
+    await warmup.stop()
+    await jobs.stop()
+    await uploads.stop()
+    await scratch.stop()
+    await metrics.loop_lag.stop()
+    await metrics.flusher.stop()
+    # 等待进程池退出，避免解释器退出时向已关闭的管道发送唤醒信号
+    pools.shutdown(wait=True)
 
 
 @app.get("/")
@@ -61,15 +552,153 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "pid": os.getpid(),
+        "executor": {"queue_depth": pools.queue_depth(), "pools": pools.stats()},
+        "storage": scratch.stats(),
+        "cache": result_cache.stats(),
+        "object_storage": object_storage.stats(),
+        "uploads": uploads.stats(),
+        "jobs": jobs.stats(),
+        "admission": admission.stats(),
+        "warmup": warmup.stats(),
+    }
+
+
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 503 until the startup warm-up has finished
+
+    - Returns: Warm-up state with per-pool import and init timings
+    """
+    stats = warmup.stats()
+    if not stats["ready"]:
+        return JSONResponse(stats, status_code=503, headers={"Retry-After": "5"})
+    return stats
+
+
+def refresh_gauges():
+    """Metrics collector: copy the current state of every component into gauges."""
+    for name, stats in pools.stats().items():
+        metrics.executor_queued.set(stats["queued"], pool=name)
+        metrics.executor_running.set(stats["running"], pool=name)
+        metrics.executor_workers.set(stats["workers"], pool=name)
+
+    lanes = admission.stats()
+    metrics.admission_active.set(lanes["active"], lane="convert")
+    metrics.admission_waiting.set(lanes["waiting"], lane="convert")
+    metrics.admission_active.set(lanes["fast_lane"]["active"], lane="fast")
+    metrics.admission_waiting.set(lanes["fast_lane"]["waiting"], lane="fast")
+    metrics.admission_reserved_bytes.set(lanes["reserved_bytes"])
+
+    storage = scratch.stats()
+    metrics.tempdir_bytes.set(storage["usage_bytes"])
+    metrics.tempdir_files.set(storage["usage_files"])
+    metrics.tempdir_free_bytes.set(storage["free_bytes"])
+
+    cache = result_cache.stats()
+    for tier in ("memory", "disk"):
+        metrics.cache_entries.set(cache[tier]["entries"], tier=tier)
+        metrics.cache_bytes.set(cache[tier]["bytes"], tier=tier)
+
+    objects = object_storage.stats()
+    for operation in ("uploads", "reused", "downloads"):
+        metrics.object_storage_objects.set(objects[operation], operation=operation)
+    metrics.object_storage_bytes.set(objects["uploaded_bytes"])
+
+    job_stats = jobs.stats()
+    for status in ("queued", "running"):
+        metrics.jobs_gauge.set(job_stats[status], status=status)
+
+
+metrics.registry.add_collector(refresh_gauges)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus metrics in the text exposition format; under server.py the
+    merged metrics of every serving process (see metrics.py)
+
+    - Returns: Request, stage, executor, admission, storage, cache, object storage
+      and job metrics
+    """
+    return Response(
+        await metrics.render(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.get("/admin/profile")
+async def profile_endpoint(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(profiler.PROFILE_INTERVAL_MS, ge=1, le=1000),
+    idle: bool = Query(False),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Sample the stacks of every serving and pool process (see profiler.py);
+    404 unless PROFILE_TOKEN is set, which is then required as a bearer token
+
+    - **seconds**: How long to sample (up to PROFILE_MAX_SECONDS, default 60)
+    - **interval_ms**: Time between samples (default PROFILE_INTERVAL_MS, 10)
+    - **idle**: Include threads waiting for work
+    - Returns: Collapsed stacks ("frame;frame;... count" per line) for flamegraph.pl,
+      inferno or speedscope
+    """
+    # 未配置令牌时不暴露该端点
+    if not profiler.PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(authorization or "", f"Bearer {profiler.PROFILE_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid profile token")
+    if seconds > profiler.PROFILE_MAX_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"seconds must be at most {profiler.PROFILE_MAX_SECONDS:g}",
+        )
+    if await pools.run("io", profiler.active):
+        raise HTTPException(status_code=409, detail="A profile is already being taken")
+
+    profile_id = await pools.run(
+        "io", profiler.request_profile, seconds, interval_ms / 1000, idle
+    )
+    logger.info(f"Profiling for {seconds:g}s ({profile_id})")
+    # 各进程的 watcher 最多晚 POLL_SECONDS 开始，采样结束后再留出写文件的时间
+    await asyncio.sleep(seconds + 3 * profiler.POLL_SECONDS)
+    folded = await pools.run("io", profiler.collect_profile, profile_id)
+    return Response(
+        folded,
+        media_type="text/plain",
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'
+        },
+    )
 
 
 @app.post("/api/v1/pdf/merge")
-async def merge_pdfs(files: List[UploadFile] = File(...)):
+async def merge_pdfs(
+    files: List[UploadFile] = Depends(input_files),
+    plan: Optional[str] = Form(None),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+    job_priority: Optional[str] = Depends(async_job),
+    delivery: Optional[str] = Depends(result_delivery),
+):
     """
     Merge multiple PDF files into one
 
-    - **files**: List of PDF files to merge (2-20 files)
+    - **files**: List of PDF files to merge (2 to MAX_MERGE_FILES, default 500)
+    - **upload_ids** / **keys**: Further PDFs as completed resumable uploads or object keys
+    - **plan**: Optional JSON list setting order and pages per input, e.g.
+      `[{"file": 1}, {"file": 0, "pages": "1-3,7"}]` (file = 0-based index over files,
+      upload_ids, then keys;
+      files may be repeated or left out). Default: all pages of every file in upload order
+    - **async** / **priority**: Queue as a background job (see /api/v1/jobs)
+    - **delivery**: 'direct', 'url' or 'redirect' with object storage (see storage.py)
     - Returns: Merged PDF file
     """
     try:
@@ -80,8 +709,13 @@ async def merge_pdfs(files: List[UploadFile] = File(...)):
                 status_code=400, detail="At least 2 PDF files are required"
             )
 
-        if len(files) > 20:
-            raise HTTPException(status_code=400, detail="Maximum 20 PDF files allowed")
+        if len(files) > MAX_MERGE_FILES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Maximum {MAX_MERGE_FILES} PDF files allowed",
+            )
+
+        merge_plan = pdf_ops.parse_merge_plan(plan, len(files))
 
         # 验证所有文件都是 PDF
         for file in files:
@@ -90,55 +724,62 @@ async def merge_pdfs(files: List[UploadFile] = File(...)):
                     status_code=400, detail=f"File {file.filename} is not a PDF"
                 )
 
-        # 创建 PDF Writer
-        writer = PdfWriter()
-        total_pages = 0
+        uploads = [(file.filename, await spool.add(file)) for file in files]
+        sources = [
+            (uploads[index][0], uploads[index][1], pages) for index, pages in merge_plan
+        ]
 
-        # 处理每个文件
-        for file in files:
-            content = await file.read()
-            try:
-                reader = PdfReader(BytesIO(content))
-                for page in reader.pages:
-                    writer.add_page(page)
-                total_pages += len(reader.pages)
-                logger.info(f"Added {len(reader.pages)} pages from {file.filename}")
-            except Exception as e:
-                logger.error(f"Error reading {file.filename}: {str(e)}")
-                raise HTTPException(
-                    status_code=400, detail=f"Invalid PDF file: {file.filename}"
-                )
+        cache_key = result_cache.key(
+            "pdf.merge",
+            [spool.digest(path) for _, path in uploads],
+            {"plan": merge_plan} if plan else {},
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        # 生成输出文件
-        output_id = str(uuid.uuid4())
-        output_path = os.path.join(TEMP_DIR, f"merged_{output_id}.pdf")
+        async def merge(job=None):
+            # 生成输出文件
+            output_id = str(uuid.uuid4())
+            output_path = os.path.join(TEMP_DIR, f"merged_{output_id}.pdf")
 
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+            total_pages = await merge_in_stages(sources, output_path)
 
-        file_size = os.path.getsize(output_path)
-        logger.info(
-            f"Merged PDF created: {output_path}, size: {file_size} bytes, pages: {total_pages}"
-        )
+            file_size = os.path.getsize(output_path)
+            logger.info(
+                f"Merged PDF created: {output_path}, size: {file_size} bytes, pages: {total_pages}"
+            )
 
-        # 返回文件
-        response = FileResponse(
-            output_path,
-            filename="merged.pdf",
-            media_type="application/pdf",
-            headers={
-                "X-Total-Pages": str(total_pages),
-                "X-File-Size": str(file_size),
-            },
-        )
+            headers = await cache_result(
+                cache_key,
+                output_path,
+                "application/pdf",
+                "merged.pdf",
+                {"X-Total-Pages": str(total_pages), "X-File-Size": str(file_size)},
+            )
+            return {
+                "path": output_path,
+                "media_type": "application/pdf",
+                "filename": "merged.pdf",
+                "headers": headers,
+            }
 
-        # 清理任务（异步）
-        # TODO: 添加定时清理或上传到 R2
+        cost = pdf_cost(spool.total_bytes())
+        if job_priority:
+            return queue_job("pdf.merge", merge, spool, job_priority, cost)
 
-        return response
+        # 返回文件
+        await ticket.admit("pdf.merge", cost)
+        result = await merge()
+        return await result_response(
+            result, delivery, scratch.cleanup(result["path"])
+        )
 
     except HTTPException:
         raise
+    except InvalidInputError as e:
+        logger.error(f"Error merging PDFs: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error merging PDFs: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -146,17 +787,32 @@ async def merge_pdfs(files: List[UploadFile] = File(...)):
 
 @app.post("/api/v1/pdf/split")
 async def split_pdf(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     pages: Optional[str] = Form(None),  # 例如: "1,3,5-10"
-    split_mode: Optional[str] = Form("single"),  # single, all, range
+    split_mode: Optional[str] = Form("all"),  # all, range, ranges, every, bookmarks
+    every: Optional[int] = Form(None),
+    resources: str = Form("prune"),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+    job_priority: Optional[str] = Depends(async_job),
+    delivery: Optional[str] = Depends(result_delivery),
 ):
     """
     Split PDF by pages
 
-    - **file**: PDF file to split
-    - **pages**: Page ranges (e.g., "1,3,5-10"). Only for 'range' mode
-    - **split_mode**: 'single' (extract specific pages), 'all' (each page separate), 'range' (custom ranges)
-    - Returns: ZIP file containing split PDFs
+    - **file**: PDF file to split (or its **upload_id** / **key**)
+    - **pages**: Page ranges (e.g., "1,3,5-10") for 'range' mode; ";"-separated ranges,
+      optionally named, for 'ranges' mode (e.g., "1-10;11-20" or "intro:1-3;body:4-20")
+    - **split_mode**: 'all' (default, each page separate), 'range' (selected pages as one
+      PDF; 'single' is accepted as an alias),
+      'ranges' (one PDF per range), 'every' (one PDF per N pages), 'bookmarks' (one PDF per top-level bookmark)
+    - **every**: Pages per output for 'every' mode
+    - **resources**: 'prune' (default) leaves fonts and images a page doesn't use out of
+      each output, 'copy' keeps each page's resources as they are
+    - **async** / **priority**: Queue as a background job (see /api/v1/jobs)
+    - **delivery**: 'direct', 'url' or 'redirect' with object storage (see storage.py)
+    - Returns: ZIP file containing split PDFs (a single PDF when there is only one output)
     """
     try:
         logger.info(
@@ -166,87 +822,149 @@ async def split_pdf(
         if not file.content_type or "pdf" not in file.content_type:
             raise HTTPException(status_code=400, detail="File must be a PDF")
 
-        content = await file.read()
-        reader = PdfReader(BytesIO(content))
-        total_pages = len(reader.pages)
-
-        if total_pages == 0:
-            raise HTTPException(status_code=400, detail="PDF has no pages")
-
-        writer = PdfWriter()
-        output_files = []
-
-        def parse_pages(page_str: str, total: int) -> List[int]:
-            result = []
-            parts = page_str.split(",")
-            for part in parts:
-                part = part.strip()
-                if "-" in part:
-                    start, end = part.split("-")
-                    result.extend(range(int(start) - 1, int(end)))
-                else:
-                    result.append(int(part) - 1)
-            return [p for p in result if 0 <= p < total]
-
-        if split_mode == "all":
-            for i in range(total_pages):
-                writer = PdfWriter()
-                writer.add_page(reader.pages[i])
-                output_id = str(uuid.uuid4())
-                output_path = os.path.join(TEMP_DIR, f"page_{i + 1}_{output_id}.pdf")
-                with open(output_path, "wb") as f:
-                    writer.write(f)
-                output_files.append((f"page_{i + 1}.pdf", output_path))
-
-        elif split_mode == "range" and pages:
-            parsed_pages = parse_pages(pages, total_pages)
-            if not parsed_pages:
-                raise HTTPException(status_code=400, detail="Invalid page range")
-
-            writer = PdfWriter()
-            for page_num in parsed_pages:
-                writer.add_page(reader.pages[page_num])
-
-            output_id = str(uuid.uuid4())
-            output_path = os.path.join(TEMP_DIR, f"split_{output_id}.pdf")
-            with open(output_path, "wb") as f:
-                writer.write(f)
-            output_files.append((f"split_pages_{pages}.pdf", output_path))
-
-        else:
+        split_mode = pdf_ops.SPLIT_MODE_ALIASES.get(split_mode, split_mode)
+        if split_mode not in pdf_ops.SPLIT_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid mode. Use one of: {', '.join(pdf_ops.SPLIT_MODES)}",
+            )
+        if split_mode in ("range", "ranges") and not pages:
+            raise HTTPException(
+                status_code=400, detail=f"'{split_mode}' mode requires pages"
+            )
+        if split_mode == "every" and (every is None or every < 1):
+            raise HTTPException(
+                status_code=400, detail="'every' mode requires every >= 1"
+            )
+        if resources not in pdf_ops.SPLIT_RESOURCES:
             raise HTTPException(
                 status_code=400,
-                detail="Invalid mode. Use 'all' to split all pages, or 'range' with pages parameter",
+                detail=f"resources must be one of: {', '.join(pdf_ops.SPLIT_RESOURCES)}",
             )
 
-        if not output_files:
-            raise HTTPException(status_code=400, detail="No pages to export")
+        input_path = await spool.add(file)
+        cost = pdf_cost(spool.total_bytes())
+
+        # 只把所选模式用到的参数计入缓存键
+        cache_key = result_cache.key(
+            "pdf.split",
+            [spool.digest(input_path)],
+            {
+                "mode": split_mode,
+                "pages": pages if split_mode in ("range", "ranges") else None,
+                "every": every if split_mode == "every" else None,
+                "resources": resources,
+            },
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        if len(output_files) == 1:
-            return FileResponse(
-                output_files[0][1],
-                filename=output_files[0][0],
-                media_type="application/pdf",
-            )
+        if split_mode == "range":
 
-        import zipfile
+            async def extract(job=None):
+                output_id = str(uuid.uuid4())
+                output_path = os.path.join(TEMP_DIR, f"split_{output_id}.pdf")
+                await pools.run(
+                    "pdf",
+                    pdf_ops.extract_pages,
+                    input_path,
+                    pages,
+                    output_path,
+                    resources == "prune",
+                )
+                filename = f"split_pages_{pages}.pdf"
+                return {
+                    "path": output_path,
+                    "media_type": "application/pdf",
+                    "filename": filename,
+                    "headers": await cache_result(
+                        cache_key, output_path, "application/pdf", filename
+                    ),
+                }
+
+            if job_priority:
+                return queue_job("pdf.split", extract, spool, job_priority, cost)
+
+            await ticket.admit("pdf.split", cost)
+            result = await extract()
+            return await result_response(
+                result, delivery, scratch.cleanup(result["path"])
+            )
 
-        zip_id = str(uuid.uuid4())
-        zip_path = os.path.join(TEMP_DIR, f"split_{zip_id}.zip")
+        if not job_priority:
+            await ticket.admit("pdf.split", cost)
+        parts = await pools.run(
+            "pdf", pdf_ops.split_plan, input_path, split_mode, pages, every
+        )
+        prune = resources == "prune"
 
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for filename, filepath in output_files:
-                zipf.write(filepath, filename)
+        if len(parts) == 1 and not job_priority:
+            [(filename, data)] = await pools.run(
+                "pdf", pdf_ops.split_parts, input_path, parts, prune
+            )
+            result_cache.store_bytes(
+                cache_key, data, "application/pdf", filename=filename
+            )
+            return Response(
+                data,
+                media_type="application/pdf",
+                headers={
+                    "Content-Disposition": f'attachment; filename="{filename}"',
+                    "ETag": etag(cache_key),
+                    "X-Cache": "MISS",
+                },
+            )
 
-        return FileResponse(
-            zip_path,
-            filename="split_pages.zip",
-            media_type="application/zip",
-            headers={"X-Total-Files": str(len(output_files))},
+        # 按页数把输出分批交给各 worker，结果按顺序直接写入 ZIP 流，不落盘
+        calls = [
+            partial(pools.run, "pdf", pdf_ops.split_parts, input_path, batch, prune)
+            for batch in pdf_ops.part_batches(parts, SPLIT_BATCH_PAGES)
+        ]
+        depth = max(ZIP_PREFETCH_BATCHES, pools.workers("pdf"))
+        total_files = len(parts)
+
+        if job_priority:
+
+            async def split_all(job):
+                output_path = os.path.join(TEMP_DIR, f"split_{uuid.uuid4()}.zip")
+                job.progress(0, total_files)
+                await write_zip(
+                    pipeline(calls, depth=depth),
+                    output_path,
+                    lambda done: job.progress(done, total_files),
+                )
+                return {
+                    "path": output_path,
+                    "media_type": "application/zip",
+                    "filename": "split_pages.zip",
+                    "headers": await cache_result(
+                        cache_key,
+                        output_path,
+                        "application/zip",
+                        "split_pages.zip",
+                        {"X-Total-Files": str(total_files)},
+                    ),
+                }
+
+            return queue_job("pdf.split", split_all, spool, job_priority, cost)
+
+        batches = await prime(pipeline(calls, depth=depth))
+
+        # 输入文件在流式发送结束后再删除
+        spool.detach(input_path)
+        return cached_zip_response(
+            cache_key,
+            batches,
+            "split_pages.zip",
+            {"X-Total-Files": str(total_files)},
+            cleanup=(input_path,),
         )
 
     except HTTPException:
         raise
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error splitting PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Split failed: {str(e)}")
@@ -254,14 +972,21 @@ async def split_pdf(
 
 @app.post("/api/v1/pdf/compress")
 async def compress_pdf(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     quality: int = 50,  # 压缩质量 1-100
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+    job_priority: Optional[str] = Depends(async_job),
+    delivery: Optional[str] = Depends(result_delivery),
 ):
     """
     Compress PDF file to reduce size
 
-    - **file**: PDF file to compress
+    - **file**: PDF file to compress (or its **upload_id** / **key**)
     - **quality**: Compression level 1-100 (default: 50, higher = better quality but larger size)
+    - **async** / **priority**: Queue as a background job (see /api/v1/jobs)
+    - **delivery**: 'direct', 'url' or 'redirect' with object storage (see storage.py)
     - Returns: Compressed PDF file
     """
     try:
@@ -271,84 +996,209 @@ async def compress_pdf(
             raise HTTPException(status_code=400, detail="File must be a PDF")
 
         # 读取文件
-        content = await file.read()
-        original_size = len(content)
+        input_path = await spool.add(file)
+        original_size = os.path.getsize(input_path)
 
-        # 创建 reader 和 writer
-        reader = PdfReader(BytesIO(content))
-        writer = PdfWriter()
+        cache_key = result_cache.key(
+            "pdf.compress",
+            [spool.digest(input_path)],
+            {"quality": quality, "filename": file.filename},
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        # 添加所有页面
-        for page in reader.pages:
-            writer.add_page(page)
+        async def compress(job=None):
+            # 生成输出文件
+            output_id = str(uuid.uuid4())
+            output_path = os.path.join(TEMP_DIR, f"compressed_{output_id}.pdf")
 
-        # 压缩内容流
-        for page in writer.pages:
-            page.compress_content_streams()
+            images = await recompress_pdf_images(input_path, quality)
+            compressed_size = await pools.run(
+                "pdf", pdf_ops.compress_pdf, input_path, output_path, images
+            )
+            reduction = ((original_size - compressed_size) / original_size) * 100
 
-        # 生成输出文件
-        output_id = str(uuid.uuid4())
-        output_path = os.path.join(TEMP_DIR, f"compressed_{output_id}.pdf")
+            logger.info(
+                f"PDF compressed: {original_size} -> {compressed_size} bytes "
+                f"({reduction:.1f}% reduction)"
+            )
 
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+            filename = f"compressed_{file.filename}"
+            headers = await cache_result(
+                cache_key,
+                output_path,
+                "application/pdf",
+                filename,
+                {
+                    "X-Original-Size": str(original_size),
+                    "X-Compressed-Size": str(compressed_size),
+                    "X-Reduction-Percent": f"{reduction:.1f}",
+                },
+            )
+            return {
+                "path": output_path,
+                "media_type": "application/pdf",
+                "filename": filename,
+                "headers": headers,
+            }
 
-        compressed_size = os.path.getsize(output_path)
-        reduction = ((original_size - compressed_size) / original_size) * 100
+        cost = pdf_cost(spool.total_bytes())
+        if job_priority:
+            return queue_job("pdf.compress", compress, spool, job_priority, cost)
+
+        await ticket.admit("pdf.compress", cost)
+        result = await compress()
+        return await result_response(
+            result, delivery, scratch.cleanup(result["path"])
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error compressing PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Compression failed: {str(e)}")
 
+
+@app.post("/api/v1/pdf/watermark")
+async def watermark_pdf(
+    file: UploadFile = Depends(input_file),
+    pages: Optional[str] = Form(None),  # 例如: "1,3,5-10"
+    options: dict = Depends(watermark_form),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+    job_priority: Optional[str] = Depends(async_job),
+    delivery: Optional[str] = Depends(result_delivery),
+):
+    """
+    Stamp a text or logo watermark on PDF pages
+
+    - **file**: PDF file (or its **upload_id** / **key**)
+    - **pages**: Only stamp these pages (e.g., "1,3,5-10"); default all
+    - **text** / **logo** / **position** / **opacity** / **scale** / **angle** / **color**:
+      as for /api/v1/image/watermark, sizes relative to each page
+    - **async** / **priority**: Queue as a background job (see /api/v1/jobs)
+    - **delivery**: 'direct', 'url' or 'redirect' with object storage (see storage.py)
+    - Returns: Watermarked PDF file
+    """
+    try:
         logger.info(
-            f"PDF compressed: {original_size} -> {compressed_size} bytes "
-            f"({reduction:.1f}% reduction)"
+            f"Watermarking PDF: {file.filename}, text: {options['text']}, "
+            f"logo: {'logo_path' in options}, pages: {pages}"
         )
 
-        return FileResponse(
-            output_path,
-            filename=f"compressed_{file.filename}",
-            media_type="application/pdf",
-            headers={
-                "X-Original-Size": str(original_size),
-                "X-Compressed-Size": str(compressed_size),
-                "X-Reduction-Percent": f"{reduction:.1f}",
+        if not file.content_type or "pdf" not in file.content_type:
+            raise HTTPException(status_code=400, detail="File must be a PDF")
+        if not options["text"] and "logo_path" not in options:
+            raise HTTPException(status_code=400, detail="Provide text or logo")
+
+        input_path = await spool.add(file)
+
+        cache_key = result_cache.key(
+            "pdf.watermark",
+            [spool.digest(input_path)],
+            {
+                **watermark_cache_params(options),
+                "pages": pages,
+                "filename": file.filename,
             },
         )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
+
+        async def stamp(job=None):
+            output_path = os.path.join(TEMP_DIR, f"watermarked_{uuid.uuid4()}.pdf")
+            stamped = await pools.run(
+                "pdf", pdf_ops.watermark_pdf, input_path, output_path, options, pages
+            )
+
+            logger.info(f"PDF watermarked: {stamped} pages")
+
+            filename = f"watermarked_{file.filename}"
+            headers = await cache_result(
+                cache_key,
+                output_path,
+                "application/pdf",
+                filename,
+                {"X-Watermarked-Pages": str(stamped)},
+            )
+            return {
+                "path": output_path,
+                "media_type": "application/pdf",
+                "filename": filename,
+                "headers": headers,
+            }
+
+        cost = pdf_cost(spool.total_bytes())
+        if job_priority:
+            return queue_job("pdf.watermark", stamp, spool, job_priority, cost)
+
+        await ticket.admit("pdf.watermark", cost)
+        result = await stamp()
+        return await result_response(
+            result, delivery, scratch.cleanup(result["path"])
+        )
 
     except HTTPException:
         raise
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Error compressing PDF: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Compression failed: {str(e)}")
+        logger.error(f"Error watermarking PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Watermark failed: {str(e)}")
 
 
 @app.post("/api/v1/pdf/info")
-async def get_pdf_info(file: UploadFile = File(...)):
+async def get_pdf_info(
+    file: UploadFile = Depends(input_file),
+    detail: bool = False,
+    spool: UploadSpool = Depends(upload_spool),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     Get PDF metadata and information
 
-    - **file**: PDF file to analyze
-    - Returns: JSON with PDF info
+    Read from the trailer, Info dictionary and page tree only; page content is
+    never parsed. Results are cached by file content. Served from the fast lane,
+    so heavy conversions do not hold it up.
+
+    - **file**: PDF file to analyze (or its **upload_id** / **key**)
+    - **detail**: Also return per-page size, rotation, image count and whether
+      the page is image-only (default: false)
+    - Returns: JSON with page count, PDF version, encryption status, first page
+      size and metadata. `pages` is null when the file needs a password
     """
     try:
-        content = await file.read()
-        reader = PdfReader(BytesIO(content))
+        input_path = await spool.add(file)
+
+        cache_key = result_cache.key(
+            "pdf.info",
+            [spool.digest(input_path)],
+            {"filename": file.filename, "detail": detail},
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
+
+        async with admission.fast():
+            result = await pools.run("fast", pdf_ops.pdf_info, input_path, detail)
 
         info = {
             "filename": file.filename,
-            "pages": len(reader.pages),
-            "file_size": len(content),
-            "metadata": {},
+            "file_size": os.path.getsize(input_path),
+            **result,
         }
 
-        if reader.metadata:
-            info["metadata"] = {
-                "title": reader.metadata.get("/Title", ""),
-                "author": reader.metadata.get("/Author", ""),
-                "subject": reader.metadata.get("/Subject", ""),
-                "creator": reader.metadata.get("/Creator", ""),
-                "producer": reader.metadata.get("/Producer", ""),
-            }
-
-        return JSONResponse(content=info)
+        response = JSONResponse(content=info)
+        result_cache.store_bytes(cache_key, response.body, "application/json")
+        response.headers["ETag"] = etag(cache_key)
+        response.headers["X-Cache"] = "MISS"
+        return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid PDF file: {str(e)}")
 
@@ -358,63 +1208,64 @@ async def get_pdf_info(file: UploadFile = File(...)):
 
 @app.post("/api/v1/image/compress")
 async def compress_image(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     quality: int = 85,
     format: Optional[str] = None,
+    max_dimension: Optional[int] = None,
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
 ):
     """
     Compress image file
 
-    - **file**: Image file (JPG, PNG, WebP, etc.)
+    - **file**: Image file (JPG, PNG, WebP, etc.) (or its **upload_id** / **key**)
     - **quality**: Compression quality 1-100 (default: 85)
     - **format**: Output format (jpg, png, webp). If not specified, keeps original
+    - **max_dimension**: Downscale so the longer side is at most this many pixels
     - Returns: Compressed image
     """
     try:
-        logger.info(f"Compressing image: {file.filename}, quality: {quality}")
-
-        # 读取图片
-        content = await file.read()
-        image = Image.open(BytesIO(content))
-        original_size = len(content)
+        logger.info(
+            f"Compressing image: {file.filename}, quality: {quality}, "
+            f"max_dimension: {max_dimension}"
+        )
 
-        # 确定输出格式 - 默认转为JPEG以获得更好的压缩效果
-        if format:
-            output_format = format.upper()
-        else:
-            # 如果原图是PNG且需要压缩，转为JPEG以获得更好的压缩率
-            original_format = (image.format or "JPEG").upper()
-            if original_format == "PNG":
-                output_format = "JPEG"  # PNG转为JPEG以支持质量压缩
-            else:
-                output_format = original_format
-
-        if output_format == "JPG":
-            output_format = "JPEG"
-
-        # 转换 RGBA 到 RGB（如果是 JPEG）
-        if output_format == "JPEG" and image.mode in ("RGBA", "P"):
-            background = Image.new("RGB", image.size, (255, 255, 255))
-            background.paste(
-                image, mask=image.split()[-1] if image.mode == "RGBA" else None
+        if max_dimension is not None and max_dimension < 1:
+            raise HTTPException(
+                status_code=400, detail="max_dimension must be a positive integer"
             )
-            image = background
 
-        # 压缩并保存
-        output_id = str(uuid.uuid4())
-        ext = output_format.lower().replace("jpeg", "jpg")
-        output_path = os.path.join(TEMP_DIR, f"compressed_{output_id}.{ext}")
-
-        save_kwargs = {"format": output_format}
-        if output_format in ("JPEG", "WEBP"):
-            save_kwargs["quality"] = quality
-            save_kwargs["optimize"] = True
-        elif output_format == "PNG":
-            save_kwargs["optimize"] = True
-
-        image.save(output_path, **save_kwargs)
+        # 读取图片
+        input_path = await spool.add(file)
+        original_size = os.path.getsize(input_path)
+
+        cache_key = result_cache.key(
+            "image.compress",
+            [spool.digest(input_path)],
+            {
+                "quality": quality,
+                "format": (format or "").lower(),
+                "max_dimension": max_dimension,
+                "filename": file.filename,
+            },
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
+
+        await ticket.admit("image.compress", image_cost(spool.paths))
+        result = await pools.run(
+            "image",
+            image_ops.compress_image,
+            input_path,
+            quality,
+            format,
+            TEMP_DIR,
+            max_dimension,
+        )
 
-        compressed_size = os.path.getsize(output_path)
+        compressed_size = result["size"]
         reduction = ((original_size - compressed_size) / original_size) * 100
 
         logger.info(
@@ -422,19 +1273,24 @@ async def compress_image(
             f"({reduction:.1f}% reduction)"
         )
 
-        media_type = f"image/{output_format.lower().replace('jpeg', 'jpg')}"
-
-        return FileResponse(
-            output_path,
-            filename=f"compressed_{os.path.splitext(file.filename)[0]}.{ext}",
-            media_type=media_type,
-            headers={
+        filename = f"compressed_{os.path.splitext(file.filename)[0]}.{result['ext']}"
+        headers = await cache_output(
+            cache_key,
+            result,
+            filename,
+            {
                 "X-Original-Size": str(original_size),
                 "X-Compressed-Size": str(compressed_size),
                 "X-Reduction-Percent": f"{reduction:.1f}",
+                "X-Original-Width": str(result["original_width"]),
+                "X-Original-Height": str(result["original_height"]),
+                "X-New-Width": str(result["width"]),
+                "X-New-Height": str(result["height"]),
             },
         )
 
+        return image_response(result, filename, headers)
+
     except HTTPException:
         raise
     except Exception as e:
@@ -446,15 +1302,18 @@ async def compress_image(
 
 @app.post("/api/v1/image/resize")
 async def resize_image(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     width: Optional[str] = Form(None),
     height: Optional[str] = Form(None),
     maintain_aspect: bool = Form(True),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
 ):
     """
     Resize image to specified dimensions
 
-    - **file**: Image file
+    - **file**: Image file (or its **upload_id** / **key**)
     - **width**: Target width in pixels
     - **height**: Target height in pixels
     - **maintain_aspect**: Keep aspect ratio (default: True)
@@ -475,75 +1334,53 @@ async def resize_image(
             raise HTTPException(status_code=400, detail="Must specify width or height")
 
         # 读取图片
-        content = await file.read()
-        image = Image.open(BytesIO(content))
-        original_width, original_height = image.size
-
-        # 计算新尺寸
-        new_width = width_int
-        new_height = height_int
-
-        if maintain_aspect:
-            if width_int and not height_int:
-                ratio = width_int / original_width
-                new_height = int(original_height * ratio)
-                new_width = width_int
-            elif height_int and not width_int:
-                ratio = height_int / original_height
-                new_width = int(original_width * ratio)
-                new_height = height_int
-            elif width_int and height_int:
-                # 保持比例，适应指定框
-                ratio = min(width_int / original_width, height_int / original_height)
-                new_width = int(original_width * ratio)
-                new_height = int(original_height * ratio)
-        else:
-            new_width = width_int or original_width
-            new_height = height_int or original_height
-
-        # 调整大小
-        # 确保 new_width 和 new_height 不为 None
-        final_width = new_width if new_width is not None else original_width
-        final_height = new_height if new_height is not None else original_height
-        resized_image = image.resize(
-            (final_width, final_height), Image.Resampling.LANCZOS
+        input_path = await spool.add(file)
+
+        cache_key = result_cache.key(
+            "image.resize",
+            [spool.digest(input_path)],
+            {
+                "width": width_int,
+                "height": height_int,
+                "maintain_aspect": maintain_aspect,
+                "filename": file.filename,
+            },
         )
-
-        # 保存
-        output_id = str(uuid.uuid4())
-        ext = image.format.lower() if image.format else "jpg"
-        if ext == "jpeg":
-            ext = "jpg"
-        output_path = os.path.join(TEMP_DIR, f"resized_{output_id}.{ext}")
-
-        save_kwargs = {"format": image.format or "JPEG"}
-        if save_kwargs["format"] in ("JPEG", "WEBP"):
-            save_kwargs["quality"] = 95
-
-        resized_image.save(output_path, **save_kwargs)
-
-        logger.info(
-            f"Image resized: {original_width}x{original_height} -> {final_width}x{final_height}"
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
+
+        await ticket.admit("image.resize", image_cost(spool.paths))
+        result = await pools.run(
+            "image",
+            image_ops.resize_image,
+            input_path,
+            width_int,
+            height_int,
+            maintain_aspect,
+            TEMP_DIR,
         )
 
-        media_type = (
-            f"image/{image.format.lower().replace('jpeg', 'jpg')}"
-            if image.format
-            else "image/jpeg"
+        logger.info(
+            f"Image resized: {result['original_width']}x{result['original_height']} "
+            f"-> {result['width']}x{result['height']}"
         )
 
-        return FileResponse(
-            output_path,
-            filename=f"resized_{final_width}x{final_height}_{file.filename}",
-            media_type=media_type,
-            headers={
-                "X-Original-Width": str(original_width),
-                "X-Original-Height": str(original_height),
-                "X-New-Width": str(final_width),
-                "X-New-Height": str(final_height),
+        filename = f"resized_{result['width']}x{result['height']}_{file.filename}"
+        headers = await cache_output(
+            cache_key,
+            result,
+            filename,
+            {
+                "X-Original-Width": str(result["original_width"]),
+                "X-Original-Height": str(result["original_height"]),
+                "X-New-Width": str(result["width"]),
+                "X-New-Height": str(result["height"]),
             },
         )
 
+        return image_response(result, filename, headers)
+
     except HTTPException:
         raise
     except Exception as e:
@@ -553,13 +1390,16 @@ async def resize_image(
 
 @app.post("/api/v1/image/convert")
 async def convert_image(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     target_format: str = "png",
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
 ):
     """
     Convert image to different format
 
-    - **file**: Image file
+    - **file**: Image file (or its **upload_id** / **key**)
     - **target_format**: Target format (jpg, png, webp, gif, bmp, tiff)
     - Returns: Converted image
     """
@@ -567,7 +1407,7 @@ async def convert_image(
         logger.info(f"Converting image: {file.filename} to {target_format}")
 
         # 验证格式
-        valid_formats = ["jpg", "jpeg", "png", "webp", "gif", "bmp", "tiff"]
+        valid_formats = image_ops.OUTPUT_FORMATS
         target_format = target_format.lower()
         if target_format not in valid_formats:
             raise HTTPException(
@@ -576,43 +1416,28 @@ async def convert_image(
             )
 
         # 读取图片
-        content = await file.read()
-        image = Image.open(BytesIO(content))
-
-        # 处理格式转换
-        output_format = target_format.upper()
-        if output_format == "JPG":
-            output_format = "JPEG"
-
-        # 转换 RGBA 到 RGB（如果是 JPEG）
-        if output_format == "JPEG" and image.mode in ("RGBA", "P"):
-            background = Image.new("RGB", image.size, (255, 255, 255))
-            background.paste(
-                image, mask=image.split()[-1] if image.mode == "RGBA" else None
-            )
-            image = background
-
-        # 保存
-        output_id = str(uuid.uuid4())
-        ext = target_format.replace("jpeg", "jpg")
-        output_path = os.path.join(TEMP_DIR, f"converted_{output_id}.{ext}")
+        input_path = await spool.add(file)
 
-        save_kwargs = {"format": output_format}
-        if output_format in ("JPEG", "WEBP"):
-            save_kwargs["quality"] = 95
-            save_kwargs["optimize"] = True
+        cache_key = result_cache.key(
+            "image.convert",
+            [spool.digest(input_path)],
+            {"target_format": target_format, "filename": file.filename},
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        image.save(output_path, **save_kwargs)
+        await ticket.admit("image.convert", image_cost(spool.paths))
+        result = await pools.run(
+            "image", image_ops.convert_image, input_path, target_format, TEMP_DIR
+        )
 
         logger.info(f"Image converted to {target_format}")
 
-        media_type = f"image/{target_format.replace('jpg', 'jpeg')}"
+        filename = f"converted_{os.path.splitext(file.filename)[0]}.{result['ext']}"
+        headers = await cache_output(cache_key, result, filename)
 
-        return FileResponse(
-            output_path,
-            filename=f"converted_{os.path.splitext(file.filename)[0]}.{ext}",
-            media_type=media_type,
-        )
+        return image_response(result, filename, headers)
 
     except HTTPException:
         raise
@@ -625,54 +1450,44 @@ async def convert_image(
 
 @app.post("/api/v1/image/rotate")
 async def rotate_image(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     angle: int = Form(90),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
 ):
     """
     Rotate image by specified angle
 
-    - **file**: Image file to rotate
+    - **file**: Image file to rotate (or its **upload_id** / **key**)
     - **angle**: Rotation angle (90, 180, 270)
     - Returns: Rotated image
     """
     try:
         logger.info(f"Rotating image: {file.filename}, angle: {angle}")
 
-        content = await file.read()
-        image = Image.open(BytesIO(content))
-
-        if angle == 90:
-            rotated = image.rotate(-90, expand=True)
-        elif angle == 180:
-            rotated = image.rotate(-180, expand=True)
-        elif angle == 270:
-            rotated = image.rotate(-270, expand=True)
-        else:
-            rotated = image.rotate(-angle, expand=True)
-
-        output_id = str(uuid.uuid4())
-        ext = image.format.lower() if image.format else "jpg"
-        output_path = os.path.join(TEMP_DIR, f"rotated_{output_id}.{ext}")
+        input_path = await spool.add(file)
 
-        save_kwargs = {"format": image.format or "JPEG"}
-        if save_kwargs["format"] in ("JPEG", "WEBP"):
-            save_kwargs["quality"] = 95
+        cache_key = result_cache.key(
+            "image.rotate",
+            [spool.digest(input_path)],
+            {"angle": angle, "filename": file.filename},
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        rotated.save(output_path, **save_kwargs)
+        await ticket.admit("image.rotate", image_cost(spool.paths))
+        result = await pools.run(
+            "image", image_ops.rotate_image, input_path, angle, TEMP_DIR
+        )
 
         logger.info(f"Image rotated: {angle} degrees")
 
-        media_type = (
-            f"image/{image.format.lower().replace('jpeg', 'jpg')}"
-            if image.format
-            else "image/jpeg"
-        )
+        filename = f"rotated_{angle}_{file.filename}"
+        headers = await cache_output(cache_key, result, filename)
 
-        return FileResponse(
-            output_path,
-            filename=f"rotated_{angle}_{file.filename}",
-            media_type=media_type,
-        )
+        return image_response(result, filename, headers)
 
     except HTTPException:
         raise
@@ -683,16 +1498,19 @@ async def rotate_image(
 
 @app.post("/api/v1/image/crop")
 async def crop_image(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     x: int = Form(0),
     y: int = Form(0),
     width: int = Form(None),
     height: int = Form(None),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
 ):
     """
     Crop image to specified dimensions
 
-    - **file**: Image file to crop
+    - **file**: Image file to crop (or its **upload_id** / **key**)
     - **x**: Left position
     - **y**: Top position
     - **width**: Crop width
@@ -704,39 +1522,34 @@ async def crop_image(
             f"Cropping image: {file.filename}, x={x}, y={y}, w={width}, h={height}"
         )
 
-        content = await file.read()
-        image = Image.open(BytesIO(content))
-
-        img_width, img_height = image.size
-        crop_width = width or img_width
-        crop_height = height or img_height
-
-        box = (x, y, x + crop_width, y + crop_height)
-        cropped = image.crop(box)
-
-        output_id = str(uuid.uuid4())
-        ext = image.format.lower() if image.format else "jpg"
-        output_path = os.path.join(TEMP_DIR, f"cropped_{output_id}.{ext}")
-
-        save_kwargs = {"format": image.format or "JPEG"}
-        if save_kwargs["format"] in ("JPEG", "WEBP"):
-            save_kwargs["quality"] = 95
+        input_path = await spool.add(file)
+
+        cache_key = result_cache.key(
+            "image.crop",
+            [spool.digest(input_path)],
+            {
+                "x": x,
+                "y": y,
+                "width": width,
+                "height": height,
+                "filename": file.filename,
+            },
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        cropped.save(output_path, **save_kwargs)
+        await ticket.admit("image.crop", image_cost(spool.paths))
+        result = await pools.run(
+            "image", image_ops.crop_image, input_path, x, y, width, height, TEMP_DIR
+        )
 
-        logger.info(f"Image cropped")
+        logger.info("Image cropped")
 
-        media_type = (
-            f"image/{image.format.lower().replace('jpeg', 'jpg')}"
-            if image.format
-            else "image/jpeg"
-        )
+        filename = f"cropped_{file.filename}"
+        headers = await cache_output(cache_key, result, filename)
 
-        return FileResponse(
-            output_path,
-            filename=f"cropped_{file.filename}",
-            media_type=media_type,
-        )
+        return image_response(result, filename, headers)
 
     except HTTPException:
         raise
@@ -747,105 +1560,356 @@ async def crop_image(
 
 @app.post("/api/v1/image/watermark")
 async def watermark_image(
-    file: UploadFile = File(...),
-    text: str = Form(""),
-    position: str = Form("center"),
+    file: UploadFile = Depends(input_file),
+    options: dict = Depends(watermark_form),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
 ):
     """
-    Add watermark text to image
+    Add a text or logo watermark to image
 
-    - **file**: Image file
+    - **file**: Image file (or its **upload_id** / **key**)
     - **text**: Watermark text
-    - **position**: Position (center, bottom-right, top-right)
+    - **logo**: Logo image, used instead of text when given
+    - **position**: Position (center, top-left, top-right, bottom-left, bottom-right, tile)
+    - **opacity**: 0-1 (default: 0.5)
+    - **scale**: Size relative to the image: text height / shorter side (default: 0.05),
+      logo width / image width (default: 0.2)
+    - **angle**: Counter-clockwise rotation in degrees (default: 0)
+    - **color**: Text color (default: white)
     - Returns: Image with watermark
     """
     try:
-        from PIL import ImageDraw, ImageFont
+        logger.info(
+            f"Adding watermark to image: {file.filename}, text: {options['text']}, "
+            f"logo: {'logo_path' in options}, position: {options['position']}"
+        )
 
-        logger.info(f"Adding watermark to image: {file.filename}, text: {text}")
+        input_path = await spool.add(file)
 
-        content = await file.read()
-        image = Image.open(BytesIO(content))
+        cache_key = result_cache.key(
+            "image.watermark",
+            [spool.digest(input_path)],
+            {**watermark_cache_params(options), "filename": file.filename},
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        draw = ImageDraw.Draw(image)
+        await ticket.admit("image.watermark", image_cost(spool.paths))
+        result = await pools.run(
+            "image", image_ops.watermark_image, input_path, options, TEMP_DIR
+        )
 
-        try:
-            font = ImageFont.truetype(
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 36
-            )
-        except:
-            font = ImageFont.load_default()
-
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-
-        img_width, img_height = image.size
-
-        if position == "center":
-            x = (img_width - text_width) // 2
-            y = (img_height - text_height) // 2
-        elif position == "bottom-right":
-            x = img_width - text_width - 20
-            y = img_height - text_height - 20
-        elif position == "top-right":
-            x = img_width - text_width - 20
-            y = 20
-        else:
-            x = 20
-            y = img_height - text_height - 20
+        logger.info("Watermark added")
 
-        draw.text((x, y), text, fill=(255, 255, 255, 128), font=font)
+        filename = f"watermarked_{file.filename}"
+        headers = await cache_output(cache_key, result, filename)
 
-        output_id = str(uuid.uuid4())
-        ext = image.format.lower() if image.format else "jpg"
-        output_path = os.path.join(TEMP_DIR, f"watermarked_{output_id}.{ext}")
+        return image_response(result, filename, headers)
 
-        save_kwargs = {"format": image.format or "JPEG"}
-        if save_kwargs["format"] in ("JPEG", "WEBP"):
-            save_kwargs["quality"] = 95
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error adding watermark: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Watermark failed: {str(e)}")
+
+
+@app.post("/api/v1/image/pipeline")
+async def image_pipeline(
+    file: UploadFile = Depends(input_file),
+    operations: str = Form(...),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Apply a chain of operations with a single decode and a single encode
+
+    - **file**: Image file (or its **upload_id** / **key**)
+    - **operations**: JSON list of steps applied in order, e.g.
+      `[{"op": "resize", "width": 800}, {"op": "watermark", "text": "PDF Master"},
+      {"op": "compress", "quality": 80, "format": "webp"}]`
+    - Ops: resize (width, height, maintain_aspect), crop (x, y, width, height),
+      rotate (angle), watermark (text, position), convert (format),
+      compress (quality, format). convert / compress set the final encoding;
+      without them the source format is kept
+    - Returns: Processed image
+    """
+    try:
+        steps = image_ops.parse_pipeline(operations)
+        logger.info(
+            f"Image pipeline: {file.filename}, "
+            f"{' -> '.join(step['op'] for step in steps)}"
+        )
 
-        image.save(output_path, **save_kwargs)
+        input_path = await spool.add(file)
 
-        logger.info(f"Watermark added")
+        cache_key = result_cache.key(
+            "image.pipeline",
+            [spool.digest(input_path)],
+            {"operations": steps, "filename": file.filename},
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        media_type = (
-            f"image/{image.format.lower().replace('jpeg', 'jpg')}"
-            if image.format
-            else "image/jpeg"
+        await ticket.admit("image.pipeline", image_cost(spool.paths))
+        result = await pools.run(
+            "image", image_ops.run_pipeline, input_path, steps, TEMP_DIR
         )
 
-        return FileResponse(
-            output_path,
-            filename=f"watermarked_{file.filename}",
-            media_type=media_type,
+        logger.info(
+            f"Image pipeline done: {result['original_width']}x{result['original_height']} "
+            f"-> {result['width']}x{result['height']} {result['ext']}, {result['size']} bytes"
+        )
+
+        filename = f"processed_{os.path.splitext(file.filename)[0]}.{result['ext']}"
+        headers = await cache_output(
+            cache_key,
+            result,
+            filename,
+            {
+                "X-Original-Width": str(result["original_width"]),
+                "X-Original-Height": str(result["original_height"]),
+                "X-New-Width": str(result["width"]),
+                "X-New-Height": str(result["height"]),
+            },
         )
 
+        return image_response(result, filename, headers)
+
     except HTTPException:
         raise
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        logger.error(f"Error adding watermark: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Watermark failed: {str(e)}")
+        logger.error(f"Error in image pipeline: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Image pipeline failed: {str(e)}")
+
+
+@app.post("/api/v1/image/pipeline/batch")
+async def image_pipeline_batch(
+    files: List[UploadFile] = Depends(input_files),
+    operations: str = Form(...),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+    job_priority: Optional[str] = Depends(async_job),
+):
+    """
+    Apply the same operation chain to many images in parallel
+
+    - **files**: Image files (and/or **upload_ids** / **keys**)
+    - **operations**: JSON list of steps, as for /api/v1/image/pipeline
+    - **async** / **priority**: Queue as a background job (see /api/v1/jobs)
+    - Returns: ZIP file with one processed image per upload, in upload order
+    """
+    try:
+        steps = image_ops.parse_pipeline(operations)
+        logger.info(
+            f"Image pipeline batch: {len(files)} images, "
+            f"{' -> '.join(step['op'] for step in steps)}"
+        )
+
+        input_paths = [await spool.add(file) for file in files]
+
+        # 同名上传加序号区分，避免 ZIP 内条目重名
+        names, seen = [], set()
+        for index, file in enumerate(files, 1):
+            name = f"processed_{os.path.splitext(file.filename or 'image')[0]}"
+            if name in seen:
+                name = f"{name}_{index}"
+            seen.add(name)
+            names.append(name)
+
+        cache_key = result_cache.key(
+            "image.pipeline.batch",
+            [spool.digest(path) for path in input_paths],
+            {"operations": steps, "names": names},
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
+
+        # 每张图一个任务，在 image 进程池中并行，按上传顺序写入 ZIP
+        calls = [
+            partial(pools.run, "image", image_ops.pipeline_entries, path, steps, name)
+            for path, name in zip(input_paths, names)
+        ]
+        depth = max(ZIP_PREFETCH_BATCHES, pools.workers("image"))
+        cost = image_cost(input_paths, depth)
+
+        if job_priority:
+
+            async def work(job):
+                output_path = os.path.join(TEMP_DIR, f"images_{uuid.uuid4()}.zip")
+                job.progress(0, len(calls))
+                await write_zip(
+                    pipeline(calls, depth=depth),
+                    output_path,
+                    lambda done: job.progress(done, len(calls)),
+                )
+                return {
+                    "path": output_path,
+                    "media_type": "application/zip",
+                    "filename": "processed_images.zip",
+                    "headers": await cache_result(
+                        cache_key,
+                        output_path,
+                        "application/zip",
+                        "processed_images.zip",
+                        {"X-Total-Images": str(len(calls))},
+                    ),
+                }
+
+            return queue_job("image.pipeline", work, spool, job_priority, cost)
+
+        await ticket.admit("image.pipeline", cost)
+        batches = await prime(pipeline(calls, depth=depth))
+
+        paths = spool.release()
+        return cached_zip_response(
+            cache_key,
+            batches,
+            "processed_images.zip",
+            {"X-Total-Images": str(len(calls))},
+            cleanup=tuple(paths),
+        )
+
+    except HTTPException:
+        raise
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in image pipeline batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Image pipeline failed: {str(e)}")
+
+
+@app.post("/api/v1/image/variants")
+async def image_variants(
+    file: UploadFile = Depends(input_file),
+    widths: str = Form("320,640,1280,2560"),
+    formats: str = Form("webp,jpg"),
+    quality: int = Form(80),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Generate responsive (srcset) variants from a single decode
+
+    - **file**: Image file (or its **upload_id** / **key**)
+    - **widths**: Comma-separated target widths in pixels (default: 320,640,1280,2560);
+      widths larger than the source are clamped to it
+    - **formats**: Comma-separated output formats: jpg, webp, png (default: webp,jpg)
+    - **quality**: JPEG / WebP quality 1-100 (default: 80)
+    - Returns: ZIP file with one image per width and format, plus manifest.json
+    """
+    try:
+        try:
+            width_list = [int(width) for width in widths.split(",") if width.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid widths")
+        if not width_list or len(width_list) > MAX_VARIANT_WIDTHS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Specify 1 to {MAX_VARIANT_WIDTHS} widths",
+            )
+        if any(width < 1 for width in width_list):
+            raise HTTPException(status_code=400, detail="Widths must be positive")
+
+        format_list = [f.strip().lower() for f in formats.split(",") if f.strip()]
+        if not format_list or any(
+            f not in image_ops.VARIANT_FORMATS for f in format_list
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid format. Supported: {', '.join(image_ops.VARIANT_FORMATS)}",
+            )
+        if not 1 <= quality <= 100:
+            raise HTTPException(status_code=400, detail="Quality must be 1-100")
+
+        logger.info(
+            f"Generating variants: {file.filename}, widths={width_list}, "
+            f"formats={format_list}"
+        )
+
+        input_path = await spool.add(file)
+        name = os.path.splitext(file.filename or "image")[0]
+
+        cache_key = result_cache.key(
+            "image.variants",
+            [spool.digest(input_path)],
+            {
+                "widths": width_list,
+                "formats": format_list,
+                "quality": quality,
+                "name": name,
+            },
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
+
+        await ticket.admit("image.variants", image_cost([input_path]))
+
+        # 单个任务完成解码、逐级缩放和并行编码；prime 使错误在开始流式输出前返回
+        calls = [
+            partial(
+                pools.run,
+                "image",
+                image_ops.image_variants,
+                input_path,
+                width_list,
+                format_list,
+                quality,
+                name,
+            )
+        ]
+        batches = await prime(pipeline(calls, depth=1))
+
+        spool.detach(input_path)
+        return cached_zip_response(
+            cache_key, batches, f"{name}_variants.zip", cleanup=(input_path,)
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error generating image variants: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Variant generation failed: {str(e)}"
+        )
 
 
 @app.post("/api/v1/pdf/to-jpg")
 async def pdf_to_jpg(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     dpi: Optional[int] = Form(150),
     format: Optional[str] = Form("jpg"),
+    first_page: Optional[int] = Form(None),
+    last_page: Optional[int] = Form(None),
+    pages: Optional[str] = Form(None),  # 例如: "1,3,5-10"
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+    job_priority: Optional[str] = Depends(async_job),
 ):
     """
     Convert PDF pages to images
 
-    - **file**: PDF file to convert
+    - **file**: PDF file to convert (or its **upload_id** / **key**)
     - **dpi**: Image resolution (default: 150)
     - **format**: Output format (jpg, png)
+    - **first_page** / **last_page**: Only render this page window (1-based, inclusive)
+    - **pages**: Only render these pages (e.g., "1,3,5-10")
+    - **async** / **priority**: Queue as a background job (see /api/v1/jobs)
     - Returns: ZIP file containing images
     """
     try:
-        try:
-            from pdf2image import convert_from_bytes
-        except ImportError:
+        if not engine_available("pdf2image"):
             raise HTTPException(
                 status_code=500,
                 detail="PDF to image conversion not available. Please install pdf2image and poppler.",
@@ -856,49 +1920,114 @@ async def pdf_to_jpg(
         if not file.content_type or "pdf" not in file.content_type:
             raise HTTPException(status_code=400, detail="File must be a PDF")
 
-        content = await file.read()
-        images = convert_from_bytes(content, dpi=dpi)
+        input_path = await spool.add(file)
+
+        output_format = format.lower() if format else "jpg"
+        if output_format not in ["jpg", "jpeg", "png"]:
+            output_format = "jpg"
+
+        cache_key = result_cache.key(
+            "pdf.to_jpg",
+            [spool.digest(input_path)],
+            {
+                "dpi": dpi,
+                "format": output_format,
+                "pages": pages,
+                "first_page": first_page,
+                "last_page": last_page,
+            },
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        if not images:
+        # 只读页面树，页数与页面尺寸同时用于估算渲染成本
+        info = await pools.run("fast", pdf_ops.pdf_info, input_path)
+        total_pages = info["pages"] or 0
+        if total_pages == 0:
             raise HTTPException(
                 status_code=400, detail="Could not extract pages from PDF"
             )
 
-        import zipfile
-        import io
-
-        zip_id = str(uuid.uuid4())
-        zip_path = os.path.join(TEMP_DIR, f"pdf_images_{zip_id}.zip")
-
-        output_format = format.lower() if format else "jpg"
-        if output_format not in ["jpg", "jpeg", "png"]:
-            output_format = "jpg"
+        try:
+            selected = pdf_ops.select_pages(total_pages, pages, first_page, last_page)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid page range")
+        if not selected:
+            raise HTTPException(status_code=400, detail="Invalid page range")
+
+        # 按批渲染：每批页数随 DPI 缩放，保证单批像素量大致恒定；
+        # 多批在 render 进程池中并行，编码完成后按页序写入 ZIP 流
+        batch_pages = max(1, int(RENDER_BATCH_PAGES * (150 / max(dpi, 1)) ** 2))
+        calls = [
+            partial(
+                pools.run,
+                "render",
+                pdf_ops.render_pages,
+                input_path,
+                dpi,
+                output_format,
+                first,
+                last,
+            )
+            for first, last in pdf_ops.page_runs(selected, batch_pages)
+        ]
+        depth = max(ZIP_PREFETCH_BATCHES, pools.workers("render"))
+        page_size = info.get("page_size") or {"width": 612, "height": 792}
+        cost = render_cost(
+            spool.total_bytes(),
+            page_size["width"],
+            page_size["height"],
+            dpi,
+            min(len(selected), depth * batch_pages),
+        )
 
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for i, image in enumerate(images):
-                img_buffer = io.BytesIO()
-                if output_format in ["jpg", "jpeg"]:
-                    image = image.convert("RGB")
-                    image.save(img_buffer, format="JPEG", quality=95)
-                    ext = "jpg"
-                else:
-                    image.save(img_buffer, format="PNG")
-                    ext = "png"
+        if job_priority:
 
-                img_buffer.seek(0)
-                zipf.writestr(f"page_{i + 1}.{ext}", img_buffer.read())
+            async def render(job):
+                output_path = os.path.join(TEMP_DIR, f"images_{uuid.uuid4()}.zip")
+                job.progress(0, len(selected))
+                await write_zip(
+                    pipeline(calls, depth=depth),
+                    output_path,
+                    lambda done: job.progress(done, len(selected)),
+                )
+                return {
+                    "path": output_path,
+                    "media_type": "application/zip",
+                    "filename": "pdf_images.zip",
+                    "headers": await cache_result(
+                        cache_key,
+                        output_path,
+                        "application/zip",
+                        "pdf_images.zip",
+                        {"X-Total-Pages": str(len(selected))},
+                    ),
+                }
+
+            return queue_job("pdf.to_jpg", render, spool, job_priority, cost)
+
+        await ticket.admit("pdf.to_jpg", cost)
+        batches = await prime(pipeline(calls, depth=depth))
 
-        logger.info(f"PDF converted to {len(images)} images")
+        logger.info(
+            f"Streaming {len(selected)} of {total_pages} PDF pages as images, "
+            f"{len(calls)} batches of up to {batch_pages}"
+        )
 
-        return FileResponse(
-            zip_path,
-            filename="pdf_images.zip",
-            media_type="application/zip",
-            headers={"X-Total-Pages": str(len(images))},
+        spool.detach(input_path)
+        return cached_zip_response(
+            cache_key,
+            batches,
+            "pdf_images.zip",
+            {"X-Total-Pages": str(len(selected))},
+            cleanup=(input_path,),
         )
 
     except HTTPException:
         raise
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error converting PDF to JPG: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
@@ -906,12 +2035,17 @@ async def pdf_to_jpg(
 
 @app.post("/api/v1/pdf/from-jpg")
 async def jpg_to_pdf(
-    files: List[UploadFile] = File(...),
+    files: List[UploadFile] = Depends(input_files),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+    delivery: Optional[str] = Depends(result_delivery),
 ):
     """
     Convert images to PDF
 
-    - **files**: List of image files (JPG, PNG, etc.)
+    - **files**: List of image files (JPG, PNG, etc.) (and/or **upload_ids** / **keys**)
+    - **delivery**: 'direct', 'url' or 'redirect' with object storage (see storage.py)
     - Returns: Combined PDF file
     """
     try:
@@ -920,43 +2054,47 @@ async def jpg_to_pdf(
         if len(files) < 1:
             raise HTTPException(status_code=400, detail="At least 1 image required")
 
-        images = []
-        for file in files:
-            content = await file.read()
-            img = Image.open(BytesIO(content))
-            if img.mode == "RGBA":
-                background = Image.new("RGB", img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3])
-                img = background
-            elif img.mode != "RGB":
-                img = img.convert("RGB")
-            images.append(img)
-
-        if not images:
-            raise HTTPException(status_code=400, detail="Could not process images")
+        input_paths = [await spool.add(file) for file in files]
+
+        cache_key = result_cache.key(
+            "pdf.from_jpg", [spool.digest(path) for path in input_paths], {}
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
+
+        # 所有图片同时解码后一起写入 PDF
+        await ticket.admit("pdf.from_jpg", image_cost(input_paths))
 
         output_id = str(uuid.uuid4())
         output_path = os.path.join(TEMP_DIR, f"images_{output_id}.pdf")
 
-        images[0].save(
-            output_path,
-            save_all=True,
-            append_images=images[1:],
-            resolution=100.0,
-            quality=95,
+        total_pages = await pools.run(
+            "pdf", pdf_ops.images_to_pdf, input_paths, output_path
         )
 
-        logger.info(f"PDF created with {len(images)} pages")
+        logger.info(f"PDF created with {total_pages} pages")
 
-        return FileResponse(
+        headers = await cache_result(
+            cache_key,
             output_path,
-            filename="converted.pdf",
-            media_type="application/pdf",
-            headers={"X-Total-Pages": str(len(images))},
+            "application/pdf",
+            "converted.pdf",
+            {"X-Total-Pages": str(total_pages)},
         )
 
+        result = {
+            "path": output_path,
+            "media_type": "application/pdf",
+            "filename": "converted.pdf",
+            "headers": headers,
+        }
+        return await result_response(result, delivery, scratch.cleanup(output_path))
+
     except HTTPException:
         raise
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error converting JPG to PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
@@ -964,18 +2102,33 @@ async def jpg_to_pdf(
 
 @app.post("/api/v1/pdf/to-word")
 async def pdf_to_word(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
+    start: Optional[int] = Form(None),
+    end: Optional[int] = Form(None),
+    pages: Optional[str] = Form(None),  # 例如: "1,3,5-10"
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    if_none_match: Optional[str] = Header(None),
+    job_priority: Optional[str] = Depends(async_job),
+    delivery: Optional[str] = Depends(result_delivery),
 ):
     """
     Convert PDF to Word document
 
-    - **file**: PDF file to convert
+    Page batches are converted in parallel and joined into one document. A
+    batch that takes longer than WORD_PAGE_TIMEOUT_SECONDS per page fails the
+    conversion with 422.
+
+    - **file**: PDF file to convert (or its **upload_id** / **key**)
+    - **start** / **end**: Only convert this page window (1-based, inclusive)
+    - **pages**: Only convert these pages (e.g., "1,3,5-10")
+    - **async** / **priority**: Queue as a background job (see /api/v1/jobs);
+      progress is reported in pages
+    - **delivery**: 'direct', 'url' or 'redirect' with object storage (see storage.py)
     - Returns: Word document (.docx)
     """
     try:
-        try:
-            from pdf2docx import Converter
-        except ImportError:
+        if not engine_available("pdf2docx"):
             raise HTTPException(
                 status_code=500,
                 detail="PDF to Word conversion not available. Please install pdf2docx.",
@@ -986,29 +2139,75 @@ async def pdf_to_word(
         if not file.content_type or "pdf" not in file.content_type:
             raise HTTPException(status_code=400, detail="File must be a PDF")
 
-        content = await file.read()
-        input_path = os.path.join(TEMP_DIR, f"input_{uuid.uuid4()}.pdf")
-        output_path = os.path.join(TEMP_DIR, f"output_{uuid.uuid4()}.docx")
+        input_path = await spool.add(file, suffix=".pdf")
+
+        info = await pools.run("fast", pdf_ops.pdf_info, input_path)
+        total_pages = info["pages"] or 0
+        if total_pages == 0:
+            raise HTTPException(
+                status_code=400, detail="Could not extract pages from PDF"
+            )
 
-        with open(input_path, "wb") as f:
-            f.write(content)
+        try:
+            selected = pdf_ops.select_pages(total_pages, pages, start, end)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid page range")
+        if not selected:
+            raise HTTPException(status_code=400, detail="Invalid page range")
+
+        cache_key = result_cache.key(
+            "pdf.to_word",
+            [spool.digest(input_path)],
+            {"filename": file.filename, "pages": selected},
+        )
+        cached = result_cache.lookup(cache_key, if_none_match)
+        if cached:
+            return cached
 
-        cv = Converter(input_path)
-        cv.convert(output_path)
-        cv.close()
+        async def convert(job=None):
+            output_path = os.path.join(TEMP_DIR, f"output_{uuid.uuid4()}.docx")
 
-        os.remove(input_path)
+            if job:
+                job.progress(0, len(selected))
+            await word_in_batches(
+                input_path, selected, output_path, job.progress if job else None
+            )
 
-        logger.info("PDF converted to Word")
+            logger.info(f"PDF converted to Word: {len(selected)} of {total_pages} pages")
 
-        return FileResponse(
-            output_path,
-            filename=f"{os.path.splitext(file.filename)[0]}.docx",
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            filename = f"{os.path.splitext(file.filename)[0]}.docx"
+            media_type = (
+                "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+            )
+            return {
+                "path": output_path,
+                "media_type": media_type,
+                "filename": filename,
+                "headers": await cache_result(
+                    cache_key,
+                    output_path,
+                    media_type,
+                    filename,
+                    {"X-Total-Pages": str(len(selected))},
+                ),
+            }
+
+        cost = office_cost(spool.total_bytes(), len(selected))
+        if job_priority:
+            return queue_job("pdf.to_word", convert, spool, job_priority, cost)
+
+        await ticket.admit("pdf.to_word", cost)
+        result = await convert()
+        return await result_response(
+            result, delivery, scratch.cleanup(result["path"])
         )
 
     except HTTPException:
         raise
+    except pdf_ops.ConversionTimeout as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except InvalidInputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error converting PDF to Word: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
@@ -1016,19 +2215,21 @@ async def pdf_to_word(
 
 @app.post("/api/v1/pdf/protect")
 async def protect_pdf(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     password: Optional[str] = Form(None),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    delivery: Optional[str] = Depends(result_delivery),
 ):
     """
     Add password protection to PDF
 
-    - **file**: PDF file to protect
+    - **file**: PDF file to protect (or its **upload_id** / **key**)
     - **password**: Password to set
+    - **delivery**: 'direct', 'url' or 'redirect' with object storage (see storage.py)
     - Returns: Protected PDF file
     """
     try:
-        from pypdf import PdfWriter
-
         logger.info(f"Protecting PDF: {file.filename}")
 
         if not file.content_type or "pdf" not in file.content_type:
@@ -1037,28 +2238,24 @@ async def protect_pdf(
         if not password:
             raise HTTPException(status_code=400, detail="Password is required")
 
-        content = await file.read()
-        reader = PdfReader(BytesIO(content))
-        writer = PdfWriter()
-
-        for page in reader.pages:
-            writer.add_page(page)
+        input_path = await spool.add(file)
 
-        writer.encrypt(password)
+        await ticket.admit("pdf.protect", pdf_cost(spool.total_bytes()))
 
         output_id = str(uuid.uuid4())
         output_path = os.path.join(TEMP_DIR, f"protected_{output_id}.pdf")
 
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+        await pools.run("pdf", pdf_ops.protect_pdf, input_path, password, output_path)
 
         logger.info(f"PDF protected: {file.filename}")
 
-        return FileResponse(
-            output_path,
-            filename=f"protected_{file.filename}",
-            media_type="application/pdf",
-        )
+        result = {
+            "path": output_path,
+            "media_type": "application/pdf",
+            "filename": f"protected_{file.filename}",
+            "headers": {},
+        }
+        return await result_response(result, delivery, scratch.cleanup(output_path))
 
     except HTTPException:
         raise
@@ -1069,19 +2266,21 @@ async def protect_pdf(
 
 @app.post("/api/v1/pdf/unlock")
 async def unlock_pdf(
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(input_file),
     password: Optional[str] = Form(None),
+    spool: UploadSpool = Depends(upload_spool),
+    ticket: Ticket = Depends(admission_ticket),
+    delivery: Optional[str] = Depends(result_delivery),
 ):
     """
     Remove password protection from PDF
 
-    - **file**: PDF file to unlock
+    - **file**: PDF file to unlock (or its **upload_id** / **key**)
     - **password**: Current password
+    - **delivery**: 'direct', 'url' or 'redirect' with object storage (see storage.py)
     - Returns: Unlocked PDF file
     """
     try:
-        from pypdf import PdfReader, PdfWriter
-
         logger.info(f"Unlocking PDF: {file.filename}")
 
         if not file.content_type or "pdf" not in file.content_type:
@@ -1090,30 +2289,24 @@ async def unlock_pdf(
         if not password:
             raise HTTPException(status_code=400, detail="Password is required")
 
-        content = await file.read()
-        reader = PdfReader(BytesIO(content))
-
-        if reader.is_encrypted:
-            reader.decrypt(password)
-
-        writer = PdfWriter()
+        input_path = await spool.add(file)
 
-        for page in reader.pages:
-            writer.add_page(page)
+        await ticket.admit("pdf.unlock", pdf_cost(spool.total_bytes()))
 
         output_id = str(uuid.uuid4())
         output_path = os.path.join(TEMP_DIR, f"unlocked_{output_id}.pdf")
 
-        with open(output_path, "wb") as output_file:
-            writer.write(output_file)
+        await pools.run("pdf", pdf_ops.unlock_pdf, input_path, password, output_path)
 
         logger.info(f"PDF unlocked: {file.filename}")
 
-        return FileResponse(
-            output_path,
-            filename=f"unlocked_{file.filename}",
-            media_type="application/pdf",
-        )
+        result = {
+            "path": output_path,
+            "media_type": "application/pdf",
+            "filename": f"unlocked_{file.filename}",
+            "headers": {},
+        }
+        return await result_response(result, delivery, scratch.cleanup(output_path))
 
     except HTTPException:
         raise
@@ -1122,6 +2315,196 @@ async def unlock_pdf(
         raise HTTPException(status_code=500, detail=f"Unlock failed: {str(e)}")
 
 
+# ==================== 对象存储 API ====================
+
+
+@app.post("/api/v1/storage/uploads")
+async def create_storage_upload(
+    filename: str = Form(...),
+    content_type: str = Form("application/pdf"),
+):
+    """
+    Presigned URL for uploading an input straight to object storage
+
+    - **filename**: Name of the file to upload
+    - **content_type**: Its media type; the PUT must send the same Content-Type
+    - Returns: JSON with the PUT url, its headers and expiry, and the object key to
+      pass as **key** / **keys** to the PDF endpoints
+    """
+    if not object_storage.enabled:
+        raise HTTPException(status_code=404, detail="Object storage is not configured")
+    try:
+        return await pools.run("io", object_storage.upload_url, filename, content_type)
+    except Exception as e:
+        logger.error(f"Error creating upload URL: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+# ==================== 分块上传 API ====================
+
+
+def upload_headers(status: dict) -> dict:
+    return {
+        "Upload-Offset": str(status["offset"]),
+        "Upload-Length": str(status["size"]),
+        "Cache-Control": "no-store",
+    }
+
+
+@app.post("/api/v1/uploads")
+async def create_upload(
+    filename: str = Form(...),
+    size: int = Form(...),
+    content_type: str = Form("application/octet-stream"),
+):
+    """
+    Start a resumable upload
+
+    - **filename**: Name of the file; its extension and content_type are what the
+      operations see
+    - **size**: Total size in bytes
+    - **content_type**: Media type of the file (e.g. application/pdf)
+    - Returns: 201 with the upload status; send the bytes with PATCH to its upload_url
+    """
+    scratch.ensure_capacity()
+    status = await pools.run("io", uploads.create, filename, size, content_type)
+    return JSONResponse(
+        status_code=201,
+        content=status,
+        headers={"Location": status["upload_url"], **upload_headers(status)},
+    )
+
+
+@app.get("/api/v1/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    """
+    Status of a resumable upload
+
+    - **upload_id**: Id returned when the upload was created
+    - Returns: JSON with size, offset received so far and whether it is completed
+    """
+    status = await pools.run("io", uploads.status, upload_id)
+    return JSONResponse(status, headers=upload_headers(status))
+
+
+@app.head("/api/v1/uploads/{upload_id}")
+async def head_upload(upload_id: str):
+    """Offset to resume from, in the Upload-Offset header"""
+    status = await pools.run("io", uploads.status, upload_id)
+    return Response(status_code=204, headers=upload_headers(status))
+
+
+@app.patch("/api/v1/uploads/{upload_id}")
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+):
+    """
+    Append a chunk to a resumable upload
+
+    - **upload_id**: Id returned when the upload was created
+    - **Upload-Offset** (header): Offset the chunk starts at, i.e. the current
+      Upload-Offset; a mismatch is answered with 409 and the current offset
+    - Body: The raw bytes of the chunk
+    - Returns: 204 with the new Upload-Offset. If the connection drops, HEAD the
+      upload and continue from the offset it reports
+    """
+    scratch.ensure_capacity()
+    offset = await uploads.append(upload_id, upload_offset, request.stream())
+    return Response(
+        status_code=204, headers={"Upload-Offset": str(offset), "Cache-Control": "no-store"}
+    )
+
+
+@app.post("/api/v1/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, sha256: Optional[str] = Form(None)):
+    """
+    Finish a resumable upload once all bytes have been sent
+
+    - **upload_id**: Id returned when the upload was created
+    - **sha256**: Optional checksum of the whole file, verified before completing
+    - Returns: The upload status; pass its id as **upload_id** (or in **upload_ids**)
+      to any /api/v1/pdf/* or /api/v1/image/* operation
+    """
+    status = await pools.run("io", uploads.complete, upload_id, sha256)
+    return JSONResponse(status, headers=upload_headers(status))
+
+
+@app.delete("/api/v1/uploads/{upload_id}")
+async def delete_upload(upload_id: str):
+    """
+    Discard a resumable upload
+
+    - **upload_id**: Id returned when the upload was created
+    """
+    await pools.run("io", uploads.delete, upload_id)
+    return Response(status_code=204)
+
+
+# ==================== 结果 API ====================
+
+
+@app.get("/api/v1/results/{result_key}")
+async def get_result(result_key: str, if_none_match: Optional[str] = Header(None)):
+    """
+    Download a result again by its ETag, with Range support
+
+    - **result_key**: ETag of an earlier response, without the quotes
+    - Returns: The result as long as it is in the result cache, else 404
+    """
+    cached = result_cache.lookup(result_key, if_none_match)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    return cached
+
+
+# ==================== 任务 API ====================
+
+
+@app.get("/api/v1/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status and progress of a queued job
+
+    - **job_id**: Id returned by an ?async=true request
+    - Returns: JSON with status (queued, running, succeeded, failed, cancelled)
+    """
+    return jobs.get(job_id).to_dict()
+
+
+@app.get("/api/v1/jobs/{job_id}/result")
+async def get_job_result(
+    job_id: str, delivery: Optional[str] = Depends(result_delivery)
+):
+    """
+    Download the result of a finished job
+
+    - **job_id**: Id returned by an ?async=true request
+    - **delivery**: 'direct', 'url' or 'redirect' with object storage (see storage.py)
+    - Returns: The file the synchronous endpoint would have returned
+    """
+    job = jobs.get(job_id)
+    if job.status != "succeeded":
+        raise HTTPException(
+            status_code=409, detail=f"Job is {job.status}, no result available"
+        )
+    if not os.path.exists(job.result["path"]):
+        raise HTTPException(status_code=410, detail="Job result has expired")
+    # 结果保留到 JOB_RESULT_TTL_SECONDS，可重复下载
+    return await result_response(job.result, delivery)
+
+
+@app.delete("/api/v1/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancel a queued or running job, or discard a finished job and its result
+
+    - **job_id**: Id returned by an ?async=true request
+    """
+    return jobs.cancel(job_id).to_dict()
+
+
 if __name__ == "__main__":
     import uvicorn
 
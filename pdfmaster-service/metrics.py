@@ -0,0 +1,775 @@
+"""
+Prometheus metrics, rendered in the text exposition format at /metrics.
+
+Counters and histograms are plain dict updates on the event loop, so they
+stay on in production. Work done in the executor process pools is measured
+inside the worker (see run_reported) and the report travels back with the
+result:
+
+    pdfmaster_requests_total                 route, method, status
+    pdfmaster_request_duration_seconds       route
+    pdfmaster_stage_duration_seconds         route, stage (upload, queue,
+                                             parse, render, transform,
+                                             encode, send)
+    pdfmaster_request_bytes_total            route
+    pdfmaster_response_bytes_total           route
+    pdfmaster_pages_processed_total          task
+    pdfmaster_pixels_processed_total         task
+    pdfmaster_errors_total                   route, type
+    pdfmaster_admission_rejected_total       operation, reason
+    pdfmaster_executor_task_seconds          pool, task
+    pdfmaster_event_loop_lag_seconds
+
+Gauges (executor queues, admission, TEMP_DIR usage, cache, jobs) are
+refreshed by collectors just before the values are read. This module is
+imported by pool workers and must stay free of heavy imports.
+
+Under the multi-process server (server.py sets METRICS_DIR) every serving
+process writes its values to METRICS_DIR/<pid>.json every
+METRICS_FLUSH_SECONDS and whenever it is scraped, and /metrics answers with
+the merge of all of them, whichever process takes the scrape. Counters and
+histograms are summed, including those of processes that have exited (the
+supervisor folds them into archive.json), so they never go backwards. Gauges
+of live processes are summed, maxed or reported per process with a pid label,
+depending on the gauge.
+
+The same stage times are kept per request: every response carries them in a
+Server-Timing header (stages finished before the headers went out, plus
+total), and a JSON record with all stages, send time and bytes is logged to
+the pdfmaster.requests logger once the response is complete. Stages are
+summed over a request's pool tasks, so batches running in parallel can add
+up to more than the total.
+
+    SERVER_TIMING   add the Server-Timing header (default 1)
+    REQUEST_LOG     log the per-request timing record (default 1)
+"""
+
+import asyncio
+import contextvars
+import fcntl
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+request_logger = logging.getLogger("pdfmaster.requests")
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1").lower() in ("1", "true", "yes")
+REQUEST_LOG = os.environ.get("REQUEST_LOG", "1").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300,
+)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _label_str(self, key: Tuple[str, ...], extra: str = "") -> str:
+        # 多进程合并后的 gauge 可能多出一个 pid 标签
+        names = self.labels + ("pid",)
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def values(self) -> Dict[Tuple[str, ...], Any]:
+        return self._values
+
+    def samples(self, values: Optional[Dict] = None) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, values: Optional[Dict] = None) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(values),
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self._values[self._key(labels)] += amount
+
+    def samples(self, values: Optional[Dict] = None) -> List[str]:
+        values = self._values if values is None else values
+        return [
+            f"{self.name}{self._label_str(key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, multiprocess: str = "sum", **kwargs):
+        super().__init__(*args, **kwargs)
+        # 多进程合并方式：sum、max，或 all（每个进程一条，带 pid 标签）
+        self.multiprocess = multiprocess
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self, values: Optional[Dict] = None) -> List[str]:
+        values = self._values if values is None else values
+        return [
+            f"{self.name}{self._label_str(key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # key -> [每个桶的计数..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self, values: Optional[Dict] = None) -> List[str]:
+        values = self._values if values is None else values
+        lines = []
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{self._label_str(key, le)} {cumulative}"
+                )
+            lines.append(
+                f"{self.name}_sum{self._label_str(key)} {_format_value(series[-2])}"
+            )
+            lines.append(f"{self.name}_count{self._label_str(key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Ordered set of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def _add(self, metric: _Metric) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        multiprocess: str = "sum",
+    ) -> Gauge:
+        return self._add(Gauge(name, help, labels, multiprocess=multiprocess))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets=buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Register a function that refreshes gauges before values are read."""
+        self._collectors.append(collector)
+
+    def collect(self):
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {str(e)}")
+
+    def render(self, merged: Optional[Dict[str, Dict]] = None) -> str:
+        """Text exposition of this process's values, or of merged per-metric values."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(None if merged is None else merged[metric.name]))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, gauges: bool = True) -> Dict[str, Dict[str, Any]]:
+        """JSON-ready copy of every series, keyed by metric name and label values."""
+        return {
+            metric.name: {
+                json.dumps(key): list(value) if isinstance(value, list) else value
+                for key, value in metric.values().items()
+            }
+            for metric in self._metrics
+            if gauges or metric.kind != "gauge"
+        }
+
+    def merge(self, snapshots: List[Dict[str, Any]]) -> Dict[str, Dict]:
+        """
+        Combine process snapshots ({"pid", "live", "metrics"}) per metric.
+
+        Counters and histograms add up over every snapshot; gauges only over
+        live processes, as their multiprocess mode says.
+        """
+        merged: Dict[str, Dict] = {}
+        for metric in self._metrics:
+            values: Dict[Tuple[str, ...], Any] = {}
+            for snapshot in snapshots:
+                series = snapshot["metrics"].get(metric.name)
+                if not series or (metric.kind == "gauge" and not snapshot["live"]):
+                    continue
+                for raw_key, value in series.items():
+                    key = tuple(json.loads(raw_key))
+                    if metric.kind == "histogram":
+                        if key in values:
+                            values[key] = [a + b for a, b in zip(values[key], value)]
+                        else:
+                            values[key] = list(value)
+                    elif metric.kind == "gauge" and metric.multiprocess == "all":
+                        values[key + (str(snapshot["pid"]),)] = value
+                    elif metric.kind == "gauge" and metric.multiprocess == "max":
+                        values[key] = max(values.get(key, value), value)
+                    else:
+                        values[key] = values.get(key, 0) + value
+            merged[metric.name] = values
+        return merged
+
+
+registry = Registry()
+
+requests_total = registry.counter(
+    "pdfmaster_requests_total", "HTTP requests handled", ("route", "method", "status")
+)
+request_seconds = registry.histogram(
+    "pdfmaster_request_duration_seconds",
+    "Time from request start to the last response byte",
+    ("route",),
+)
+stage_seconds = registry.histogram(
+    "pdfmaster_stage_duration_seconds",
+    "Time spent per request stage",
+    ("route", "stage"),
+)
+request_bytes = registry.counter(
+    "pdfmaster_request_bytes_total", "Request body bytes received", ("route",)
+)
+response_bytes = registry.counter(
+    "pdfmaster_response_bytes_total", "Response body bytes sent", ("route",)
+)
+pages_total = registry.counter(
+    "pdfmaster_pages_processed_total", "PDF pages processed", ("task",)
+)
+pixels_total = registry.counter(
+    "pdfmaster_pixels_processed_total", "Image pixels decoded or rendered", ("task",)
+)
+errors_total = registry.counter(
+    "pdfmaster_errors_total", "Failed requests and tasks by error type", ("route", "type")
+)
+task_seconds = registry.histogram(
+    "pdfmaster_executor_task_seconds",
+    "Execution time of tasks in the process pools",
+    ("pool", "task"),
+)
+loop_lag_seconds = registry.histogram(
+    "pdfmaster_event_loop_lag_seconds",
+    "Delay of event loop wake-ups past their deadline",
+    buckets=LAG_BUCKETS,
+)
+
+executor_queued = registry.gauge(
+    "pdfmaster_executor_queued_tasks", "Tasks waiting for a pool worker", ("pool",)
+)
+executor_running = registry.gauge(
+    "pdfmaster_executor_running_tasks", "Tasks running in a pool", ("pool",)
+)
+executor_workers = registry.gauge(
+    "pdfmaster_executor_workers", "Configured pool workers", ("pool",)
+)
+# TEMP_DIR 由所有进程共享，取最大值而非求和
+tempdir_bytes = registry.gauge(
+    "pdfmaster_tempdir_bytes", "Bytes used under TEMP_DIR", multiprocess="max"
+)
+tempdir_files = registry.gauge(
+    "pdfmaster_tempdir_files", "Files under TEMP_DIR", multiprocess="max"
+)
+tempdir_free_bytes = registry.gauge(
+    "pdfmaster_tempdir_free_bytes",
+    "Free bytes on the TEMP_DIR volume",
+    multiprocess="max",
+)
+# 内存层按进程，磁盘层共享目录：按进程分别报告
+cache_entries = registry.gauge(
+    "pdfmaster_cache_entries", "Result cache entries", ("tier",), multiprocess="all"
+)
+cache_bytes = registry.gauge(
+    "pdfmaster_cache_bytes", "Result cache size", ("tier",), multiprocess="all"
+)
+cache_lookups = registry.counter(
+    "pdfmaster_cache_lookups_total", "Result cache lookups", ("result",)
+)
+jobs_gauge = registry.gauge("pdfmaster_jobs", "Retained async jobs", ("status",))
+admission_rejected = registry.counter(
+    "pdfmaster_admission_rejected_total",
+    "Requests refused with 503 by admission control",
+    ("operation", "reason"),
+)
+admission_active = registry.gauge(
+    "pdfmaster_admission_active", "Admitted requests in progress", ("lane",)
+)
+admission_waiting = registry.gauge(
+    "pdfmaster_admission_waiting", "Requests waiting for admission", ("lane",)
+)
+admission_reserved_bytes = registry.gauge(
+    "pdfmaster_admission_reserved_bytes", "Estimated memory of admitted conversions"
+)
+object_storage_objects = registry.gauge(
+    "pdfmaster_object_storage_objects",
+    "Object storage transfers since start",
+    ("operation",),
+)
+object_storage_bytes = registry.gauge(
+    "pdfmaster_object_storage_uploaded_bytes", "Bytes uploaded to object storage"
+)
+warmup_seconds = registry.gauge(
+    "pdfmaster_warmup_seconds",
+    "Startup warm-up time per pool",
+    ("engine",),
+    multiprocess="all",
+)
+
+
+# ---------- 路由上下文 ----------
+
+_current_scope: contextvars.ContextVar = contextvars.ContextVar(
+    "pdfmaster_scope", default=None
+)
+_route_paths: Dict[Any, str] = {}
+# 当前请求各阶段累计耗时（秒）
+_current_timing: contextvars.ContextVar = contextvars.ContextVar(
+    "pdfmaster_timing", default=None
+)
+
+
+def route_of(scope: Optional[dict]) -> str:
+    """Route template (e.g. /api/v1/jobs/{job_id}) of a routed ASGI scope."""
+    if scope is None:
+        return "background"
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        path = endpoint.__name__
+        for route in getattr(scope.get("app"), "routes", []):
+            if getattr(route, "endpoint", None) is endpoint:
+                path = route.path
+                break
+        _route_paths[endpoint] = path
+    return path
+
+
+def current_route() -> str:
+    """Route of the request being handled; 'background' outside a request."""
+    return route_of(_current_scope.get())
+
+
+def _add_timing(stage: str, seconds: float):
+    timing = _current_timing.get()
+    if timing is not None:
+        timing[stage] = timing.get(stage, 0.0) + seconds
+
+
+def observe_stage(stage: str, seconds: float):
+    stage_seconds.observe(seconds, route=current_route(), stage=stage)
+    _add_timing(stage, seconds)
+
+
+def server_timing(timing: Dict[str, float], total: float) -> str:
+    """Server-Timing header value, durations in milliseconds."""
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timing.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+# ---------- worker 侧 ----------
+
+_local = threading.local()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Attribute the enclosed time to a stage of the running pool task."""
+    report = getattr(_local, "report", None)
+    if report is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        report["stages"][name] += time.perf_counter() - started
+
+
+def count(pages: int = 0, pixels: int = 0):
+    """Record pages/pixels processed by the running pool task."""
+    report = getattr(_local, "report", None)
+    if report is not None:
+        report["pages"] += pages
+        report["pixels"] += pixels
+
+
+def run_reported(fn: Callable, *args, **kwargs) -> Tuple[Any, Dict[str, Any]]:
+    """Run fn in a pool worker and return (result, timing report)."""
+    report = {"stages": defaultdict(float), "pages": 0, "pixels": 0}
+    _local.report = report
+    report["started"] = time.time()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        _local.report = None
+    report["finished"] = time.time()
+    report["stages"] = dict(report["stages"])
+    return result, report
+
+
+def record_task(pool: str, task: str, submitted: float, report: Dict[str, Any]):
+    """Fold a worker report into the histograms (event loop side)."""
+    elapsed = report["finished"] - report["started"]
+    task_seconds.observe(elapsed, pool=pool, task=task)
+    stages = report["stages"]
+    observe_stage("queue", max(0.0, report["started"] - submitted))
+    for name, seconds in stages.items():
+        observe_stage(name, seconds)
+    observe_stage("transform", max(0.0, elapsed - sum(stages.values())))
+    if report["pages"]:
+        pages_total.inc(report["pages"], task=task)
+    if report["pixels"]:
+        pixels_total.inc(report["pixels"], task=task)
+
+
+# ---------- HTTP ----------
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests, bytes, latency and send time per route,
+    and reporting the stage times of each request (Server-Timing, log record).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = _current_scope.set(scope)
+        timing: Dict[str, float] = {}
+        timing_token = _current_timing.set(timing)
+        started = time.perf_counter()
+        state = {"status": 500, "in": 0, "out": 0, "send_started": None}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["in"] += len(message.get("body", b""))
+            return message
+
+        async def timing_send(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["send_started"] = time.perf_counter()
+                if SERVER_TIMING:
+                    header = server_timing(timing, state["send_started"] - started)
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", header.encode("latin-1")),
+                    ]
+            elif message["type"] == "http.response.body":
+                state["out"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, timing_send)
+        except Exception as e:
+            errors_total.inc(route=route_of(scope), type=type(e).__name__)
+            raise
+        finally:
+            finished = time.perf_counter()
+            route = route_of(scope)
+            status = state["status"]
+            requests_total.inc(route=route, method=scope["method"], status=status)
+            request_seconds.observe(finished - started, route=route)
+            send_seconds = None
+            if state["send_started"] is not None:
+                send_seconds = finished - state["send_started"]
+                stage_seconds.observe(send_seconds, route=route, stage="send")
+            request_bytes.inc(state["in"], route=route)
+            response_bytes.inc(state["out"], route=route)
+            if status >= 400:
+                errors_total.inc(route=route, type=f"http_{status}")
+            if REQUEST_LOG:
+                self._log(scope, route, state, timing, finished - started, send_seconds)
+            _current_timing.reset(timing_token)
+            _current_scope.reset(token)
+
+    @staticmethod
+    def _log(scope, route, state, timing, total, send_seconds):
+        record = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route,
+            "status": state["status"],
+            "duration_ms": round(total * 1000, 1),
+            "stages_ms": {name: round(s * 1000, 1) for name, s in timing.items()},
+            "bytes_in": state["in"],
+            "bytes_out": state["out"],
+        }
+        if send_seconds is not None:
+            record["stages_ms"]["send"] = round(send_seconds * 1000, 1)
+        request_logger.info(json.dumps(record))
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed sleep."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            loop_lag_seconds.observe(max(0.0, lag))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+loop_lag = LoopLagMonitor()
+
+
+# ---------- 多进程 ----------
+
+ARCHIVE_FILE = "archive.json"
+
+# 定时写入与抓取可能并发：只让更新的快照覆盖文件，保证数值不回退
+_flush_lock = threading.Lock()
+_flushed_at = 0.0
+
+
+def _locked(exclusive: bool):
+    f = open(os.path.join(METRICS_DIR, ".lock"), "a")
+    fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    return f
+
+
+def _write_json(path: str, data: Dict[str, Any]):
+    temp = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp, "w") as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+
+def _write_own(snapshot: Dict[str, Dict[str, Any]], taken: float):
+    global _flushed_at
+    with _flush_lock:
+        if taken >= _flushed_at:
+            _write_json(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), snapshot)
+            _flushed_at = taken
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush(snapshot: Dict[str, Dict[str, Any]], taken: float):
+    """Write this process's snapshot, taken at monotonic time taken (blocking)."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with _locked(exclusive=False):
+        _write_own(snapshot, taken)
+
+
+def collect_all(snapshot: Dict[str, Dict[str, Any]], taken: float) -> str:
+    """
+    Flush snapshot, then render the merge of every process (blocking).
+
+    Everything rendered comes from the files, so a value once scraped is
+    never lower in a later scrape, even if this process is killed.
+    """
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    snapshots = []
+    with _locked(exclusive=False):
+        _write_own(snapshot, taken)
+        for name in os.listdir(METRICS_DIR):
+            if not name.endswith(".json"):
+                continue
+            data = _read_json(os.path.join(METRICS_DIR, name))
+            if data is None:
+                continue
+            pid = name[: -len(".json")]
+            snapshots.append(
+                {"pid": pid, "live": name != ARCHIVE_FILE, "metrics": data}
+            )
+    return registry.render(registry.merge(snapshots))
+
+
+def archive_process(pid: int):
+    """
+    Fold the counters and histograms of an exited process into archive.json
+    and drop its file; called by the supervisor (server.py) when it reaps.
+    """
+    path = os.path.join(METRICS_DIR, f"{pid}.json")
+    if not METRICS_DIR or not os.path.exists(path):
+        return
+    with _locked(exclusive=True):
+        archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+        snapshots = [
+            {"pid": name, "live": False, "metrics": data}
+            for name, data in (
+                ("archive", _read_json(archive_path)),
+                (str(pid), _read_json(path)),
+            )
+            if data is not None
+        ]
+        merged = registry.merge(snapshots)
+        _write_json(
+            archive_path,
+            {
+                metric.name: {
+                    json.dumps(key): value
+                    for key, value in merged[metric.name].items()
+                }
+                for metric in registry._metrics
+                if metric.kind != "gauge"
+            },
+        )
+        os.remove(path)
+
+
+def reset_process_files():
+    """Start from empty shared metrics; called once by the supervisor."""
+    if METRICS_DIR:
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+        os.makedirs(METRICS_DIR, exist_ok=True)
+
+
+async def render() -> str:
+    """/metrics body: this process alone, or every process under server.py."""
+    registry.collect()
+    if not METRICS_DIR:
+        return registry.render()
+    # 在事件循环上取快照，文件读写交给线程
+    snapshot = registry.snapshot()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, collect_all, snapshot, time.monotonic()
+    )
+
+
+class MetricsFlusher:
+    """Writes this process's values to METRICS_DIR periodically and on stop."""
+
+    def __init__(self, interval: float = METRICS_FLUSH_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _flush(self):
+        registry.collect()
+        snapshot = registry.snapshot()
+        await asyncio.get_running_loop().run_in_executor(
+            None, flush, snapshot, time.monotonic()
+        )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.warning(f"Metrics flush failed: {str(e)}")
+
+    def start(self):
+        if METRICS_DIR and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self._flush()
+
+
+flusher = MetricsFlusher()
@@ -0,0 +1,292 @@
+"""
+Result output: small results stay in memory, large ones go out with sendfile.
+
+Transforms encode into a SpooledOutput instead of a scratch file. Results up
+to OUTPUT_MEMORY_KB never touch the disk: the bytes come back from the worker
+and are sent as the response body. A larger result spills to its scratch file
+while it is being encoded and is served from there.
+
+File responses use the ASGI zero-copy extensions (http.response.pathsend,
+http.response.zerocopysend) when the server offers them; otherwise the file
+is read in OUTPUT_CHUNK_KB chunks.
+
+Both kinds answer GET requests carrying a single Range with 206 (honouring
+If-Range against the ETag or Last-Modified), so interrupted downloads resume;
+a range past the end gets 416. Streamed ZIPs have no length up front and are
+always sent whole.
+
+    OUTPUT_MEMORY_KB    largest result kept in memory (default 1024)
+    OUTPUT_CHUNK_KB     read size for file responses without sendfile (1024)
+"""
+
+import io
+import os
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from fastapi.responses import FileResponse, Response
+from starlette.datastructures import Headers
+
+OUTPUT_MEMORY_BYTES = int(os.environ.get("OUTPUT_MEMORY_KB", "1024")) * 1024
+OUTPUT_CHUNK_BYTES = int(os.environ.get("OUTPUT_CHUNK_KB", "1024")) * 1024
+
+
+def content_disposition(filename: str) -> str:
+    """Attachment header for filename, RFC 5987-encoded when it is not plain ASCII."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def requested_range(scope, size: int, headers) -> Optional[Tuple[int, int]]:
+    """
+    The byte range (first, last inclusive) a GET asks for, None for the whole body.
+
+    Several ranges, malformed ranges and an If-Range that no longer matches the
+    response's ETag / Last-Modified all mean the whole body. Raises
+    RangeNotSatisfiable when the range starts past the end.
+    """
+    if scope.get("method") not in ("GET", "HEAD"):
+        return None
+    request_headers = Headers(scope=scope)
+    value = request_headers.get("range", "")
+    if not value.startswith("bytes=") or "," in value:
+        return None
+    if_range = request_headers.get("if-range")
+    if if_range and if_range not in (headers.get("etag"), headers.get("last-modified")):
+        return None
+
+    first, _, last = value[len("bytes="):].strip().partition("-")
+    try:
+        if not first:
+            # 后缀范围: 最后 N 字节
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _partial_headers(response: Response, span: Tuple[int, int], size: int):
+    response.status_code = 206
+    response.headers["content-range"] = f"bytes {span[0]}-{span[1]}/{size}"
+    response.headers["content-length"] = str(span[1] - span[0] + 1)
+
+
+async def _not_satisfiable(send, size: int):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 416,
+            "headers": [
+                (b"content-range", f"bytes */{size}".encode()),
+                (b"content-length", b"0"),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": b""})
+
+
+class MemoryResponse(Response):
+    """In-memory body that answers Range requests."""
+
+    async def __call__(self, scope, receive, send):
+        self.headers["accept-ranges"] = "bytes"
+        size = len(self.body)
+        try:
+            span = requested_range(scope, size, self.headers)
+        except RangeNotSatisfiable:
+            await _not_satisfiable(send, size)
+            return
+        if span is not None:
+            _partial_headers(self, span, size)
+            self.body = self.body[span[0] : span[1] + 1]
+        await super().__call__(scope, receive, send)
+
+
+class SpooledOutput(io.RawIOBase):
+    """
+    Writable, seekable target for an encoder (e.g. PIL's save()): bytes stay in
+    memory up to max_bytes, then move to a scratch file at path.
+    """
+
+    def __init__(self, path: str, max_bytes: int = OUTPUT_MEMORY_BYTES):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = io.BytesIO()
+        self.spilled = False
+
+    def writable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if not self.spilled:
+            with self._file.getbuffer() as view:
+                size = max(view.nbytes, self._file.tell() + len(data))
+            if size > self.max_bytes:
+                self._spill()
+        return self._file.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def _spill(self):
+        buffer = self._file
+        self._file = open(self.path, "w+b")
+        with buffer.getbuffer() as view:
+            self._file.write(view)
+        self._file.seek(buffer.tell())
+        self.spilled = True
+
+    def result(self) -> Dict[str, Any]:
+        """{"body", "size"} for an in-memory result, {"path", "size"} once spilled."""
+        size = self._file.seek(0, io.SEEK_END)
+        if self.spilled:
+            self._file.close()
+            return {"path": self.path, "size": size}
+        return {"body": self._file.getvalue(), "size": size}
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        super().close()
+
+
+class SendfileResponse(FileResponse):
+    """
+    FileResponse that answers Range requests and hands the file to the server
+    when it can send it zero-copy.
+    """
+
+    chunk_size = OUTPUT_CHUNK_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if self.stat_result is None:
+            try:
+                self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            except FileNotFoundError:
+                raise RuntimeError(f"File at path {self.path} does not exist.")
+            self.set_stat_headers(self.stat_result)
+        self.headers["accept-ranges"] = "bytes"
+
+        size = self.stat_result.st_size
+        try:
+            span = requested_range(scope, size, self.headers)
+        except RangeNotSatisfiable:
+            await _not_satisfiable(send, size)
+            return
+        if span is not None:
+            await self._send_range(span, size, send)
+            return
+
+        extensions = scope.get("extensions") or {}
+        if self.send_header_only or not (
+            "http.response.pathsend" in extensions
+            or "http.response.zerocopysend" in extensions
+        ):
+            await super().__call__(scope, receive, send)
+            return
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+        else:
+            with open(self.path, "rb") as file:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": file.fileno(),
+                        "more_body": False,
+                    }
+                )
+        if self.background is not None:
+            await self.background()
+
+    async def _send_range(self, span: Tuple[int, int], size: int, send):
+        _partial_headers(self, span, size)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if self.send_header_only:
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            remaining = span[1] - span[0] + 1
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(span[0])
+                while remaining:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    # 文件被截断时提前结束
+                    remaining = remaining - len(chunk) if chunk else 0
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": chunk,
+                            "more_body": bool(remaining),
+                        }
+                    )
+        if self.background is not None:
+            await self.background()
+
+
+def output_response(
+    output: Dict[str, Any],
+    filename: Optional[str],
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+    background=None,
+) -> Response:
+    """Response for a SpooledOutput result: the bytes, or the spilled file."""
+    if "body" in output:
+        headers = dict(headers or {})
+        if filename:
+            headers["Content-Disposition"] = content_disposition(filename)
+        return MemoryResponse(
+            output["body"], media_type=media_type, headers=headers, background=background
+        )
+    return SendfileResponse(
+        output["path"],
+        filename=filename,
+        media_type=media_type,
+        headers=headers,
+        background=background,
+    )
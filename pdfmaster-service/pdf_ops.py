@@ -0,0 +1,1122 @@
+"""
+Blocking PDF transforms.
+
+Everything here runs inside executor pools (see executor.py), so functions
+must stay module-level with picklable arguments and return values. Inputs are
+scratch-file paths written by ingest.py; PDFs are opened memory-mapped so
+large uploads are paged in by the OS rather than copied into the heap. Client
+errors are raised as InvalidInputError and mapped to HTTP 400 by main.py.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import signal
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from pypdf import PdfReader, PdfWriter, Transformation
+from pypdf.filters import ASCII85Decode, ASCIIHexDecode, FlateDecode
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    StreamObject,
+)
+
+import watermark
+from metrics import count, stage
+
+
+class InvalidInputError(ValueError):
+    """The uploaded input cannot be processed (maps to HTTP 400)."""
+
+
+class ConversionTimeout(InvalidInputError):
+    """Pages took longer than their time limit to convert (maps to HTTP 422)."""
+
+
+@contextmanager
+def open_pdf(path: str) -> Iterator[PdfReader]:
+    """Yield a PdfReader over a read-only memory map of path."""
+    with open(path, "rb") as f:
+        try:
+            stream = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法 mmap
+            raise InvalidInputError("PDF file is empty")
+        try:
+            with stage("parse"):
+                reader = PdfReader(stream)
+            yield reader
+        finally:
+            stream.close()
+
+
+def parse_pages(page_str: str, total: int) -> List[int]:
+    """0-based pages of a range string ("1,3,5-10"); InvalidInputError if malformed."""
+    result = []
+    parts = page_str.split(",")
+    try:
+        for part in parts:
+            part = part.strip()
+            if "-" in part:
+                start, end = part.split("-")
+                result.extend(range(int(start) - 1, int(end)))
+            else:
+                result.append(int(part) - 1)
+    except ValueError:
+        raise InvalidInputError("Invalid page range")
+    return [p for p in result if 0 <= p < total]
+
+
+def select_pages(
+    total: int,
+    pages: Optional[str] = None,
+    first_page: Optional[int] = None,
+    last_page: Optional[int] = None,
+) -> List[int]:
+    """
+    1-based page numbers chosen by a range string ("1,3,5-10") and/or a
+    first_page..last_page window, in document order without duplicates.
+    """
+    first = max(1, first_page or 1)
+    last = min(total, last_page or total)
+    if pages:
+        chosen = sorted({p + 1 for p in parse_pages(pages, total)})
+    else:
+        chosen = list(range(1, total + 1))
+    return [p for p in chosen if first <= p <= last]
+
+
+def page_runs(page_numbers: List[int], batch_size: int) -> List[Tuple[int, int]]:
+    """Group sorted page numbers into contiguous (first, last) runs of at most batch_size."""
+    runs = []
+    for page in page_numbers:
+        if runs and page == runs[-1][1] + 1 and page - runs[-1][0] < batch_size:
+            runs[-1] = (runs[-1][0], page)
+        else:
+            runs.append((page, page))
+    return runs
+
+
+def merge_pdfs(
+    sources: List[Tuple[str, str, Optional[str]]], output_path: str
+) -> int:
+    """
+    Merge (filename, path, pages) sources into output_path, return page count.
+
+    pages is a range string ("1,3,5-10") selecting and ordering pages of that
+    source, None for all of them. Each source is closed as soon as its pages
+    are copied into the writer, and objects repeated across sources (fonts,
+    images, ICC profiles) are written once.
+    """
+    writer = PdfWriter()
+    total_pages = 0
+
+    for filename, path, pages in sources:
+        try:
+            # add_page 会把页面及其引用的对象复制进 writer，源文件随即可关闭
+            with open_pdf(path) as reader:
+                total = len(reader.pages)
+                try:
+                    numbers = [p + 1 for p in parse_pages(pages, total)] if pages else []
+                except ValueError:
+                    raise InvalidInputError(f"Invalid page range for {filename}")
+                if pages and not numbers:
+                    raise InvalidInputError(f"No pages selected from {filename}")
+                for number in numbers or range(1, total + 1):
+                    writer.add_page(reader.pages[number - 1])
+                total_pages += len(numbers) or total
+        except InvalidInputError:
+            raise
+        except Exception as e:
+            raise InvalidInputError(f"Invalid PDF file: {filename}") from e
+    count(pages=total_pages)
+
+    _dedupe_objects(writer)
+
+    with open(output_path, "wb") as output_file:
+        with stage("encode"):
+            writer.write(output_file)
+
+    return total_pages
+
+
+def parse_merge_plan(
+    spec: Optional[str], file_count: int
+) -> List[Tuple[int, Optional[str]]]:
+    """
+    Validate a merge plan: a JSON list of {"file": index, "pages": "1-3"}.
+
+    index is 0-based in upload order; entries may reorder or repeat files.
+    Without a plan every file is merged whole, in upload order.
+    """
+    if not spec:
+        return [(index, None) for index in range(file_count)]
+    try:
+        entries = json.loads(spec)
+    except ValueError:
+        raise InvalidInputError("Plan must be a JSON list")
+    if not isinstance(entries, list) or not entries:
+        raise InvalidInputError("Plan must be a non-empty JSON list")
+
+    plan = []
+    for number, entry in enumerate(entries, 1):
+        index = entry.get("file") if isinstance(entry, dict) else None
+        valid = isinstance(index, int) and not isinstance(index, bool)
+        if not valid or not 0 <= index < file_count:
+            raise InvalidInputError(
+                f"Plan entry {number}: file must be an index from 0 to {file_count - 1}"
+            )
+        pages = entry.get("pages")
+        if pages is not None and (
+            not isinstance(pages, str) or not re.fullmatch(r"[\d\s,-]+", pages)
+        ):
+            raise InvalidInputError(f"Plan entry {number}: invalid page range")
+        plan.append((index, pages or None))
+    return plan
+
+
+def page_count(input_path: str) -> int:
+    with open_pdf(input_path) as reader:
+        return len(reader.pages)
+
+
+# ---------- 拆分 ----------
+
+SPLIT_MODES = ["all", "range", "ranges", "every", "bookmarks"]
+# 旧版接口的模式名
+SPLIT_MODE_ALIASES = {"single": "range"}
+SPLIT_RESOURCES = ["prune", "copy"]
+
+# 一个拆分输出：(文件名, 0-based 页码)
+Part = Tuple[str, List[int]]
+
+
+def _part_name(name: str) -> str:
+    name = re.sub(r"[^\w.-]+", "_", name).strip("._")[:80]
+    return (name or "part") + ".pdf"
+
+
+def _range_parts(spec: str, total: int) -> List[Part]:
+    parts = []
+    for number, item in enumerate(spec.split(";"), 1):
+        if not item.strip():
+            continue
+        name, _, pages = item.rpartition(":")
+        pages = pages.strip()
+        try:
+            if not re.fullmatch(r"[\d\s,-]+", pages):
+                raise ValueError
+            indices = parse_pages(pages, total)
+        except ValueError:
+            raise InvalidInputError(f"Range {number}: invalid page range")
+        if not indices:
+            raise InvalidInputError(f"Range {number}: no pages selected")
+        name = name.strip() or "pages_" + pages.replace(" ", "")
+        parts.append((_part_name(name), indices))
+    if not parts:
+        raise InvalidInputError("No page ranges given")
+    return parts
+
+
+def _bookmark_parts(reader: PdfReader, total: int) -> List[Part]:
+    starts: Dict[int, str] = {}
+    # 只按顶级书签拆分，子级书签（嵌套列表）归入其上级
+    for item in reader.outline:
+        if isinstance(item, list):
+            continue
+        try:
+            page = reader.get_destination_page_number(item)
+        except Exception:
+            continue
+        if page is not None and 0 <= page < total:
+            starts.setdefault(page, item.title or "")
+    if not starts:
+        raise InvalidInputError("PDF has no bookmarks")
+    if 0 not in starts:
+        starts[0] = "front_matter"
+
+    firsts = sorted(starts)
+    width = len(str(len(firsts)))
+    return [
+        (
+            _part_name(f"{number:0{width}d}_{starts[first]}"),
+            list(range(first, firsts[number] if number < len(firsts) else total)),
+        )
+        for number, first in enumerate(firsts, 1)
+    ]
+
+
+def split_plan(
+    input_path: str,
+    mode: str,
+    ranges: Optional[str] = None,
+    every: Optional[int] = None,
+) -> List[Part]:
+    """
+    The output parts of a split, one PDF each.
+
+    all: one part per page; ranges: one part per ";"-separated range
+    ("1-10;11-20", a range may be named as "intro:1-3"); every: consecutive
+    parts of every pages; bookmarks: one part per top-level bookmark, with
+    any pages before the first bookmark as front matter.
+    """
+    with open_pdf(input_path) as reader:
+        total = len(reader.pages)
+        if total == 0:
+            raise InvalidInputError("PDF has no pages")
+
+        if mode == "ranges":
+            parts = _range_parts(ranges or "", total)
+        elif mode == "every":
+            parts = []
+            for start in range(0, total, every):
+                end = min(start + every, total)
+                parts.append((f"pages_{start + 1}-{end}.pdf", list(range(start, end))))
+        elif mode == "bookmarks":
+            parts = _bookmark_parts(reader, total)
+        else:
+            parts = [(f"page_{i + 1}.pdf", [i]) for i in range(total)]
+
+    # 同名输出加序号区分，避免 ZIP 中出现重复条目
+    seen: Dict[str, int] = {}
+    unique = []
+    for name, indices in parts:
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name = f"{name[:-4]}_{seen[name]}.pdf"
+        unique.append((name, indices))
+    return unique
+
+
+def part_batches(parts: List[Part], batch_pages: int) -> List[List[Part]]:
+    """Group consecutive parts into worker calls of about batch_pages pages each."""
+    batches: List[List[Part]] = []
+    size = batch_pages
+    for part in parts:
+        if size >= batch_pages:
+            batches.append([])
+            size = 0
+        batches[-1].append(part)
+        size += len(part[1])
+    return batches
+
+
+def split_parts(
+    input_path: str, parts: List[Part], prune: bool = True
+) -> List[Tuple[str, bytes]]:
+    """
+    One PDF per part, as (name, bytes) entries.
+
+    With prune, fonts and XObjects a page's content never uses are left out
+    of its part when its resource dictionary is shared with other pages;
+    otherwise every part gets the page's full resource dictionary, which for
+    PDFs sharing one dictionary across all pages means a copy of every image
+    and font in every part.
+    """
+    entries = []
+    with open_pdf(input_path) as reader:
+        for name, indices in parts:
+            writer = PdfWriter()
+            for i in indices:
+                page = reader.pages[i]
+                if prune and _shares_resources(page):
+                    # 在复制进 writer 之前裁剪，未用对象就不会被克隆
+                    _prune_resources(page)
+                writer.add_page(page)
+            buffer = BytesIO()
+            with stage("encode"):
+                writer.write(buffer)
+            entries.append((name, buffer.getvalue()))
+    count(pages=sum(len(indices) for _, indices in parts))
+    return entries
+
+
+def extract_pages(
+    input_path: str, pages: str, output_path: str, prune: bool = True
+) -> int:
+    """
+    Write the pages selected by a range string to output_path, return count.
+
+    prune leaves out resources the pages never use, as in split_parts.
+    """
+    with open_pdf(input_path) as reader:
+        total_pages = len(reader.pages)
+
+        if total_pages == 0:
+            raise InvalidInputError("PDF has no pages")
+
+        parsed_pages = parse_pages(pages, total_pages)
+        if not parsed_pages:
+            raise InvalidInputError("Invalid page range")
+
+        writer = PdfWriter()
+        for page_num in parsed_pages:
+            page = reader.pages[page_num]
+            if prune and _shares_resources(page):
+                _prune_resources(page)
+            writer.add_page(page)
+        count(pages=len(parsed_pages))
+
+        with open(output_path, "wb") as f:
+            with stage("encode"):
+                writer.write(f)
+
+    return len(parsed_pages)
+
+
+# ---------- 压缩 ----------
+
+# (idnum, generation) of an image XObject in the source PDF
+ImageRef = Tuple[int, int]
+
+# 小于此尺寸的图片不值得重新编码
+MIN_RECOMPRESS_PIXELS = 64 * 64
+
+# 可由 pypdf 解码为原始像素的滤镜
+LOSSLESS_FILTERS = {
+    "/FlateDecode",
+    "/LZWDecode",
+    "/ASCII85Decode",
+    "/ASCIIHexDecode",
+    "/RunLengthDecode",
+}
+
+# JPEG 外层可以剥掉的传输编码
+TRANSPORT_FILTERS = {
+    "/ASCII85Decode": ASCII85Decode,
+    "/ASCIIHexDecode": ASCIIHexDecode,
+    "/FlateDecode": FlateDecode,
+}
+
+_NAME_RE = re.compile(rb"/([^\s/\[\]()<>{}%]+)")
+_NAME_ESCAPE_RE = re.compile(rb"#([0-9a-fA-F]{2})")
+
+
+def compression_settings(quality: int) -> Tuple[int, int]:
+    """
+    (target DPI, JPEG quality) for a 1-100 compression quality.
+
+    50 gives 150 DPI / JPEG 75, 100 gives 250 DPI / JPEG 95.
+    """
+    quality = min(100, max(1, quality))
+    return 50 + 2 * quality, min(95, quality + 25)
+
+
+def _image_xobjects(resources, seen: Set[int]) -> Iterator[Tuple[ImageRef, Any]]:
+    """Indirect image XObjects reachable from a resource dict, forms included."""
+    xobjects = resources.get("/XObject") if resources else None
+    if not xobjects:
+        return
+    for ref in xobjects.get_object().values():
+        if not isinstance(ref, IndirectObject) or ref.idnum in seen:
+            continue
+        seen.add(ref.idnum)
+        obj = ref.get_object()
+        if obj.get("/Subtype") == "/Image":
+            yield (ref.idnum, ref.generation), obj
+        elif obj.get("/Subtype") == "/Form":
+            yield from _image_xobjects(obj.get("/Resources"), seen)
+
+
+def find_images(input_path: str) -> List[Dict[str, Any]]:
+    """
+    Image XObjects worth recompressing, each with its effective DPI.
+
+    The DPI assumes the image spans the page, which is exact for scans and
+    underestimates smaller placements, so downsampling errs on the safe side.
+    An image shown on several pages keeps the lowest estimate.
+    """
+    images: Dict[ImageRef, Dict[str, Any]] = {}
+    with open_pdf(input_path) as reader:
+        for page in reader.pages:
+            page_inches = max(
+                float(page.mediabox.width) / 72, float(page.mediabox.height) / 72, 1
+            )
+            for ref, obj in _image_xobjects(page.get("/Resources"), set()):
+                width, height = int(obj.get("/Width", 0)), int(obj.get("/Height", 0))
+                if width * height < MIN_RECOMPRESS_PIXELS:
+                    continue
+                dpi = max(width, height) / page_inches
+                if ref in images:
+                    images[ref]["dpi"] = min(images[ref]["dpi"], dpi)
+                else:
+                    images[ref] = {"ref": ref, "dpi": dpi, "pixels": width * height}
+    return list(images.values())
+
+
+def _image_mode(obj) -> Optional[str]:
+    """PIL mode for the image color spaces we can re-encode losslessly in meaning."""
+    colorspace = obj.get("/ColorSpace")
+    if isinstance(colorspace, IndirectObject):
+        colorspace = colorspace.get_object()
+    if isinstance(colorspace, ArrayObject) and colorspace[0] == "/ICCBased":
+        components = colorspace[1].get_object().get("/N")
+        return {1: "L", 3: "RGB"}.get(components)
+    return {"/DeviceGray": "L", "/DeviceRGB": "RGB"}.get(colorspace)
+
+
+def _jpeg_data(obj, filters: List[str]) -> Optional[bytes]:
+    """
+    The JPEG inside a DCT image stream, None when the image is not DCT-encoded.
+
+    Leading transport filters (ASCII85 / ASCIIHex, or Flate around the JPEG,
+    as reportlab writes by default) are decoded first.
+    """
+    if not filters or filters[-1] != "/DCTDecode":
+        return None
+    parms = obj.get("/DecodeParms")
+    if not isinstance(parms, list):
+        parms = [parms] * len(filters)
+    data = obj._data
+    for name, decode_parms in zip(filters[:-1], parms):
+        decoder = TRANSPORT_FILTERS.get(name)
+        if decoder is None:
+            return None
+        if isinstance(decode_parms, IndirectObject):
+            decode_parms = decode_parms.get_object()
+        if not isinstance(decode_parms, DictionaryObject):
+            decode_parms = None
+        data = decoder.decode(data, decode_parms)
+    return data
+
+
+def _recompress_image(
+    obj, target_dpi: float, dpi: float, jpeg_quality: int
+) -> Optional[Dict[str, Any]]:
+    from PIL import Image
+
+    # 遮罩、解码数组、非 8 位图片改写后语义会变，保持原样
+    if obj.get("/ImageMask") or "/Mask" in obj or "/Decode" in obj:
+        return None
+    if obj.get("/BitsPerComponent", 8) != 8:
+        return None
+    mode = _image_mode(obj)
+    if mode is None:
+        return None
+
+    filters = obj.get("/Filter", [])
+    if not isinstance(filters, list):
+        filters = [filters]
+    width, height = int(obj["/Width"]), int(obj["/Height"])
+    scale = min(1.0, target_dpi / dpi) if dpi else 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    jpeg = _jpeg_data(obj, filters)
+    if jpeg is not None:
+        image = Image.open(BytesIO(jpeg))
+        # JPEG 在 DCT 域直接缩小解码，省去大部分像素运算
+        image.draft(mode, size)
+    elif set(filters) <= LOSSLESS_FILTERS:
+        image = Image.frombytes(mode, (width, height), obj.get_data())
+    else:
+        return None
+
+    if image.mode != mode:
+        image = image.convert(mode)
+    if scale < 0.95:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=jpeg_quality, optimize=True)
+    data = buffer.getvalue()
+    if len(data) >= len(obj._data) * 0.95:
+        return None
+    return {"data": data, "width": image.width, "height": image.height, "mode": mode}
+
+
+def recompress_images(
+    input_path: str, images: List[Dict[str, Any]], quality: int
+) -> Dict[ImageRef, Dict[str, Any]]:
+    """
+    Downsample and JPEG-encode a share of the images found by find_images.
+
+    Returns the replacements that came out smaller, keyed by image ref;
+    called once per worker so images are re-encoded in parallel.
+    """
+    target_dpi, jpeg_quality = compression_settings(quality)
+    replacements = {}
+    with open_pdf(input_path) as reader:
+        for image in images:
+            idnum, generation = image["ref"]
+            obj = reader.get_object(IndirectObject(idnum, generation, reader))
+            try:
+                result = _recompress_image(obj, target_dpi, image["dpi"], jpeg_quality)
+            except Exception:
+                # 无法解码的图片保持原样
+                continue
+            if result:
+                replacements[image["ref"]] = result
+    count(pixels=sum(image["pixels"] for image in images))
+    return replacements
+
+
+def _replace_image(obj, replacement: Dict[str, Any]):
+    obj[NameObject("/Filter")] = NameObject("/DCTDecode")
+    obj[NameObject("/Width")] = NumberObject(replacement["width"])
+    obj[NameObject("/Height")] = NumberObject(replacement["height"])
+    obj[NameObject("/BitsPerComponent")] = NumberObject(8)
+    if not isinstance(obj.get("/ColorSpace"), (ArrayObject, IndirectObject)):
+        colorspace = "/DeviceGray" if replacement["mode"] == "L" else "/DeviceRGB"
+        obj[NameObject("/ColorSpace")] = NameObject(colorspace)
+    obj.pop("/DecodeParms", None)
+    obj._data = replacement["data"]
+    obj.decoded_self = None
+
+
+def _used_names(content: bytes) -> Set[str]:
+    names = set()
+    for match in _NAME_RE.finditer(content):
+        raw = _NAME_ESCAPE_RE.sub(lambda m: bytes([int(m.group(1), 16)]), match.group(1))
+        names.add("/" + raw.decode("latin-1"))
+    return names
+
+
+def _prune_resources(page):
+    """Drop /XObject and /Font entries the page content never names."""
+    resources = page.get("/Resources")
+    contents = page.get_contents()
+    if not resources or contents is None:
+        return
+    resources = resources.get_object()
+    used = _used_names(contents.get_data())
+
+    xobjects = resources.get("/XObject")
+    xobjects = xobjects.get_object() if xobjects else {}
+    for name in used & set(xobjects):
+        obj = xobjects[name].get_object()
+        if obj.get("/Subtype") == "/Form" and "/Resources" not in obj:
+            # 无自带资源的表单沿用页面资源，无法安全裁剪
+            return
+
+    pruned = DictionaryObject(resources)
+    changed = False
+    for category in ("/XObject", "/Font"):
+        entries = resources.get(category)
+        if not entries:
+            continue
+        entries = entries.get_object()
+        kept = DictionaryObject({k: v for k, v in entries.items() if k in used})
+        if len(kept) < len(entries):
+            pruned[NameObject(category)] = kept
+            changed = True
+    if changed:
+        # 资源字典可能被多页共享，替换为本页副本而不是原地修改
+        page[NameObject("/Resources")] = pruned
+
+
+def _shares_resources(page) -> bool:
+    """Whether the page may list fonts or XObjects that only other pages use."""
+    resources = page.get("/Resources")
+    if not resources:
+        return False
+    resources = resources.get_object()
+    # 只有被多页共享（间接引用）的资源字典才可能带有别页的资源
+    shared = isinstance(page.raw_get("/Resources"), IndirectObject)
+    entries = 0
+    for category in ("/XObject", "/Font"):
+        if category in resources:
+            shared = shared or isinstance(resources.raw_get(category), IndirectObject)
+            entries += len(resources[category])
+    return shared and entries > 1
+
+
+def _remap_references(obj, remap: Dict[int, IndirectObject]):
+    # pypdf 对象类的 isinstance 走 Protocol 检查，很慢；这里用内置类型判断
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, list):
+        items = enumerate(obj)
+    else:
+        return
+    for key, value in list(items):
+        if type(value) is IndirectObject:
+            if value.idnum in remap:
+                obj[key] = remap[value.idnum]
+        elif isinstance(value, (dict, list)):
+            _remap_references(value, remap)
+
+
+# 内容相同即可共享的字典类型
+SHAREABLE_TYPES = {"/Font", "/FontDescriptor", "/ExtGState", "/Encoding"}
+
+
+def _dedupe_key(obj) -> Optional[bytes]:
+    if isinstance(obj, StreamObject):
+        # 字典部分 + 原始（未解码）流数据的摘要
+        header = repr(sorted(obj.items(), key=lambda item: item[0])).encode()
+        return b"stream:" + header + hashlib.sha1(obj._data).digest()
+    if isinstance(obj, DictionaryObject) and obj.get("/Type") in SHAREABLE_TYPES:
+        return ("dict:" + repr(sorted(obj.items(), key=lambda item: item[0]))).encode()
+    if isinstance(obj, ArrayObject):
+        return ("array:" + repr(obj)).encode()
+    return None
+
+
+def _dedupe_objects(writer: PdfWriter, max_passes: int = 4) -> int:
+    """
+    Point references to identical objects at one copy, return duplicates dropped.
+
+    Streams (font files, images, ICC profiles) and arrays are compared first;
+    fonts and descriptors that only become identical once their streams are
+    shared are caught by the following passes.
+    """
+    dropped = 0
+    for _ in range(max_passes):
+        canonical: Dict[bytes, IndirectObject] = {}
+        remap: Dict[int, IndirectObject] = {}
+        for i, obj in enumerate(writer._objects):
+            key = _dedupe_key(obj)
+            if key is None:
+                continue
+            if key in canonical:
+                remap[i + 1] = canonical[key]
+            else:
+                canonical[key] = IndirectObject(i + 1, 0, writer)
+        if not remap:
+            break
+        for obj in writer._objects:
+            _remap_references(obj, remap)
+        for idnum in remap:
+            # xref 按序号连续写出，重复对象替换为 null 占位
+            writer._objects[idnum - 1] = NullObject()
+        dropped += len(remap)
+    return dropped
+
+
+def compress_pdf(
+    input_path: str,
+    output_path: str,
+    images: Optional[Dict[ImageRef, Dict[str, Any]]] = None,
+) -> int:
+    """
+    Write a compressed copy of input_path, return the output size.
+
+    images are the replacements produced by recompress_images. Beyond
+    swapping those in, unused page resources are dropped, content and
+    unfiltered streams are Flate-compressed and identical streams are
+    stored once.
+    """
+    with open_pdf(input_path) as reader:
+        for (idnum, generation), replacement in (images or {}).items():
+            _replace_image(
+                reader.get_object(IndirectObject(idnum, generation, reader)),
+                replacement,
+            )
+
+        writer = PdfWriter()
+
+        # 在复制进 writer 之前裁剪未用资源，未用对象就不会被克隆写出
+        for page in reader.pages:
+            _prune_resources(page)
+            writer.add_page(page)
+        count(pages=len(writer.pages))
+
+        for page in writer.pages:
+            page.compress_content_streams()
+
+        for i, obj in enumerate(writer._objects):
+            if isinstance(obj, StreamObject) and "/Filter" not in obj:
+                writer._objects[i] = obj.flate_encode()
+
+        _dedupe_objects(writer)
+
+        with open(output_path, "wb") as output_file:
+            with stage("encode"):
+                writer.write(output_file)
+
+    # 已经足够紧凑的文件，重写反而变大时原样返回
+    if os.path.getsize(output_path) >= os.path.getsize(input_path):
+        shutil.copyfile(input_path, output_path)
+
+    return os.path.getsize(output_path)
+
+
+def watermark_pdf(
+    input_path: str,
+    output_path: str,
+    options: Dict[str, Any],
+    pages: Optional[str] = None,
+) -> int:
+    """
+    Stamp the watermark (see watermark.py) on the chosen pages, return how many.
+
+    One overlay is built per distinct page size and merged onto every page of
+    that size, so its font and logo are embedded once.
+    """
+    with open_pdf(input_path) as reader:
+        total = len(reader.pages)
+        try:
+            selected = set(select_pages(total, pages))
+        except ValueError:
+            raise InvalidInputError("Invalid page range")
+        if not selected:
+            raise InvalidInputError("Invalid page range")
+
+        writer = PdfWriter()
+        overlays = {}
+        for number, page in enumerate(reader.pages, 1):
+            if number in selected:
+                # 旋转页先把旋转并入内容，水印按可见方向绘制
+                if page.rotation:
+                    page.transfer_rotation_to_content()
+                box = page.cropbox
+                size = (float(box.width), float(box.height))
+                if size not in overlays:
+                    overlay = watermark.pdf_overlay(*size, options)
+                    overlays[size] = PdfReader(BytesIO(overlay)).pages[0]
+                page.merge_transformed_page(
+                    overlays[size],
+                    Transformation().translate(float(box.left), float(box.bottom)),
+                )
+                # 合并后的内容流未压缩，写出前重新 Flate 编码
+                writer.add_page(page).compress_content_streams()
+            else:
+                writer.add_page(page)
+        count(pages=total)
+
+        with open(output_path, "wb") as output_file:
+            with stage("encode"):
+                writer.write(output_file)
+
+    return len(selected)
+
+
+# ---------- 文档信息 ----------
+
+METADATA_FIELDS = ["title", "author", "subject", "creator", "producer"]
+INHERITED_PAGE_KEYS = ("/MediaBox", "/CropBox", "/Rotate", "/Resources")
+
+
+def _page_nodes(pages_node) -> Iterator[Dict[str, Any]]:
+    """Leaf page dictionaries with inherited attributes resolved, in order."""
+    stack = [(pages_node, {})]
+    seen: Set[int] = set()
+    while stack:
+        node, inherited = stack.pop()
+        node = node.get_object()
+        if id(node) in seen:
+            # 损坏的页面树可能成环
+            continue
+        seen.add(id(node))
+        attributes = dict(inherited)
+        for key in INHERITED_PAGE_KEYS:
+            if key in node:
+                attributes[key] = node[key]
+        kids = node.get("/Kids")
+        if node.get("/Type") == "/Pages" or kids is not None:
+            stack.extend((kid, attributes) for kid in reversed(kids or []))
+        else:
+            yield attributes
+
+
+def _resource_summary(resources, seen: Set[int]) -> Tuple[int, bool]:
+    """(image XObjects, whether any fonts are declared) reachable from resources."""
+    if not resources:
+        return 0, False
+    resources = resources.get_object()
+    images, fonts = 0, bool(resources.get("/Font"))
+    xobjects = resources.get("/XObject")
+    for ref in xobjects.get_object().values() if xobjects else ():
+        if not isinstance(ref, IndirectObject) or ref.idnum in seen:
+            continue
+        seen.add(ref.idnum)
+        obj = ref.get_object()
+        if obj.get("/Subtype") == "/Image":
+            images += 1
+        elif obj.get("/Subtype") == "/Form":
+            form_images, form_fonts = _resource_summary(obj.get("/Resources"), seen)
+            images += form_images
+            fonts = fonts or form_fonts
+    return images, fonts
+
+
+def _page_size(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    """Displayed width and height in points, and the rotation."""
+    box = attributes.get("/CropBox") or attributes.get("/MediaBox") or [0, 0, 612, 792]
+    x0, y0, x1, y1 = (float(value) for value in box)
+    rotation = int(attributes.get("/Rotate", 0)) % 360
+    width, height = round(abs(x1 - x0), 2), round(abs(y1 - y0), 2)
+    if rotation in (90, 270):
+        width, height = height, width
+    return {"width": width, "height": height, "rotation": rotation}
+
+
+def _page_summary(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    images, fonts = _resource_summary(attributes.get("/Resources"), set())
+    return {
+        **_page_size(attributes),
+        "images": images,
+        # 没有声明字体的页面不可能绘制文字
+        "image_only": images > 0 and not fonts,
+    }
+
+
+def pdf_info(input_path: str, detail: bool = False) -> Dict[str, Any]:
+    """
+    Document summary from the trailer, catalog, Info dictionary and page tree.
+
+    Content streams are never decoded: the page count is the page tree's
+    /Count and sizes come from the page dictionaries. detail adds one entry
+    per page (size in points as displayed, rotation, image XObjects declared
+    in its resources, image_only when it has images and no fonts).
+    Encrypted files are opened with the empty user password when possible;
+    otherwise only the version and encryption status are known.
+    """
+    with open_pdf(input_path) as reader:
+        version = reader.pdf_header.replace("%PDF-", "")
+        encrypted = reader.is_encrypted
+        info: Dict[str, Any] = {
+            "pages": None,
+            "version": version,
+            "encrypted": encrypted,
+            "password_required": False,
+            "metadata": {},
+        }
+        if encrypted:
+            try:
+                readable = bool(reader.decrypt(""))
+            except Exception:
+                readable = False
+            if not readable:
+                info["password_required"] = True
+                return info
+
+        root = reader.trailer["/Root"].get_object()
+        # 目录中的 /Version 可以覆盖文件头中的版本
+        catalog_version = str(root.get("/Version", "")).lstrip("/")
+        if catalog_version > version:
+            info["version"] = catalog_version
+
+        pages_node = root["/Pages"]
+        info["pages"] = int(pages_node.get_object().get("/Count", 0))
+
+        metadata = reader.metadata
+        if metadata:
+            info["metadata"] = {
+                field: metadata.get("/" + field.capitalize(), "")
+                for field in METADATA_FIELDS
+            }
+
+        first = next(_page_nodes(pages_node), None)
+        if first is not None:
+            info["page_size"] = _page_size(first)
+
+        if detail:
+            info["page_details"] = [
+                _page_summary(attributes) for attributes in _page_nodes(pages_node)
+            ]
+            info["pages"] = len(info["page_details"])
+            count(pages=info["pages"])
+
+    return info
+
+
+def render_pages(
+    input_path: str, dpi: int, output_format: str, first_page: int, last_page: int
+) -> List[Tuple[str, bytes]]:
+    """
+    Rasterize pages first_page..last_page (1-based, inclusive) to encoded images.
+
+    Called once per batch, so only one batch of decoded pages is resident in
+    this worker; encoding happens here too, in parallel across workers.
+    """
+    from pdf2image import convert_from_path
+
+    with stage("render"):
+        images = convert_from_path(
+            input_path, dpi=dpi, first_page=first_page, last_page=last_page
+        )
+    count(
+        pages=len(images), pixels=sum(image.width * image.height for image in images)
+    )
+
+    entries = []
+    while images:
+        # 逐页编码并释放位图，批内内存随编码递减
+        image = images.pop(0)
+        i = len(entries)
+        img_buffer = BytesIO()
+        with stage("encode"):
+            if output_format in ["jpg", "jpeg"]:
+                image = image.convert("RGB")
+                image.save(img_buffer, format="JPEG", quality=95)
+                ext = "jpg"
+            else:
+                image.save(img_buffer, format="PNG")
+                ext = "png"
+        entries.append((f"page_{first_page + i}.{ext}", img_buffer.getvalue()))
+
+    return entries
+
+
+def images_to_pdf(input_paths: List[str], output_path: str) -> int:
+    """Combine images into one PDF, return the page count."""
+    from PIL import Image
+
+    images = []
+    for path in input_paths:
+        img = Image.open(path)
+        if img.mode == "RGBA":
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        images.append(img)
+
+    if not images:
+        raise InvalidInputError("Could not process images")
+    count(pages=len(images), pixels=sum(img.width * img.height for img in images))
+
+    with stage("encode"):
+        images[0].save(
+            output_path,
+            save_all=True,
+            append_images=images[1:],
+            resolution=100.0,
+            quality=95,
+        )
+
+    return len(images)
+
+
+# ---------- 转 Word ----------
+
+
+@contextmanager
+def time_limit(seconds: Optional[float], message: str):
+    """
+    Raise ConversionTimeout from the block once seconds have passed.
+
+    Uses SIGALRM, so it only works in the main thread of a pool worker; the
+    worker survives and takes the next task. Code stuck inside a C call is
+    interrupted only when it returns to Python, so callers also bound the
+    task from outside (see WorkerPools.run_limited).
+    """
+    if not seconds:
+        yield
+        return
+
+    def expire(signum, frame):
+        raise ConversionTimeout(message)
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def timeout_message(pages: List[int], page_timeout: Optional[float]) -> str:
+    """The ConversionTimeout message for pages (0-based)."""
+    first, last = pages[0] + 1, pages[-1] + 1
+    label = f"Page {first}" if first == last else f"Pages {first}-{last}"
+    return f"{label} could not be converted within {page_timeout}s per page"
+
+
+def _parse_word(cv, pages: List[int], page_timeout: Optional[float]):
+    settings = cv.default_settings
+    with stage("parse"), time_limit(
+        page_timeout and page_timeout * len(pages),
+        timeout_message(pages, page_timeout),
+    ):
+        cv.parse(pages=pages, **settings)
+    count(pages=len(pages))
+    return settings
+
+
+def parse_word_pages(
+    input_path: str, pages: List[int], output_path: str, page_timeout: Optional[float]
+) -> int:
+    """
+    Lay out pages (0-based) with pdf2docx and store the parsed pages as JSON
+    at output_path, for make_word to assemble. Returns the pages stored.
+    """
+    from pdf2docx import Converter
+
+    cv = Converter(input_path)
+    try:
+        _parse_word(cv, pages, page_timeout)
+        with stage("encode"):
+            cv.serialize(output_path)
+    finally:
+        cv.close()
+    return len(pages)
+
+
+def make_word(input_path: str, parsed_paths: List[str], output_path: str):
+    """Assemble the pages stored by parse_word_pages, in order, into one .docx."""
+    from pdf2docx import Converter
+
+    cv = Converter(input_path)
+    try:
+        settings = cv.default_settings
+        for path in parsed_paths:
+            cv.deserialize(path)
+        with stage("encode"):
+            cv.make_docx(output_path, **settings)
+    finally:
+        cv.close()
+
+
+def pdf_to_word(
+    input_path: str,
+    output_path: str,
+    pages: Optional[List[int]] = None,
+    page_timeout: Optional[float] = None,
+):
+    """Convert pages (0-based, default all) of input_path to a .docx at output_path."""
+    from pdf2docx import Converter
+
+    cv = Converter(input_path)
+    try:
+        if pages is None:
+            pages = list(range(len(cv.fitz_doc)))
+        settings = _parse_word(cv, pages, page_timeout)
+        with stage("encode"):
+            cv.make_docx(output_path, **settings)
+    finally:
+        cv.close()
+
+
+def protect_pdf(input_path: str, password: str, output_path: str):
+    with open_pdf(input_path) as reader:
+        writer = PdfWriter()
+
+        for page in reader.pages:
+            writer.add_page(page)
+
+        count(pages=len(writer.pages))
+        writer.encrypt(password)
+
+        with open(output_path, "wb") as output_file:
+            with stage("encode"):
+                writer.write(output_file)
+
+
+def unlock_pdf(input_path: str, password: str, output_path: str):
+    with open_pdf(input_path) as reader:
+        if reader.is_encrypted:
+            reader.decrypt(password)
+
+        writer = PdfWriter()
+
+        for page in reader.pages:
+            writer.add_page(page)
+        count(pages=len(writer.pages))
+
+        with open(output_path, "wb") as output_file:
+            with stage("encode"):
+                writer.write(output_file)
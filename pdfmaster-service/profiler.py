@@ -0,0 +1,230 @@
+"""
+On-demand sampling profiler for the live service.
+
+GET /admin/profile?seconds=N samples the Python stacks of every thread in
+every serving process and every executor pool process for N seconds and
+returns them in the collapsed ("folded") format that flamegraph.pl, inferno,
+speedscope and similar tools read: one line per distinct stack, frames
+separated by ";", followed by its sample count. Each stack is rooted at its
+process (e.g. "server[12]", "render[34]") and thread.
+
+Nothing is sampled until a profile is requested. The request is a small file
+under TEMP_DIR/profiles that a watcher thread in each process picks up (see
+start_watcher), so a multi-process server (server.py) profiles all of its
+processes whichever one takes the request. Threads blocked waiting for work
+(idle pool workers, the event loop in select) are left out unless idle=true.
+
+Settings (environment):
+
+    PROFILE_TOKEN          required as "Authorization: Bearer <token>"; unset
+                           disables the endpoint (404)
+    PROFILE_MAX_SECONDS    longest profile (default 60)
+    PROFILE_INTERVAL_MS    default sampling interval (10)
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 池进程也会导入本模块，不能依赖 scratch / executor（避免循环导入）
+PROFILE_DIR = os.path.join(os.environ.get("TEMP_DIR", "/tmp/pdfmaster"), "profiles")
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "10"))
+
+# watcher 检查新请求的间隔；收集结果时也据此多等一会
+POLL_SECONDS = 0.5
+MAX_DEPTH = 256
+
+# (文件名, 函数名)：线程停在这些帧上表示在等待任务
+# （runners.py:run 为 uvloop 空转，thread.py:_worker 为空闲的线程池 worker）
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("runners.py", "run"),
+    ("thread.py", "_worker"),
+    ("connection.py", "_recv"),
+    ("connection.py", "_poll"),
+    ("queue.py", "get"),
+}
+
+
+# ---------- 采样 ----------
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame, depth: int = MAX_DEPTH) -> list:
+    frames = []
+    while frame is not None and len(frames) < depth:
+        frames.append(frame.f_code)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _is_idle(code) -> bool:
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def sample(
+    until: float, interval: float, process: str, idle: bool = False
+) -> Counter:
+    """Sample every other thread of this process until the wall clock reaches until."""
+    me = threading.get_ident()
+    counts: Counter = Counter()
+    while time.time() < until:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            codes = _stack(frame)
+            if not codes or (not idle and _is_idle(codes[-1])):
+                continue
+            thread = names.get(ident, str(ident)).replace(";", ":")
+            key = ";".join(
+                [process, thread, *(_frame_name(code).replace(";", ":") for code in codes)]
+            )
+            counts[key] += 1
+        # 不持有其他线程的帧，避免延长其生命周期
+        frame = None
+        time.sleep(interval)
+    return counts
+
+
+# ---------- 进程内 watcher ----------
+
+
+def _respond(profile_id: str, request: Dict, process: str):
+    counts = sample(
+        request["until"], request["interval"], process, request.get("idle", False)
+    )
+    directory = os.path.join(PROFILE_DIR, profile_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{process}.folded")
+    with open(path + ".tmp", "w") as f:
+        for stack, samples in counts.items():
+            f.write(f"{stack} {samples}\n")
+    os.replace(path + ".tmp", path)
+
+
+def _watch(process: str):
+    seen = set()
+    while True:
+        time.sleep(POLL_SECONDS)
+        try:
+            names = os.listdir(PROFILE_DIR)
+        except FileNotFoundError:
+            continue
+        requests = {
+            profile_id
+            for profile_id, ext in map(os.path.splitext, names)
+            if ext == ".json"
+        }
+        # 请求文件由 collect_profile 删除后不再记着，seen 不随运行时间增长
+        seen &= requests
+        for profile_id in requests - seen:
+            seen.add(profile_id)
+            name = profile_id + ".json"
+            try:
+                with open(os.path.join(PROFILE_DIR, name)) as f:
+                    request = json.load(f)
+                if request["until"] > time.time():
+                    _respond(profile_id, request, process)
+            except Exception as e:
+                logger.warning(f"Profile {profile_id} failed in {process}: {str(e)}")
+
+
+_watcher: Optional[threading.Thread] = None
+
+
+def start_watcher(role: str = "server"):
+    """
+    Start the thread answering profile requests in this process.
+
+    Used as the initializer of the executor's process pools and called once
+    by each serving process at startup. Without PROFILE_TOKEN the endpoint is
+    disabled and no watcher is started.
+    """
+    global _watcher
+    if PROFILE_TOKEN and _watcher is None:
+        process = f"{role}[{os.getpid()}]"
+        _watcher = threading.Thread(
+            target=_watch, args=(process,), name="pdfmaster-profiler", daemon=True
+        )
+        _watcher.start()
+
+
+# ---------- 请求方 ----------
+
+
+def request_profile(seconds: float, interval: float, idle: bool = False) -> str:
+    """Ask every process to sample for seconds; returns the profile id."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+    request = {
+        "until": time.time() + POLL_SECONDS + seconds,
+        "interval": interval,
+        "idle": idle,
+    }
+    path = os.path.join(PROFILE_DIR, profile_id + ".json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(request, f)
+    os.replace(path + ".tmp", path)
+    return profile_id
+
+
+def collect_profile(profile_id: str) -> str:
+    """Merge the stacks every process wrote for profile_id, then remove them."""
+    directory = os.path.join(PROFILE_DIR, profile_id)
+    counts: Counter = Counter()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.endswith(".folded"):
+            with open(path) as f:
+                for line in f:
+                    stack, _, samples = line.rstrip("\n").rpartition(" ")
+                    counts[stack] += int(samples)
+        os.remove(path)
+    for remove, path in (
+        (os.rmdir, directory),
+        (os.remove, os.path.join(PROFILE_DIR, profile_id + ".json")),
+    ):
+        try:
+            remove(path)
+        except OSError:
+            pass
+    return "".join(f"{stack} {samples}\n" for stack, samples in counts.most_common())
+
+
+def active() -> bool:
+    """Whether a profile is being taken (at most one at a time)."""
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return False
+    now = time.time()
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                if json.load(f)["until"] > now:
+                    return True
+        except (OSError, ValueError, KeyError):
+            continue
+    return False
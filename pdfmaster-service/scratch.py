@@ -0,0 +1,178 @@
+"""
+TEMP_DIR lifecycle: post-response cleanup, TTL sweeper and disk quota.
+
+Settings (environment):
+
+    TEMP_DIR                 scratch directory (default /tmp/pdfmaster)
+    TEMP_FILE_TTL_SECONDS    age after which the sweeper deletes a file (3600)
+    TEMP_SWEEP_INTERVAL      seconds between sweeps (60)
+    TEMP_DIR_QUOTA_MB        max bytes kept in TEMP_DIR, 0 = unlimited (2048)
+    TEMP_MIN_FREE_MB         min free space on the volume before shedding (512)
+
+When the quota or free-space floor is hit, new work is refused with 503 and a
+Retry-After header until the sweeper or finished responses free space again.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from starlette.background import BackgroundTask
+
+from executor import pools
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+TEMP_DIR = os.environ.get("TEMP_DIR", "/tmp/pdfmaster")
+TEMP_FILE_TTL_SECONDS = int(os.environ.get("TEMP_FILE_TTL_SECONDS", "3600"))
+TEMP_SWEEP_INTERVAL = int(os.environ.get("TEMP_SWEEP_INTERVAL", "60"))
+TEMP_DIR_QUOTA_BYTES = int(os.environ.get("TEMP_DIR_QUOTA_MB", "2048")) * MB
+TEMP_MIN_FREE_BYTES = int(os.environ.get("TEMP_MIN_FREE_MB", "512")) * MB
+
+
+class ScratchStorage:
+    """Owns every file the service writes under TEMP_DIR."""
+
+    def __init__(
+        self,
+        directory: str,
+        ttl_seconds: int = TEMP_FILE_TTL_SECONDS,
+        sweep_interval: int = TEMP_SWEEP_INTERVAL,
+        quota_bytes: int = TEMP_DIR_QUOTA_BYTES,
+        min_free_bytes: int = TEMP_MIN_FREE_BYTES,
+    ):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+
+        self.usage_bytes = 0
+        self.usage_files = 0
+        self.removed = {"response": 0, "ttl": 0}
+        self.removed_bytes = {"response": 0, "ttl": 0}
+        self.shed = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    # ---------- 清理 ----------
+
+    def remove(self, *paths: str, reason: str = "response"):
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Could not remove {path}: {str(e)}")
+                continue
+            self.removed[reason] += 1
+            self.removed_bytes[reason] += size
+            self.usage_bytes = max(0, self.usage_bytes - size)
+            self.usage_files = max(0, self.usage_files - 1)
+
+    def cleanup(self, *paths: str) -> BackgroundTask:
+        """Background task deleting paths once the response has been sent."""
+        # 计入用量，直到发送完成后删除（两次 sweep 之间保持配额准确）
+        for path in paths:
+            try:
+                self.usage_bytes += os.path.getsize(path)
+                self.usage_files += 1
+            except OSError:
+                pass
+        return BackgroundTask(self.remove, *paths)
+
+    def sweep(self) -> int:
+        """Delete files older than the TTL and refresh usage, return count removed."""
+        cutoff = time.time() - self.ttl_seconds
+        expired = []
+        usage_bytes = 0
+        usage_files = 0
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime < cutoff:
+                    expired.append(entry.path)
+                else:
+                    usage_bytes += stat.st_size
+                    usage_files += 1
+
+        before = self.removed["ttl"]
+        self.remove(*expired, reason="ttl")
+        self.usage_bytes = usage_bytes
+        self.usage_files = usage_files
+        return self.removed["ttl"] - before
+
+    async def _sweep_forever(self):
+        while True:
+            try:
+                count = await pools.run("io", self.sweep)
+                if count:
+                    logger.info(f"Swept {count} expired files from {self.directory}")
+            except Exception as e:
+                logger.error(f"Scratch sweep failed: {str(e)}")
+            await asyncio.sleep(self.sweep_interval)
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_running_loop().create_task(
+                self._sweep_forever()
+            )
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    # ---------- 配额 ----------
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.directory).free
+
+    def ensure_capacity(self):
+        """Refuse new work with 503 when TEMP_DIR is over quota or the disk is nearly full."""
+        over_quota = self.quota_bytes and self.usage_bytes >= self.quota_bytes
+        if over_quota or self.free_bytes() < self.min_free_bytes:
+            self.shed += 1
+            logger.warning(
+                f"Shedding request: scratch usage {self.usage_bytes} bytes, "
+                f"free {self.free_bytes()} bytes"
+            )
+            raise HTTPException(
+                status_code=503,
+                detail="Server storage is busy, please retry shortly",
+                headers={"Retry-After": str(self.sweep_interval)},
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "usage_bytes": self.usage_bytes,
+            "usage_files": self.usage_files,
+            "quota_bytes": self.quota_bytes,
+            "free_bytes": self.free_bytes(),
+            "removed_files": dict(self.removed),
+            "removed_bytes": dict(self.removed_bytes),
+            "shed_requests": self.shed,
+        }
+
+
+scratch = ScratchStorage(TEMP_DIR)
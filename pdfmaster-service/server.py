@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Production server: a pre-forking supervisor around uvicorn.
+
+The supervisor imports the application once (FastAPI, pypdf, PIL, reportlab),
+binds the listening socket and forks the serving processes, which share those
+pages copy-on-write and accept from the same socket. The executor pools of
+each serving process are forked from a forkserver that has preloaded the
+transform modules (see executor.py), so pool workers share them as well
+instead of importing them again. A serving process is
+recycled after a number of requests or when its process tree (itself plus its
+executor pools) grows past an RSS limit: the replacement is forked first, then
+the old process stops accepting, drains in-flight requests and queued jobs,
+and exits.
+
+    python server.py [--host 0.0.0.0] [--port 8000]
+
+Settings (environment):
+
+    SERVER_WORKERS              serving processes (default: auto, one per core
+                                within SERVER_WORKER_MEMORY_MB each)
+    SERVER_WORKER_MEMORY_MB     memory budgeted per serving process for the
+                                auto size (default 768)
+    SERVER_MAX_REQUESTS         requests before a process is recycled
+                                (default 10000, 0 = never)
+    SERVER_MAX_REQUESTS_JITTER  random extra requests per process so they do
+                                not all recycle at once (default 1000)
+    SERVER_MAX_RSS_MB           process-tree RSS that triggers recycling
+                                (default: memory limit / workers, 0 = never)
+    SERVER_RSS_CHECK_SECONDS    interval between RSS checks (default 10)
+    SERVER_GRACEFUL_TIMEOUT     seconds in-flight requests get to finish when a
+                                process stops (default 30); queued jobs get
+                                another JOB_DRAIN_SECONDS (see jobs.py)
+
+Serving processes warm their pools before accepting connections (WARMUP_WAIT,
+see warmup.py), so a replacement takes no traffic while cold.
+
+SIGTERM / SIGINT stop every process gracefully; SIGHUP recycles all of them,
+replacements first. Code is preloaded, so new code needs a full restart. Job
+state is shared through TEMP_DIR (see jobs.py). Metrics are merged across
+processes through METRICS_DIR (default TEMP_DIR/metrics, see metrics.py), so
+any process answers /metrics for all of them and counters of recycled
+processes are kept; the result cache index stays per process.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+import uvicorn
+
+logger = logging.getLogger("pdfmaster.server")
+
+MB = 1024 * 1024
+CPU_COUNT = os.cpu_count() or 1
+
+SERVER_WORKER_MEMORY_BYTES = (
+    int(os.environ.get("SERVER_WORKER_MEMORY_MB", "768")) * MB
+)
+SERVER_MAX_REQUESTS = int(os.environ.get("SERVER_MAX_REQUESTS", "10000"))
+SERVER_MAX_REQUESTS_JITTER = int(
+    os.environ.get("SERVER_MAX_REQUESTS_JITTER", "1000")
+)
+SERVER_RSS_CHECK_SECONDS = float(os.environ.get("SERVER_RSS_CHECK_SECONDS", "10"))
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", "30"))
+
+# 进程退出过快视为启动失败，避免无限快速重启
+MIN_WORKER_LIFETIME = 5.0
+RESTART_BACKOFF = 2.0
+# 停止监听后等待刚被接受的连接送达请求，再关闭空闲连接
+ACCEPT_GRACE_SECONDS = 1.0
+
+
+def memory_limit() -> Optional[int]:
+    """Bytes available to this container: the cgroup limit, else physical memory."""
+    for path in (
+        "/sys/fs/cgroup/memory.max",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup 未设限时为 "max" 或一个接近 2^63 的值
+        if value.isdigit() and int(value) < 1 << 50:
+            return int(value)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError):
+        return None
+
+
+def auto_workers(limit: Optional[int]) -> int:
+    if not limit:
+        return CPU_COUNT
+    return max(1, min(CPU_COUNT, limit // SERVER_WORKER_MEMORY_BYTES))
+
+
+def tree_rss(pid: int) -> int:
+    """Resident bytes of pid and all of its descendants."""
+    total = 0
+    stack = [pid]
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn closes connections without a request in progress as soon as it
+    stops listening, which resets connections accepted a moment earlier whose
+    request has not arrived yet; give those a moment first.
+    """
+
+    async def shutdown(self, sockets=None):
+        for server in self.servers:
+            server.close()
+        await asyncio.sleep(ACCEPT_GRACE_SECONDS)
+        await super().shutdown(sockets)
+
+
+class Worker:
+    """A forked serving process and the reason it is being stopped, if any."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.started = time.monotonic()
+        self.stopping: Optional[str] = None
+        self.stop_deadline = 0.0
+
+
+class Supervisor:
+    def __init__(
+        self,
+        app,
+        sock: socket.socket,
+        workers: int,
+        max_rss: int,
+        kill_after: float,
+    ):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.max_rss = max_rss
+        self.kill_after = kill_after
+
+        self.children: Dict[int, Worker] = {}
+        self.shutting_down = False
+        self.recycle_all = False
+        self.recycled = {"requests": 0, "rss": 0, "signal": 0, "crash": 0}
+
+    # ---------- 子进程 ----------
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = Worker(pid)
+            logger.info(f"Started worker {pid}")
+            return
+        try:
+            self._serve()
+        except Exception:
+            logger.exception("Worker failed")
+            os._exit(1)
+        # 正常退出（而非 os._exit），让进程池和 multiprocessing 完成清理
+        sys.exit(0)
+
+    def _serve(self):
+        # 恢复默认信号处理，uvicorn 会安装自己的处理器
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, signal.SIG_DFL)
+        random.seed()
+
+        limit = None
+        if SERVER_MAX_REQUESTS:
+            limit = SERVER_MAX_REQUESTS + random.randint(0, SERVER_MAX_REQUESTS_JITTER)
+        config = uvicorn.Config(
+            self.app,
+            limit_max_requests=limit,
+            timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+            log_config=None,
+        )
+        DrainingServer(config).run(sockets=[self.sock])
+
+    def stop(self, worker: Worker, reason: str):
+        if worker.stopping:
+            return
+        worker.stopping = reason
+        worker.stop_deadline = time.monotonic() + self.kill_after
+        self.recycled[reason] = self.recycled.get(reason, 0) + 1
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        # metrics 依赖 main() 设置的环境变量，不能在模块顶部导入
+        from metrics import archive_process
+
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            worker = self.children.pop(pid, None)
+            if worker is None:
+                continue
+            # 计数器并入归档，退出进程的请求数不会从 /metrics 中消失
+            archive_process(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if worker.stopping:
+                logger.info(f"Worker {pid} exited ({worker.stopping})")
+            elif code == 0:
+                # uvicorn 达到 limit_max_requests 后自行优雅退出
+                self.recycled["requests"] += 1
+                logger.info(f"Worker {pid} recycled after its request limit")
+            else:
+                self.recycled["crash"] += 1
+                logger.error(f"Worker {pid} died with exit code {code}")
+                if time.monotonic() - worker.started < MIN_WORKER_LIFETIME:
+                    time.sleep(RESTART_BACKOFF)
+
+    def replace(self, worker: Worker, reason: str):
+        # 先启动替补，再让旧进程排空退出
+        self.spawn()
+        self.stop(worker, reason)
+
+    def serving(self):
+        return [worker for worker in self.children.values() if not worker.stopping]
+
+    # ---------- 主循环 ----------
+
+    def kill_overdue(self):
+        now = time.monotonic()
+        for worker in self.children.values():
+            if worker.stopping and now > worker.stop_deadline:
+                logger.warning(f"Worker {worker.pid} did not drain in time, killing")
+                try:
+                    os.kill(worker.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def check_memory(self):
+        for worker in self.serving():
+            rss = tree_rss(worker.pid)
+            if rss > self.max_rss:
+                logger.warning(
+                    f"Worker {worker.pid} uses {rss // MB} MB "
+                    f"(limit {self.max_rss // MB} MB), recycling"
+                )
+                self.replace(worker, "rss")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_hup)
+
+        logger.info(
+            f"Supervisor {os.getpid()} serving with {self.workers} workers, "
+            f"max requests {SERVER_MAX_REQUESTS or 'unlimited'}, "
+            f"max RSS {self.max_rss // MB if self.max_rss else 'unlimited'} MB"
+        )
+        next_memory_check = time.monotonic() + SERVER_RSS_CHECK_SECONDS
+        while not self.shutting_down:
+            self.reap()
+            while len(self.serving()) < self.workers:
+                self.spawn()
+            if self.recycle_all:
+                self.recycle_all = False
+                for worker in self.serving():
+                    self.replace(worker, "signal")
+            if self.max_rss and time.monotonic() >= next_memory_check:
+                next_memory_check = time.monotonic() + SERVER_RSS_CHECK_SECONDS
+                self.check_memory()
+            self.kill_overdue()
+            time.sleep(0.5)
+
+        logger.info("Shutting down workers")
+        for worker in list(self.children.values()):
+            self.stop(worker, "shutdown")
+        while self.children:
+            self.reap()
+            self.kill_overdue()
+            time.sleep(0.2)
+        logger.info(f"Supervisor stopped, workers recycled: {self.recycled}")
+
+    def _on_stop(self, signum, frame):
+        self.shutting_down = True
+
+    def _on_hup(self, signum, frame):
+        self.recycle_all = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    limit = memory_limit()
+    workers = int(os.environ.get("SERVER_WORKERS") or 0) or auto_workers(limit)
+    max_rss = int(os.environ.get("SERVER_MAX_RSS_MB", "-1")) * MB
+    if max_rss < 0:
+        max_rss = limit // workers if limit else 0
+    # 执行器按服务进程数划分进程池大小，必须在导入应用之前设置
+    os.environ["SERVER_WORKERS"] = str(workers)
+    # 新进程预热完成后才开始接受连接，其余进程照常服务
+    os.environ.setdefault("WARMUP_WAIT", "1")
+    # 各进程的指标经此目录合并
+    os.environ.setdefault(
+        "METRICS_DIR",
+        os.path.join(os.environ.get("TEMP_DIR", "/tmp/pdfmaster"), "metrics"),
+    )
+
+    # 预加载应用及其依赖，fork 后各 worker 以写时复制方式共享
+    from main import app
+
+    from metrics import reset_process_files
+
+    reset_process_files()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    logger.info(f"Listening on {args.host}:{args.port}")
+
+    from jobs import JOB_DRAIN_SECONDS
+
+    kill_after = SERVER_GRACEFUL_TIMEOUT + JOB_DRAIN_SECONDS + 10
+    Supervisor(app, sock, workers, max_rss, kill_after).run()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
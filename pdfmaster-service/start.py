@@ -15,15 +15,14 @@ except ValueError:
     print(f"[START.PY] Invalid PORT value: {port}, using default 8000")
     port_int = 8000
 
-# Run uvicorn with the port
+# Run the pre-forking server (see server.py) with the port
 cmd = [
-    sys.executable, '-m', 'uvicorn',
-    'main:app',
+    sys.executable, 'server.py',
     '--host', '0.0.0.0',
     '--port', str(port_int)
 ]
 
-print(f"[START.PY] Starting uvicorn on port {port_int}...")
+print(f"[START.PY] Starting server on port {port_int}...")
 print(f"[START.PY] Command: {' '.join(cmd)}")
 sys.stdout.flush()
 sys.stderr.flush()
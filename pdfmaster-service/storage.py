@@ -0,0 +1,243 @@
+"""
+Optional S3-compatible object storage (AWS S3, Cloudflare R2, MinIO).
+
+With STORAGE_BUCKET set, finished results are uploaded to the bucket and the
+client gets a presigned download link instead of the bytes, so slow
+downloads no longer hold a serving process. Large files go up as concurrent
+multipart uploads. Results are stored under their ETag (the result cache
+key) when they have one, so a result is uploaded once however often it is
+fetched.
+
+Clients pick the delivery per request with ?delivery=:
+
+    direct     bytes from the API, as without storage
+    url        JSON with a presigned URL, its expiry and the object key
+    redirect   303 to the presigned URL (default)
+
+Inputs can skip the API as well: POST /api/v1/storage/uploads returns a
+presigned PUT URL and a key, and the PDF endpoints accept that key (or the
+key of an earlier result) instead of a file upload.
+
+Settings (environment):
+
+    STORAGE_BUCKET                bucket name (or R2_BUCKET_NAME); unset
+                                  disables storage
+    STORAGE_ENDPOINT_URL          endpoint of a non-AWS service, e.g.
+                                  https://<account>.r2.cloudflarestorage.com
+                                  or http://minio:9000
+    STORAGE_PUBLIC_ENDPOINT_URL   endpoint used in presigned URLs when clients
+                                  reach the service under another address
+                                  (default: STORAGE_ENDPOINT_URL)
+    STORAGE_REGION                region (default "auto", as R2 expects)
+    STORAGE_ACCESS_KEY_ID         credentials (or R2_ACCESS_KEY_ID /
+    STORAGE_SECRET_ACCESS_KEY     R2_SECRET_ACCESS_KEY); default: the boto3 chain
+    STORAGE_PREFIX                key prefix of results (default "results/")
+    STORAGE_INPUT_PREFIX          key prefix of client uploads ("inputs/")
+    STORAGE_DELIVERY              default delivery (default "redirect")
+    STORAGE_MIN_KB                smaller results are always sent directly (64)
+    STORAGE_URL_TTL_SECONDS       lifetime of presigned URLs (default 3600)
+    STORAGE_PART_MB               multipart threshold and part size (default 8)
+    STORAGE_CONCURRENCY           parts transferred in parallel (default 8)
+"""
+
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def _setting(*names: str) -> Optional[str]:
+    # 兼容部署文档中的 R2_* 变量名
+    for name in names:
+        if os.environ.get(name):
+            return os.environ[name]
+    return None
+
+
+STORAGE_BUCKET = _setting("STORAGE_BUCKET", "R2_BUCKET_NAME") or ""
+STORAGE_ENDPOINT_URL = os.environ.get("STORAGE_ENDPOINT_URL") or None
+STORAGE_PUBLIC_ENDPOINT_URL = (
+    os.environ.get("STORAGE_PUBLIC_ENDPOINT_URL") or STORAGE_ENDPOINT_URL
+)
+STORAGE_REGION = os.environ.get("STORAGE_REGION", "auto")
+STORAGE_PREFIX = os.environ.get("STORAGE_PREFIX", "results/")
+STORAGE_INPUT_PREFIX = os.environ.get("STORAGE_INPUT_PREFIX", "inputs/")
+STORAGE_DELIVERY = os.environ.get("STORAGE_DELIVERY", "redirect")
+STORAGE_MIN_BYTES = int(os.environ.get("STORAGE_MIN_KB", "64")) * 1024
+STORAGE_URL_TTL_SECONDS = int(os.environ.get("STORAGE_URL_TTL_SECONDS", "3600"))
+STORAGE_PART_BYTES = int(os.environ.get("STORAGE_PART_MB", "8")) * MB
+STORAGE_CONCURRENCY = int(os.environ.get("STORAGE_CONCURRENCY", "8"))
+
+DELIVERIES = ["direct", "url", "redirect"]
+
+
+class ObjectStorage:
+    """A bucket for results and client inputs; every call blocks (run in the io pool)."""
+
+    def __init__(self, bucket: str = STORAGE_BUCKET):
+        self.bucket = bucket
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.reused = 0
+        self.downloads = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.bucket)
+
+    def client(self, endpoint_url: Optional[str] = STORAGE_ENDPOINT_URL):
+        # 延迟创建：未启用存储时不导入 boto3
+        with self._lock:
+            if endpoint_url not in self._clients:
+                import boto3
+                from botocore.config import Config
+
+                self._clients[endpoint_url] = boto3.client(
+                    "s3",
+                    endpoint_url=endpoint_url,
+                    region_name=STORAGE_REGION,
+                    aws_access_key_id=_setting(
+                        "STORAGE_ACCESS_KEY_ID", "R2_ACCESS_KEY_ID"
+                    ),
+                    aws_secret_access_key=_setting(
+                        "STORAGE_SECRET_ACCESS_KEY", "R2_SECRET_ACCESS_KEY"
+                    ),
+                    config=Config(
+                        signature_version="s3v4",
+                        max_pool_connections=max(10, STORAGE_CONCURRENCY * 2),
+                        retries={"max_attempts": 5, "mode": "standard"},
+                    ),
+                )
+            return self._clients[endpoint_url]
+
+    def _transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+
+        return TransferConfig(
+            multipart_threshold=STORAGE_PART_BYTES,
+            multipart_chunksize=STORAGE_PART_BYTES,
+            max_concurrency=STORAGE_CONCURRENCY,
+            use_threads=True,
+        )
+
+    def _size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client().head_object(Bucket=self.bucket, Key=key)[
+                "ContentLength"
+            ]
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    # ---------- 结果 ----------
+
+    @staticmethod
+    def result_key(result: Dict[str, Any]) -> str:
+        """Object key of a result: its ETag when cached, else its scratch file name."""
+        identity = result["headers"].get("ETag", "").strip('"') or (
+            os.path.splitext(os.path.basename(result["path"]))[0]
+        )
+        return f"{STORAGE_PREFIX}{identity}/{result['filename']}"
+
+    def upload(self, path: str, key: str, media_type: str, filename: str) -> bool:
+        """
+        Upload path to key unless an object of the same size is already there.
+
+        Files above STORAGE_PART_MB go up in parts, STORAGE_CONCURRENCY at a
+        time. Returns whether anything was uploaded.
+        """
+        size = os.path.getsize(path)
+        if self._size(key) == size:
+            self.reused += 1
+            return False
+        self.client().upload_file(
+            path,
+            self.bucket,
+            key,
+            ExtraArgs={
+                "ContentType": media_type,
+                "ContentDisposition": f'attachment; filename="{filename}"',
+            },
+            Config=self._transfer_config(),
+        )
+        self.uploads += 1
+        self.uploaded_bytes += size
+        logger.info(f"Uploaded {key} ({size} bytes)")
+        return True
+
+    def download_url(self, key: str) -> str:
+        return self.client(STORAGE_PUBLIC_ENDPOINT_URL).generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=STORAGE_URL_TTL_SECONDS,
+        )
+
+    # ---------- 输入 ----------
+
+    def upload_url(self, filename: str, media_type: str) -> Dict[str, Any]:
+        """A presigned PUT for a client upload under STORAGE_INPUT_PREFIX."""
+        name = os.path.basename(filename).replace('"', "") or "input"
+        key = f"{STORAGE_INPUT_PREFIX}{uuid.uuid4().hex}/{name}"
+        url = self.client(STORAGE_PUBLIC_ENDPOINT_URL).generate_presigned_url(
+            "put_object",
+            Params={"Bucket": self.bucket, "Key": key, "ContentType": media_type},
+            ExpiresIn=STORAGE_URL_TTL_SECONDS,
+        )
+        return {
+            "key": key,
+            "url": url,
+            "method": "PUT",
+            "headers": {"Content-Type": media_type},
+            "expires_in": STORAGE_URL_TTL_SECONDS,
+        }
+
+    def check_input_key(self, key: str):
+        """Only client uploads and earlier results may be used as inputs."""
+        if not self.enabled:
+            raise HTTPException(status_code=400, detail="Object storage is not configured")
+        if ".." in key.split("/") or not key.startswith(
+            (STORAGE_INPUT_PREFIX, STORAGE_PREFIX)
+        ):
+            raise HTTPException(status_code=400, detail=f"Invalid object key: {key}")
+
+    def download(self, key: str, path: str, max_bytes: int) -> int:
+        """Fetch key into path with concurrent ranged GETs, return its size."""
+        size = self._size(key)
+        if size is None:
+            raise HTTPException(status_code=404, detail=f"Object not found: {key}")
+        if size > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Object {key} exceeds the {max_bytes // MB} MB limit",
+            )
+        self.client().download_file(
+            self.bucket, key, path, Config=self._transfer_config()
+        )
+        self.downloads += 1
+        return size
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "bucket": self.bucket or None,
+            "delivery": STORAGE_DELIVERY,
+            "uploads": self.uploads,
+            "uploaded_bytes": self.uploaded_bytes,
+            "reused": self.reused,
+            "downloads": self.downloads,
+        }
+
+
+object_storage = ObjectStorage()
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# 服务模块是平铺的，且在导入时读取 TEMP_DIR 等环境变量
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TEMP_DIR", tempfile.mkdtemp(prefix="pdfmaster-test-"))
+os.environ.setdefault("WARMUP", "none")
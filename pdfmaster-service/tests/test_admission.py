@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission import Admission
+
+
+def _admission(**options):
+    settings = {
+        "budget_bytes": 100,
+        "max_active": 10,
+        "limits": {"pdf.merge": 10, "pdf.to_jpg": 1},
+        "queue_seconds": 5,
+    }
+    return Admission(**{**settings, **options})
+
+
+def test_memory_budget_holds_requests_until_released():
+    async def scenario():
+        admission = _admission()
+        first = await admission.acquire("pdf.merge", 60)
+        second = asyncio.ensure_future(admission.acquire("pdf.merge", 60))
+        await asyncio.sleep(0.01)
+        assert not second.done()
+        assert admission.stats()["waiting"] == 1
+
+        first.release()
+        grant = await asyncio.wait_for(second, 1)
+        assert admission.reserved == 60
+        grant.release()
+
+        # 超出整个预算的请求在空闲时单独放行
+        alone = await admission.acquire("pdf.merge", 500)
+        assert admission.active == 1
+        alone.release()
+
+    asyncio.run(scenario())
+
+
+def test_per_operation_limit():
+    async def scenario():
+        admission = _admission()
+        render = await admission.acquire("pdf.to_jpg", 1)
+        queued = asyncio.ensure_future(admission.acquire("pdf.to_jpg", 1))
+        await asyncio.sleep(0.01)
+        assert not queued.done()
+
+        # 其他操作不受 to_jpg 的上限影响
+        merge = await asyncio.wait_for(admission.acquire("pdf.merge", 1), 1)
+        assert admission.stats()["by_operation"] == {"pdf.to_jpg": 1, "pdf.merge": 1}
+
+        render.release()
+        (await asyncio.wait_for(queued, 1)).release()
+        merge.release()
+
+    asyncio.run(scenario())
+
+
+def test_wait_past_the_deadline_is_refused_with_503():
+    async def scenario():
+        admission = _admission(queue_seconds=0.05)
+        held = await admission.acquire("pdf.to_jpg", 1)
+        with pytest.raises(HTTPException) as refused:
+            await admission.acquire("pdf.to_jpg", 1)
+        held.release()
+        return admission, refused.value
+
+    admission, error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert int(error.headers["Retry-After"]) >= 1
+    stats = admission.stats()
+    assert stats["rejected"]["timeout"] == 1
+    assert stats["waiting"] == 0
+    assert stats["active"] == 0
+
+
+def test_fast_lane_hands_its_slot_to_the_next_waiter():
+    async def scenario():
+        admission = _admission(fast_lane=1)
+        release = asyncio.Event()
+        entered = []
+
+        async def request(name):
+            async with admission.fast():
+                entered.append((name, admission.fast_active))
+                await release.wait()
+
+        first = asyncio.ensure_future(request("first"))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(request("second"))
+        await asyncio.sleep(0.01)
+        assert entered == [("first", 1)]
+        assert len(admission.fast_waiting) == 1
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(first, second), 1)
+        return admission, entered
+
+    admission, entered = asyncio.run(scenario())
+    # 名额直接转交，第二个请求进入时 fast_active 仍为 1
+    assert entered == [("first", 1), ("second", 1)]
+    assert admission.fast_active == 0
+    assert not admission.fast_waiting
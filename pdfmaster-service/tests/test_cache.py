@@ -0,0 +1,74 @@
+import os
+
+from cache import ResultCache, etag
+from output import MemoryResponse, SendfileResponse
+
+
+def _key(name):
+    return ResultCache.key("test", [name], {})
+
+
+def _result(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(name.encode()[:1] * size)
+    return str(path)
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), memory_bytes=10, disk_bytes=0)
+    for name in ("a", "b"):
+        cache.store_bytes(_key(name), b"x" * 4, "application/octet-stream")
+    assert cache.lookup(_key("a")) is not None  # a 变为最近使用
+    cache.store_bytes(_key("c"), b"x" * 4, "application/octet-stream")
+
+    assert cache.lookup(_key("b")) is None
+    assert isinstance(cache.lookup(_key("a")), MemoryResponse)
+    assert cache.stats()["evictions"]["memory"] == 1
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    directory = tmp_path / "cache"
+    cache = ResultCache(str(directory), memory_item_bytes=0, disk_bytes=10)
+    for name in ("a", "b"):
+        cache.store_file(_key(name), _result(tmp_path, name, 4), "application/pdf")
+    assert cache.lookup(_key("a")) is not None
+    cache.store_file(_key("c"), _result(tmp_path, "c", 4), "application/pdf")
+
+    assert cache.lookup(_key("b")) is None
+    assert not os.path.exists(directory / _key("b"))
+    response = cache.lookup(_key("a"))
+    assert isinstance(response, SendfileResponse)
+    assert response.headers["x-cache"] == "HIT"
+    assert cache.stats()["disk"] == {"entries": 2, "bytes": 8}
+
+
+def test_if_none_match_answers_304(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    key = _key("a")
+    cache.store_bytes(key, b"result", "text/plain")
+
+    for header in (etag(key), f"W/{etag(key)}", f'"other", {etag(key)}', "*"):
+        response = cache.lookup(key, header)
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag(key)
+    assert cache.lookup(key, '"other"').status_code == 200
+    assert cache.stats()["not_modified"] == 4
+
+
+def test_adopts_results_stored_by_another_process(tmp_path):
+    directory = str(tmp_path / "cache")
+    mine = ResultCache(directory, memory_item_bytes=0)
+    other = ResultCache(directory, memory_item_bytes=0)
+    key = _key("a")
+    other.store_file(
+        key, _result(tmp_path, "a", 100), "application/pdf", "a.pdf", {"X-Pages": "1"}
+    )
+
+    response = mine.lookup(key)
+    assert isinstance(response, SendfileResponse)
+    assert response.headers["x-pages"] == "1"
+    assert mine.stats()["hits"]["disk"] == 1
+    assert mine.stats()["disk"] == {"entries": 1, "bytes": 100}
+
+    # 重启后从 sidecar 重建索引
+    assert ResultCache(directory).stats()["disk"]["entries"] == 1
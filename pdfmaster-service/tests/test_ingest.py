@@ -0,0 +1,72 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+
+from ingest import SpooledPart, SpoolingMultiPartParser, UploadSpool
+
+BOUNDARY = "testboundary"
+HEADERS = Headers({"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+CHUNK = 64 * 1024
+
+
+def _body(filename: str, data: bytes) -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def _stream(body: bytes, received: list):
+    async def stream():
+        for i in range(0, len(body), CHUNK):
+            received.append(CHUNK)
+            yield body[i : i + CHUNK]
+
+    return stream()
+
+
+def test_file_part_is_spooled_once_into_the_spool(tmp_path):
+    data = os.urandom(300 * 1024)
+
+    async def run():
+        parser = SpoolingMultiPartParser(
+            HEADERS, _stream(_body("a.pdf", data), []), directory=str(tmp_path)
+        )
+        form = await parser.parse()
+        upload = form["file"]
+        assert isinstance(upload.file, SpooledPart)
+        async with UploadSpool(str(tmp_path)) as spool:
+            path = await spool.add(upload)
+            assert path.endswith(".pdf")
+            assert open(path, "rb").read() == data
+            assert spool.total_bytes() == len(data)
+            await form.close()
+            # 已被 spool 接管的文件不随表单关闭而删除
+            assert os.listdir(tmp_path) == [os.path.basename(path)]
+        assert os.listdir(tmp_path) == []
+
+    asyncio.run(run())
+
+
+def test_oversized_part_is_rejected_before_the_body_is_received(tmp_path):
+    body = _body("big.pdf", os.urandom(2 * 1024 * 1024))
+    received = []
+
+    async def run():
+        parser = SpoolingMultiPartParser(
+            HEADERS,
+            _stream(body, received),
+            directory=str(tmp_path),
+            max_file_bytes=256 * 1024,
+        )
+        await parser.parse()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 413
+    assert sum(received) < len(body) / 4
+    assert os.listdir(tmp_path) == []
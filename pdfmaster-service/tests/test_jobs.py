@@ -0,0 +1,109 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from jobs import CANCELLED, JOB_STATE_DIR, QUEUED, RUNNING, SUCCEEDED, JobQueue
+from scratch import TEMP_DIR, ScratchStorage
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def _result(path):
+    async def run(job):
+        path.write_bytes(b"result")
+        return {"path": str(path), "media_type": "text/plain", "filename": None}
+
+    return run
+
+
+def test_jobs_run_by_priority_then_fifo(tmp_path):
+    async def scenario():
+        queue = JobQueue(workers=1)
+        queue.start()
+        gate = asyncio.Event()
+        order = []
+
+        async def blocker(job):
+            await gate.wait()
+            return await _result(tmp_path / "block")(job)
+
+        def record(name):
+            async def run(job):
+                order.append(name)
+                return await _result(tmp_path / name)(job)
+
+            return run
+
+        queue.submit("block", blocker, [])
+        await _settle()
+        for name, priority in [
+            ("low", "low"),
+            ("normal-1", "normal"),
+            ("high", "high"),
+            ("normal-2", "normal"),
+        ]:
+            queue.submit(name, record(name), [], priority)
+        gate.set()
+        while queue.active():
+            await asyncio.sleep(0.01)
+        await queue.stop(0)
+        return order
+
+    assert asyncio.run(scenario()) == ["high", "normal-1", "normal-2", "low"]
+
+
+def test_cancel_queued_and_running_jobs():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        queue.start()
+        started = []
+
+        async def forever(job):
+            started.append(job.id)
+            await asyncio.sleep(60)
+
+        running = queue.submit("running", forever, [])
+        queued = queue.submit("queued", forever, [])
+        await _settle()
+        assert (running.status, queued.status) == (RUNNING, QUEUED)
+
+        queue.cancel(queued.id)
+        queue.cancel(running.id)
+        await _settle()
+        await queue.stop(0)
+        return running, queued, started
+
+    running, queued, started = asyncio.run(scenario())
+    assert running.status == CANCELLED
+    assert queued.status == CANCELLED
+    assert started == [running.id]
+
+
+def test_finished_jobs_expire_with_their_results(tmp_path):
+    async def scenario():
+        queue = JobQueue(workers=1, result_ttl=0.05)
+        queue.start()
+        job = queue.submit("convert", _result(tmp_path / "out.txt"), [])
+        while job.status != SUCCEEDED:
+            await asyncio.sleep(0.01)
+        # 结果移到 jobs 目录，scratch 的 TTL 清理不会删除它
+        assert os.path.dirname(job.result["path"]) == JOB_STATE_DIR
+        ScratchStorage(TEMP_DIR, ttl_seconds=0).sweep()
+        assert open(job.result["path"], "rb").read() == b"result"
+        await asyncio.sleep(0.3)
+        try:
+            with pytest.raises(HTTPException) as missing:
+                queue.get(job.id)
+            assert missing.value.status_code == 404
+        finally:
+            await queue.stop(0)
+        return job.id
+
+    job_id = asyncio.run(scenario())
+    assert not os.listdir(tmp_path)
+    assert not os.path.exists(os.path.join(JOB_STATE_DIR, job_id + ".result"))
@@ -0,0 +1,37 @@
+from metrics import Registry
+
+
+def _registry():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ("route",))
+    queued = registry.gauge("queued", "Queued tasks")
+    free = registry.gauge("free_bytes", "Free bytes", multiprocess="max")
+    entries = registry.gauge("entries", "Entries", multiprocess="all")
+    return registry, requests, queued, free, entries
+
+
+def _snapshot(pid, live, requests_count, queued_count):
+    registry, requests, queued, free, entries = _registry()
+    requests.inc(requests_count, route="/health")
+    queued.set(queued_count)
+    free.set(100 + queued_count)
+    entries.set(queued_count)
+    return {"pid": pid, "live": live, "metrics": registry.snapshot(gauges=live)}
+
+
+def test_merge_keeps_counters_of_exited_processes_and_gauges_of_live_ones():
+    registry = _registry()[0]
+    merged = registry.merge(
+        [
+            _snapshot("1", True, 3, 2),
+            _snapshot("2", True, 4, 5),
+            _snapshot("archive", False, 10, 7),
+        ]
+    )
+    assert merged["requests_total"] == {("/health",): 17}
+    assert merged["queued"] == {(): 7}
+    assert merged["free_bytes"] == {(): 105}
+    assert merged["entries"] == {("1",): 2, ("2",): 5}
+    text = registry.render(merged)
+    assert 'requests_total{route="/health"} 17' in text
+    assert 'entries{pid="1"} 2' in text
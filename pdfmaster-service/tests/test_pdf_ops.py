@@ -0,0 +1,79 @@
+from io import BytesIO
+
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import StreamObject
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+import pdf_ops
+
+
+def _scan_pdf(path):
+    # reportlab 默认以 [/ASCII85Decode /DCTDecode] 写入 JPEG
+    image = Image.radial_gradient("L").resize((1600, 1600)).convert("RGB")
+    jpeg = BytesIO()
+    image.save(jpeg, format="JPEG", quality=95)
+    jpeg.seek(0)
+    c = canvas.Canvas(str(path), pagesize=(612, 792))
+    c.drawImage(ImageReader(jpeg), 0, 0, 612, 792)
+    c.save()
+
+
+def _image_filters(path):
+    page = PdfReader(str(path)).pages[0]
+    (image,) = page["/Resources"]["/XObject"].values()
+    return image.get_object()["/Filter"]
+
+
+def test_compress_recompresses_ascii85_wrapped_jpeg(tmp_path):
+    source = tmp_path / "scan.pdf"
+    output = tmp_path / "compressed.pdf"
+    _scan_pdf(source)
+    assert list(_image_filters(source)) == ["/ASCII85Decode", "/DCTDecode"]
+
+    images = pdf_ops.find_images(str(source))
+    replacements = pdf_ops.recompress_images(str(source), images, quality=30)
+    size = pdf_ops.compress_pdf(str(source), str(output), replacements)
+
+    assert len(replacements) == 1
+    assert size < source.stat().st_size * 0.5
+    assert _image_filters(output) == "/DCTDecode"
+
+
+def _unused_image_pdf(path):
+    # 页面资源列出两张图片，内容只绘制第一张
+    c = canvas.Canvas(str(path), pagesize=(612, 792))
+    for x in (0, 306):
+        noise = Image.effect_noise((300, 300), 64).convert("RGB")
+        c.drawImage(ImageReader(noise), x, 0, 306, 306)
+    c.save()
+    writer = PdfWriter(clone_from=PdfReader(str(path)))
+    page = writer.pages[0]
+    contents = page.get_contents()
+    unused = list(page["/Resources"]["/XObject"])[0]
+    contents.set_data(contents.get_data().replace(f"{unused} Do".encode(), b""))
+    page.replace_contents(contents)
+    writer.write(str(path))
+
+
+def _image_count(path):
+    reader = PdfReader(str(path))
+    objects = (reader.get_object(n) for n in range(1, reader.trailer["/Size"]))
+    return sum(
+        1
+        for obj in objects
+        if isinstance(obj, StreamObject) and obj.get("/Subtype") == "/Image"
+    )
+
+
+def test_compress_drops_unused_images(tmp_path):
+    source = tmp_path / "unused.pdf"
+    output = tmp_path / "compressed.pdf"
+    _unused_image_pdf(source)
+    assert _image_count(source) == 2
+
+    size = pdf_ops.compress_pdf(str(source), str(output))
+
+    assert _image_count(output) == 1
+    assert size < source.stat().st_size * 0.75
@@ -0,0 +1,30 @@
+from fastapi.testclient import TestClient
+
+import profiler
+from main import app
+
+client = TestClient(app)
+
+
+def test_profile_endpoint_is_disabled_without_a_token(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_TOKEN", "")
+    response = client.get("/admin/profile", params={"seconds": 1})
+    assert response.status_code == 404
+    assert not profiler.active()
+
+
+def test_profile_endpoint_requires_the_token(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_TOKEN", "secret")
+    response = client.get(
+        "/admin/profile",
+        params={"seconds": 1},
+        headers={"Authorization": "Bearer wrong"},
+    )
+    assert response.status_code == 401
+
+
+def test_no_watcher_without_a_token(monkeypatch):
+    monkeypatch.setattr(profiler, "PROFILE_TOKEN", "")
+    monkeypatch.setattr(profiler, "_watcher", None)
+    profiler.start_watcher("test")
+    assert profiler._watcher is None
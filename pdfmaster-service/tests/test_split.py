@@ -0,0 +1,46 @@
+import io
+import zipfile
+
+from fastapi.testclient import TestClient
+from reportlab.pdfgen import canvas
+
+from main import app
+
+client = TestClient(app)
+
+
+def _pdf(pages: int) -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    for page in range(pages):
+        pdf.drawString(72, 720, f"Page {page + 1}")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def _split(**form):
+    return client.post(
+        "/api/v1/pdf/split",
+        files={"file": ("doc.pdf", _pdf(3), "application/pdf")},
+        data=form,
+    )
+
+
+def test_split_defaults_to_all_pages():
+    response = _split()
+    assert response.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+    assert len(names) == 3
+
+
+def test_single_is_an_alias_of_range():
+    response = _split(split_mode="single", pages="2")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/pdf"
+
+
+def test_malformed_range_is_a_client_error():
+    response = _split(split_mode="range", pages="x")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid page range"
@@ -0,0 +1,34 @@
+import asyncio
+import os
+import time
+
+from ingest import UploadSpool
+from scratch import ScratchStorage
+from uploads import ResumableUploads
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_linked_upload_survives_the_scratch_sweep(tmp_path):
+    spool_dir = tmp_path / "scratch"
+    uploads = ResumableUploads(directory=str(tmp_path / "uploads"))
+    data = b"%PDF-1.4 resumable"
+
+    async def run():
+        upload = uploads.create("old.pdf", len(data), "application/pdf")
+        await uploads.append(upload["id"], 0, _chunks(data[:5], data[5:]))
+        uploads.complete(upload["id"])
+        # 上传在两小时前完成
+        aged = time.time() - 7200
+        os.utime(uploads._path(upload["id"], ".part"), (aged, aged))
+
+        scratch = ScratchStorage(str(spool_dir), ttl_seconds=3600)
+        async with UploadSpool(str(spool_dir)) as spool:
+            path = await spool.add(uploads.input(upload["id"]))
+            assert scratch.sweep() == 0
+            assert open(path, "rb").read() == data
+
+    asyncio.run(run())
@@ -0,0 +1,52 @@
+import asyncio
+import io
+import signal
+import time
+
+from fastapi.testclient import TestClient
+from reportlab.pdfgen import canvas
+
+import main
+import pdf_ops
+from executor import pools
+from main import app
+
+client = TestClient(app)
+
+
+def stuck_parse(input_path, pages, output_path, page_timeout):
+    # 模拟卡在 C 调用里的 pdf2docx：worker 内的 SIGALRM 打断不了它
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    time.sleep(120)
+
+
+def two_pages() -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer)
+    for page in range(2):
+        pdf.drawString(72, 720, f"Page {page + 1}")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def test_stuck_word_batch_returns_timeout_error(monkeypatch):
+    monkeypatch.setattr(pdf_ops, "parse_word_pages", stuck_parse)
+    monkeypatch.setattr(main, "WORD_BATCH_PAGES", 1)
+    monkeypatch.setattr(main, "WORD_PAGE_TIMEOUT_SECONDS", 0.5)
+    monkeypatch.setattr(main, "WORD_TIMEOUT_GRACE_SECONDS", 1)
+
+    started = time.monotonic()
+    response = client.post(
+        "/api/v1/pdf/to-word",
+        files={"file": ("two.pdf", two_pages(), "application/pdf")},
+    )
+    assert response.status_code == 422
+    assert "could not be converted within 0.5s per page" in response.json()["detail"]
+    assert time.monotonic() - started < 30
+
+    # 卡住的 worker 已被结束，office 池可以继续使用
+    office = pools._pools["office"]
+    assert office._executor is None
+    assert asyncio.run(pools.run("office", sum, [1, 2])) == 3
+    office.shutdown()
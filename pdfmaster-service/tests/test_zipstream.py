@@ -0,0 +1,51 @@
+import asyncio
+import io
+import zipfile
+
+from zipstream import ZipStreamWriter, stream_zip
+
+
+def test_writer_round_trip():
+    writer = ZipStreamWriter()
+    chunks = [
+        writer.add("a.pdf", b"%PDF-1.4 first"),
+        writer.add("b.txt", b"x" * 10000, zipfile.ZIP_DEFLATED),
+        writer.close(),
+    ]
+    assert all(chunks)
+
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(chunks)))
+    assert archive.testzip() is None
+    assert archive.namelist() == ["a.pdf", "b.txt"]
+    assert archive.read("a.pdf") == b"%PDF-1.4 first"
+    assert archive.read("b.txt") == b"x" * 10000
+    assert archive.getinfo("a.pdf").compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo("b.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_stream_zip_tees_the_archive(tmp_path):
+    async def batches():
+        yield [("1.jpg", b"one"), ("2.jpg", b"two")]
+        yield [("3.jpg", b"three")]
+
+    completed = []
+
+    async def on_complete():
+        completed.append(True)
+
+    async def collect():
+        tee = tmp_path / "tee.zip"
+        data = b"".join(
+            [chunk async for chunk in stream_zip(batches(), str(tee), on_complete)]
+        )
+        return data, tee.read_bytes()
+
+    data, teed = asyncio.run(collect())
+    assert data == teed
+    assert completed == [True]
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert [archive.read(name) for name in archive.namelist()] == [
+        b"one",
+        b"two",
+        b"three",
+    ]
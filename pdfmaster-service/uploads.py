@@ -0,0 +1,312 @@
+"""
+Resumable chunked uploads for large inputs.
+
+A dropped connection costs only the chunk in flight instead of the whole file:
+
+    POST   /api/v1/uploads                 create (filename, size, content_type)
+    PATCH  /api/v1/uploads/{id}            append the body at Upload-Offset
+    HEAD   /api/v1/uploads/{id}            Upload-Offset to resume from
+    POST   /api/v1/uploads/{id}/complete   check the size (and sha256), finalize
+    DELETE /api/v1/uploads/{id}
+
+A completed upload is passed to any /api/v1/pdf/* or /api/v1/image/* operation
+as upload_id (upload_ids for merge, from-jpg and pipeline/batch) in place of the
+file, as often as needed until it expires. It is hard-linked into the request's
+spool, so using it copies nothing.
+
+Uploads live in TEMP_DIR/uploads ({id}.part and {id}.json), so any process of
+a multi-process server (see server.py) can take any chunk; a file lock keeps
+concurrent PATCHes to one upload from interleaving.
+
+Settings (environment):
+
+    UPLOAD_TTL_SECONDS   idle time after which an upload is deleted (86400)
+    UPLOAD_MAX_MB        largest resumable upload (default MAX_UPLOAD_FILE_MB)
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import HTTPException
+from starlette.requests import ClientDisconnect
+
+from executor import pools
+from scratch import TEMP_DIR
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+HASH_CHUNK_SIZE = 1 * MB
+
+UPLOAD_TTL_SECONDS = int(os.environ.get("UPLOAD_TTL_SECONDS", "86400"))
+UPLOAD_MAX_BYTES = (
+    int(os.environ.get("UPLOAD_MAX_MB", os.environ.get("MAX_UPLOAD_FILE_MB", "200")))
+    * MB
+)
+UPLOAD_STATE_DIR = os.path.join(TEMP_DIR, "uploads")
+
+
+class UploadedInput:
+    """A completed resumable upload, accepted wherever an upload is (see ingest.py)."""
+
+    def __init__(self, state: Dict[str, Any], path: str):
+        self.id = state["id"]
+        self.path = path
+        self.filename = state["filename"]
+        self.content_type = state["content_type"]
+        self.size = state["size"]
+        self.digest = state["sha256"]
+
+
+class ResumableUploads:
+    """Chunked uploads kept under a shared directory until they expire."""
+
+    def __init__(
+        self,
+        directory: str = UPLOAD_STATE_DIR,
+        max_bytes: int = UPLOAD_MAX_BYTES,
+        ttl_seconds: int = UPLOAD_TTL_SECONDS,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.counts = {"created": 0, "completed": 0, "expired": 0}
+        self._expirer = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    # ---------- 状态文件 ----------
+
+    def _path(self, upload_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, upload_id + suffix)
+
+    def _save(self, state: Dict[str, Any]):
+        path = self._path(state["id"], ".json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    def _load(self, upload_id: str) -> Dict[str, Any]:
+        # id 来自 URL，只接受 uuid hex，避免路径穿越
+        if len(upload_id) == 32 and upload_id.isalnum():
+            try:
+                with open(self._path(upload_id, ".json")) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+    def _offset(self, upload_id: str) -> int:
+        try:
+            return os.path.getsize(self._path(upload_id, ".part"))
+        except FileNotFoundError:
+            return 0
+
+    def to_dict(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": state["id"],
+            "filename": state["filename"],
+            "content_type": state["content_type"],
+            "size": state["size"],
+            "offset": state["size"] if state["completed"] else self._offset(state["id"]),
+            "completed": state["completed"],
+            "sha256": state.get("sha256"),
+            "created_at": datetime.fromtimestamp(state["created_at"]).isoformat(),
+            "upload_url": f"/api/v1/uploads/{state['id']}",
+        }
+
+    # ---------- 协议 ----------
+
+    def create(self, filename: str, size: int, content_type: str) -> Dict[str, Any]:
+        if size < 1:
+            raise HTTPException(status_code=400, detail="size must be a positive integer")
+        if size > self.max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Upload exceeds the {self.max_bytes // MB} MB limit",
+            )
+        state = {
+            "id": uuid.uuid4().hex,
+            "filename": os.path.basename(filename) or "upload",
+            "content_type": content_type,
+            "size": size,
+            "completed": False,
+            "sha256": None,
+            "created_at": time.time(),
+        }
+        open(self._path(state["id"], ".part"), "wb").close()
+        self._save(state)
+        self.counts["created"] += 1
+        logger.info(f"Created upload {state['id']}: {state['filename']}, {size} bytes")
+        return self.to_dict(state)
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        return self.to_dict(self._load(upload_id))
+
+    def _open_for_append(self, upload_id: str, offset: int):
+        state = self._load(upload_id)
+        if state["completed"]:
+            raise HTTPException(status_code=409, detail="Upload is already completed")
+        f = open(self._path(upload_id, ".part"), "ab")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise HTTPException(
+                status_code=409, detail="Another chunk of this upload is in progress"
+            )
+        current = f.seek(0, os.SEEK_END)
+        if offset != current:
+            f.close()
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload-Offset {offset} does not match the upload offset {current}",
+                headers={"Upload-Offset": str(current)},
+            )
+        return f, state
+
+    async def append(
+        self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]
+    ) -> int:
+        """
+        Append a request body at offset and return the new offset.
+
+        A body cut off by a dropped connection is kept up to the last byte
+        received, so the client resumes from the offset HEAD reports.
+        """
+        f, state = await pools.run("io", self._open_for_append, upload_id, offset)
+        try:
+            try:
+                async for chunk in chunks:
+                    if offset + len(chunk) > state["size"]:
+                        raise HTTPException(
+                            status_code=400,
+                            detail=f"Chunk goes past the upload size of {state['size']} bytes",
+                            headers={"Upload-Offset": str(offset)},
+                        )
+                    await pools.run("io", f.write, chunk)
+                    offset += len(chunk)
+            except ClientDisconnect:
+                logger.info(f"Upload {upload_id} interrupted at offset {offset}")
+        finally:
+            # 关闭时释放文件锁
+            await pools.run("io", f.close)
+        return offset
+
+    def _hash(self, upload_id: str) -> str:
+        digest = hashlib.sha256()
+        with open(self._path(upload_id, ".part"), "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def complete(self, upload_id: str, sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Finalize once every byte has arrived; blocking, run it in the io pool."""
+        state = self._load(upload_id)
+        if state["completed"]:
+            return self.to_dict(state)
+        offset = self._offset(upload_id)
+        if offset != state["size"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Upload has {offset} of {state['size']} bytes",
+                headers={"Upload-Offset": str(offset)},
+            )
+        digest = self._hash(upload_id)
+        if sha256 and sha256.lower() != digest:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Checksum mismatch: received data has sha256 {digest}",
+            )
+        state.update(completed=True, sha256=digest)
+        self._save(state)
+        self.counts["completed"] += 1
+        return self.to_dict(state)
+
+    def delete(self, upload_id: str):
+        self._load(upload_id)
+        self._remove(upload_id)
+
+    def input(self, upload_id: str) -> UploadedInput:
+        """A completed upload to use as an operation's input."""
+        state = self._load(upload_id)
+        if not state["completed"]:
+            raise HTTPException(
+                status_code=409, detail=f"Upload {upload_id} is not completed"
+            )
+        # 使用即续期
+        os.utime(self._path(upload_id, ".json"))
+        return UploadedInput(state, self._path(upload_id, ".part"))
+
+    # ---------- 过期 ----------
+
+    def _remove(self, upload_id: str):
+        for suffix in (".part", ".json"):
+            try:
+                os.remove(self._path(upload_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def expire(self) -> int:
+        """Delete uploads idle for longer than the TTL, return how many."""
+        cutoff = time.time() - self.ttl_seconds
+        latest: Dict[str, float] = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                upload_id = entry.name.split(".")[0]
+                try:
+                    mtime = entry.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                latest[upload_id] = max(latest.get(upload_id, 0), mtime)
+        expired = [upload_id for upload_id, mtime in latest.items() if mtime < cutoff]
+        for upload_id in expired:
+            self._remove(upload_id)
+        self.counts["expired"] += len(expired)
+        return len(expired)
+
+    async def _expire_forever(self):
+        while True:
+            await asyncio.sleep(min(60, self.ttl_seconds))
+            try:
+                count = await pools.run("io", self.expire)
+                if count:
+                    logger.info(f"Expired {count} resumable uploads")
+            except Exception as e:
+                logger.error(f"Upload expiry failed: {str(e)}")
+
+    def start(self):
+        if self._expirer is None:
+            self._expirer = asyncio.get_running_loop().create_task(
+                self._expire_forever()
+            )
+
+    async def stop(self):
+        if self._expirer is not None:
+            self._expirer.cancel()
+            await asyncio.gather(self._expirer, return_exceptions=True)
+            self._expirer = None
+
+    def stats(self) -> Dict[str, Any]:
+        usage = 0
+        uploads = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".part"):
+                    uploads += 1
+                    try:
+                        usage += entry.stat().st_size
+                    except FileNotFoundError:
+                        pass
+        return {"uploads": uploads, "usage_bytes": usage, **self.counts}
+
+
+uploads = ResumableUploads()
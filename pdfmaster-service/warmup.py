@@ -0,0 +1,226 @@
+"""
+Startup warm-up and readiness.
+
+Pool processes are spawned on first use and pdf2image, pdf2docx, PIL fonts
+and reportlab are imported lazily, so without a warm-up the first conversion
+after a deploy pays for interpreter start, imports and engine initialization.
+On startup every process of the warmed pools imports its engines and runs
+them once on a built-in one-page sample: pypdf parse and split, a poppler
+render, a pdf2docx conversion, a font load and the PIL encoders. Import and
+init times are recorded per module and per worker.
+
+/ready answers 503 until the warm-up has finished; /health stays a liveness
+probe. An engine that fails to warm (e.g. poppler missing) is reported but
+does not hold readiness back.
+
+Settings (environment):
+
+    WARMUP            pools to warm: all (default), none, or a comma list of
+                      pdf, image, render, office, fast
+    WARMUP_WAIT       finish the warm-up before accepting connections
+                      (default 0; server.py sets 1, so a recycled or new
+                      serving process only takes traffic once warm)
+    WARMUP_TIMEOUT    seconds before readiness is reported anyway (120)
+
+Pool processes replaced later (EXECUTOR_MAX_TASKS_PER_CHILD) start cold.
+"""
+
+import asyncio
+import importlib
+import importlib.util
+import logging
+import os
+import time
+import uuid
+from functools import lru_cache
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+import metrics
+from executor import pools
+from scratch import TEMP_DIR, scratch
+
+logger = logging.getLogger(__name__)
+
+# 池名 -> 该池 worker 需要预先导入的模块
+ENGINE_MODULES = {
+    "pdf": ["pypdf", "reportlab.pdfgen.canvas", "pdf_ops"],
+    "image": ["PIL.Image", "PIL.ImageDraw", "PIL.ImageFont", "image_ops", "watermark"],
+    "render": ["pdf2image", "PIL.Image", "pdf_ops"],
+    "office": ["pdf2docx", "pdf_ops"],
+    "fast": ["pypdf", "pdf_ops"],
+}
+
+WARMUP = os.environ.get("WARMUP", "all").strip().lower()
+WARMUP_WAIT = os.environ.get("WARMUP_WAIT", "0").lower() in ("1", "true", "yes")
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "120"))
+
+
+def engines_from(setting: str) -> List[str]:
+    if setting in ("", "none", "off", "0"):
+        return []
+    if setting == "all":
+        return list(ENGINE_MODULES)
+    engines = [name.strip() for name in setting.split(",") if name.strip()]
+    unknown = [name for name in engines if name not in ENGINE_MODULES]
+    if unknown:
+        logger.warning(f"Ignoring unknown WARMUP engines: {', '.join(unknown)}")
+    return [name for name in engines if name in ENGINE_MODULES]
+
+
+@lru_cache(maxsize=None)
+def engine_available(module: str) -> bool:
+    """Whether an optional engine is installed, without importing it here."""
+    return importlib.util.find_spec(module) is not None
+
+
+# ---------- worker 侧 ----------
+
+
+def make_sample(path: str):
+    """Write the one-page sample PDF (text, a filled shape and a small image)."""
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(path, pagesize=(300, 200))
+    c.setFont("Helvetica", 12)
+    c.drawString(20, 160, "PDF Master warm-up")
+    c.rect(20, 20, 120, 60, fill=1)
+    c.drawImage(ImageReader(Image.new("RGB", (32, 32), (200, 80, 40))), 180, 20, 64, 64)
+    c.showPage()
+    c.save()
+
+
+def _exercise(engine: str, sample_path: str):
+    import pdf_ops
+
+    if engine == "pdf":
+        pdf_ops.pdf_info(sample_path, True)
+        pdf_ops.split_parts(sample_path, [("page_1.pdf", [0])])
+    elif engine == "fast":
+        pdf_ops.pdf_info(sample_path, True)
+    elif engine == "image":
+        from PIL import Image, ImageDraw
+
+        import watermark
+
+        image = Image.new("RGB", (64, 64), "white")
+        ImageDraw.Draw(image).text(
+            (4, 4), "warm", font=watermark.font(watermark.FONT_PATH, 16), fill="black"
+        )
+        for format in ("JPEG", "PNG", "WEBP"):
+            image.save(BytesIO(), format=format)
+    elif engine == "render":
+        pdf_ops.render_pages(sample_path, 36, "jpg", 1, 1)
+    elif engine == "office":
+        output_path = f"{sample_path}.{os.getpid()}.docx"
+        try:
+            pdf_ops.pdf_to_word(sample_path, output_path)
+        finally:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+
+
+def warm(engine: str, sample_path: str) -> Dict[str, Any]:
+    """Import an engine's modules and run it once on the sample, with timings."""
+    imports = {}
+    for module in ENGINE_MODULES[engine]:
+        started = time.perf_counter()
+        importlib.import_module(module)
+        # 只计入本模块新增的导入时间，已被前面模块带入的接近 0
+        imports[module] = round(time.perf_counter() - started, 4)
+
+    started = time.perf_counter()
+    _exercise(engine, sample_path)
+    return {
+        "pid": os.getpid(),
+        "imports": imports,
+        "init_seconds": round(time.perf_counter() - started, 4),
+    }
+
+
+# ---------- 服务进程侧 ----------
+
+
+class WarmUp:
+    """Warms the executor pools once per serving process and tracks readiness."""
+
+    def __init__(self, engines: List[str], timeout: float = WARMUP_TIMEOUT):
+        self.engines = engines
+        self.timeout = timeout
+        self.ready = not engines
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.errors: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, wait: bool = WARMUP_WAIT):
+        if not self.engines or self.started_at is not None:
+            return
+        self.started_at = time.time()
+        if wait:
+            await self.run()
+        else:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        logger.info(f"Warming up: {', '.join(self.engines)}")
+        sample_path = os.path.join(TEMP_DIR, f"warmup_{uuid.uuid4()}.pdf")
+        try:
+            await pools.run("pdf", make_sample, sample_path)
+            await asyncio.wait_for(
+                asyncio.gather(*(self._warm(name, sample_path) for name in self.engines)),
+                self.timeout,
+            )
+        except asyncio.TimeoutError:
+            self.errors["timeout"] = f"Warm-up did not finish within {self.timeout:g}s"
+            logger.warning(self.errors["timeout"])
+        except Exception as e:
+            self.errors["sample"] = str(e)
+            logger.error(f"Warm-up failed: {str(e)}")
+        finally:
+            scratch.remove(sample_path)
+            self.finished_at = time.time()
+            self.ready = True
+        logger.info(f"Warm-up finished in {self.finished_at - self.started_at:.2f}s")
+
+    async def _warm(self, engine: str, sample_path: str):
+        started = time.perf_counter()
+        try:
+            # 同时提交与 worker 数相同的任务，池会为每个任务启动一个进程
+            reports = await asyncio.gather(
+                *(
+                    pools.run(engine, warm, engine, sample_path)
+                    for _ in range(pools.workers(engine))
+                )
+            )
+        except Exception as e:
+            self.errors[engine] = str(e)
+            logger.warning(f"Could not warm up '{engine}' pool: {str(e)}")
+            return
+        seconds = time.perf_counter() - started
+        metrics.warmup_seconds.set(seconds, engine=engine)
+        self.results[engine] = {"seconds": round(seconds, 3), "workers": reports}
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started_at:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+        return {
+            "ready": self.ready,
+            "engines": self.engines,
+            "elapsed_seconds": elapsed,
+            "results": self.results,
+            "errors": self.errors,
+        }
+
+
+warmup = WarmUp(engines_from(WARMUP))
@@ -0,0 +1,312 @@
+"""
+Watermark engine shared by the image and PDF endpoints.
+
+Fonts, rendered text / logo layers and tiled overlays are cached per worker
+process, so a watermark used repeatedly is composited instead of being
+re-rasterized. Layers are RGBA and composited with their alpha, so the
+opacity actually shows through.
+
+    WATERMARK_CACHE_MB      rendered layer cache per worker (default 64)
+
+Options are a plain dict (picklable for the executor pools):
+
+    text, logo_path, logo_key   text, or a logo image with a content key
+                                (the upload digest) used for caching
+    position                    center, top-left, top-right, bottom-left,
+                                bottom-right or tile
+    opacity                     0-1
+    scale                       text height relative to the shorter side
+                                (default 0.05), logo width relative to the
+                                width (default 0.2)
+    angle                       counter-clockwise rotation in degrees
+    color                       text color, any PIL color string
+"""
+
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from io import BytesIO
+from math import cos, radians, sin
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+WATERMARK_CACHE_BYTES = int(os.environ.get("WATERMARK_CACHE_MB", "64")) * 1024 * 1024
+
+POSITIONS = ["center", "top-left", "top-right", "bottom-left", "bottom-right", "tile"]
+TEXT_SCALE = 0.05
+LOGO_SCALE = 0.2
+MARGIN = 0.025  # 边距占短边的比例
+TILE_GAP = 0.5  # 平铺间距占水印尺寸的比例
+PDF_LOGO_DPI = 144  # PDF 中 logo 的栅格分辨率
+
+Size = Tuple[int, int]
+
+
+class LayerCache:
+    """Byte-bounded LRU of rendered RGBA layers. Cached images must not be mutated."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Hashable, Image.Image]" = OrderedDict()
+
+    def get(self, key: Hashable, render: Callable[[], Image.Image]) -> Image.Image:
+        layer = self._items.get(key)
+        if layer is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return layer
+
+        self.misses += 1
+        layer = render()
+        size = layer.width * layer.height * 4
+        if size <= self.max_bytes:
+            self._items[key] = layer
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, old = self._items.popitem(last=False)
+                self.bytes -= old.width * old.height * 4
+        return layer
+
+
+layers = LayerCache(WATERMARK_CACHE_BYTES)
+
+
+@lru_cache(maxsize=32)
+def font(path: str, size: int) -> ImageFont.ImageFont:
+    try:
+        return ImageFont.truetype(path, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=1)
+def _pdf_font() -> str:
+    """Register the TTF font with reportlab once, return the font name to use."""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    try:
+        pdfmetrics.registerFont(TTFont("DejaVuSans", FONT_PATH))
+        return "DejaVuSans"
+    except Exception:
+        return "Helvetica"
+
+
+def check_options(options: Dict[str, Any]):
+    """Raise ValueError for options the engine cannot render."""
+    if options.get("position", "center") not in POSITIONS:
+        raise ValueError(f"position must be one of {', '.join(POSITIONS)}")
+    if not 0 <= options.get("opacity", 0.5) <= 1:
+        raise ValueError("opacity must be between 0 and 1")
+    scale = options.get("scale")
+    if scale is not None and not 0 < scale <= 1:
+        raise ValueError("scale must be greater than 0 and at most 1")
+    try:
+        ImageColor.getrgb(options.get("color", "white"))
+    except ValueError:
+        raise ValueError(f"Invalid color: {options.get('color')}")
+
+
+# ---------- 图层渲染 ----------
+
+
+def _fade(layer: Image.Image, opacity: float) -> Image.Image:
+    if opacity < 1:
+        layer.putalpha(layer.getchannel("A").point(lambda a: round(a * opacity)))
+    return layer
+
+
+def _rotate(layer: Image.Image, angle: float, fill) -> Image.Image:
+    if not angle % 360:
+        return layer
+    return layer.rotate(angle, Image.Resampling.BICUBIC, expand=True, fillcolor=fill)
+
+
+def _render_text(
+    text: str, size: int, color: str, opacity: float, angle: float
+) -> Image.Image:
+    face = font(FONT_PATH, size)
+    rgb = ImageColor.getrgb(color)[:3]
+    left, top, right, bottom = face.getbbox(text)
+    # 透明底色取文字颜色，旋转插值时边缘不会发黑
+    layer = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), rgb + (0,))
+    ImageDraw.Draw(layer).text((-left, -top), text, font=face, fill=rgb + (255,))
+    return _rotate(_fade(layer, opacity), angle, rgb + (0,))
+
+
+def _render_logo(path: str, width: int, opacity: float, angle: float) -> Image.Image:
+    with Image.open(path) as logo:
+        logo = logo.convert("RGBA")
+    height = max(1, round(logo.height * width / logo.width))
+    logo = logo.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return _rotate(_fade(logo, opacity), angle, (0, 0, 0, 0))
+
+
+def _layer(
+    size: Size, options: Dict[str, Any]
+) -> Optional[Tuple[Hashable, Image.Image]]:
+    """Cache key and rendered layer for a target of size, None if there is nothing to draw."""
+    opacity = options.get("opacity", 0.5)
+    angle = options.get("angle", 0)
+    scale = options.get("scale")
+
+    if options.get("logo_path"):
+        width = max(1, round(size[0] * (scale or LOGO_SCALE)))
+        key = ("logo", options["logo_key"], width, opacity, angle)
+        return key, layers.get(
+            key, lambda: _render_logo(options["logo_path"], width, opacity, angle)
+        )
+
+    text = options.get("text")
+    if not text:
+        return None
+    font_size = max(8, round(min(size) * (scale or TEXT_SCALE)))
+    color = options.get("color", "white")
+    key = ("text", text, font_size, color, opacity, angle)
+    return key, layers.get(
+        key, lambda: _render_text(text, font_size, color, opacity, angle)
+    )
+
+
+# ---------- 布局 ----------
+
+
+def placements(
+    size: Tuple[float, float], item: Tuple[float, float], position: str
+) -> List[Tuple[int, int]]:
+    """Top-left corners for an item on a canvas of size, with a top-left origin."""
+    width, height = size
+    w, h = item
+    margin = round(min(width, height) * MARGIN)
+
+    if position == "tile":
+        step_x = round(w * (1 + TILE_GAP)) or 1
+        step_y = round(h * (1 + TILE_GAP)) or 1
+        points = []
+        for row, y in enumerate(range(0, int(height), step_y)):
+            # 奇数行错开半格
+            offset = step_x // 2 if row % 2 else 0
+            points.extend((x, y) for x in range(offset - step_x, int(width), step_x))
+        return points
+    if position == "center":
+        return [(round((width - w) / 2), round((height - h) / 2))]
+    if position == "top-left":
+        return [(margin, margin)]
+    if position == "top-right":
+        return [(round(width - w) - margin, margin)]
+    if position == "bottom-right":
+        return [(round(width - w) - margin, round(height - h) - margin)]
+    return [(margin, round(height - h) - margin)]
+
+
+def _tile(layer: Image.Image, size: Size) -> Image.Image:
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    for point in placements(size, layer.size, "tile"):
+        overlay.paste(layer, point)
+    return overlay
+
+
+# ---------- 合成 ----------
+
+
+def apply(image: Image.Image, options: Dict[str, Any]) -> Image.Image:
+    """Composite the watermark onto image in place where possible and return it."""
+    found = _layer(image.size, options)
+    if found is None:
+        return image
+    key, layer = found
+
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert(
+            "RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB"
+        )
+
+    position = options.get("position", "center")
+    if position == "tile":
+        # 整幅平铺图层同样缓存，同尺寸图片只需一次合成
+        layer = layers.get(("tile", key, image.size), lambda: _tile(layer, image.size))
+        points = [(0, 0)]
+    else:
+        points = placements(image.size, layer.size, position)
+
+    for x, y in points:
+        if image.mode == "RGBA":
+            image.alpha_composite(
+                layer, dest=(max(x, 0), max(y, 0)), source=(max(-x, 0), max(-y, 0))
+            )
+        else:
+            image.paste(layer, (x, y), layer)
+    return image
+
+
+def _rotated_box(w: float, h: float, angle: float) -> Tuple[float, float]:
+    a = radians(angle)
+    return abs(w * cos(a)) + abs(h * sin(a)), abs(w * sin(a)) + abs(h * cos(a))
+
+
+def pdf_overlay(width: float, height: float, options: Dict[str, Any]) -> bytes:
+    """
+    A one-page PDF of width x height points carrying the watermark.
+
+    Text stays vector (DejaVuSans when available); a logo is embedded once
+    from the cached layer at PDF_LOGO_DPI and reused by every placement.
+    """
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    from reportlab.pdfgen import canvas
+
+    opacity = options.get("opacity", 0.5)
+    angle = options.get("angle", 0)
+    scale = options.get("scale")
+
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(width, height))
+
+    if options.get("logo_path"):
+        w = width * (scale or LOGO_SCALE)
+        pixels = max(1, round(w / 72 * PDF_LOGO_DPI))
+        logo = layers.get(
+            ("logo", options["logo_key"], pixels, opacity, 0),
+            lambda: _render_logo(options["logo_path"], pixels, opacity, 0),
+        )
+        h = w * logo.height / logo.width
+        reader = ImageReader(logo)
+
+        def draw():
+            c.drawImage(reader, -w / 2, -h / 2, w, h, mask="auto")
+
+    elif options.get("text"):
+        name = _pdf_font()
+        size = min(width, height) * (scale or TEXT_SCALE)
+        w, h = stringWidth(options["text"], name, size), size
+        rgb = ImageColor.getrgb(options.get("color", "white"))[:3]
+        c.setFont(name, size)
+        c.setFillColorRGB(*(channel / 255 for channel in rgb))
+        c.setFillAlpha(opacity)
+
+        def draw():
+            # 基线下移约 0.35 字号，使字形在框内大致居中
+            c.drawString(-w / 2, -h * 0.35, options["text"])
+
+    else:
+        c.showPage()
+        c.save()
+        return buffer.getvalue()
+
+    box = _rotated_box(w, h, angle)
+    for x, y in placements((width, height), box, options.get("position", "center")):
+        c.saveState()
+        # placements 使用左上角原点，PDF 坐标原点在左下角
+        c.translate(x + box[0] / 2, height - y - box[1] / 2)
+        c.rotate(angle)
+        draw()
+        c.restoreState()
+
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
@@ -0,0 +1,138 @@
+"""
+Streaming ZIP responses.
+
+Entries are appended to a ZipFile that writes into an in-memory sink; after
+each entry the sink is drained and the bytes go straight to the client, so
+the archive is never materialized on disk or in memory. zipfile handles the
+unseekable sink by emitting data descriptors after each entry.
+
+A streamed archive can also be teed to a scratch file while it is sent, so
+the finished archive can be cached (see main.cached_zip_response).
+
+Entries default to ZIP_STORED: JPEG, PNG and PDF payloads are already
+compressed and deflating them again only costs CPU.
+"""
+
+import time
+import zipfile
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from executor import pools
+
+Entry = Tuple[str, bytes]
+
+
+class _Sink:
+    """Write-only file object collecting zipfile output between drains."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStreamWriter:
+    """Incremental ZIP encoder: add() and close() return the bytes to send."""
+
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w", zipfile.ZIP_STORED)
+
+    def add(self, name: str, data: bytes, compress_type: int = zipfile.ZIP_STORED) -> bytes:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = compress_type
+        info.external_attr = 0o644 << 16
+        self._zip.writestr(info, data)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._sink.drain()
+
+
+async def stream_zip(
+    batches: AsyncIterator[List[Entry]],
+    tee: Optional[str] = None,
+    on_complete: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Encode batches of (name, data) entries into a ZIP byte stream.
+
+    With tee, the same bytes are also written to that file; on_complete is
+    awaited once the whole archive has been encoded, and not at all if the
+    stream is abandoned (client gone, failed batch).
+    """
+    writer = ZipStreamWriter()
+    out = open(tee, "wb") if tee else None
+    try:
+        async for entries in batches:
+            for name, data in entries:
+                chunk = writer.add(name, data)
+                if out:
+                    await pools.run("io", out.write, chunk)
+                yield chunk
+        chunk = writer.close()
+        if out:
+            await pools.run("io", out.write, chunk)
+            out.close()
+        yield chunk
+        if on_complete:
+            await on_complete()
+    finally:
+        if out:
+            out.close()
+
+
+async def write_zip(
+    batches: AsyncIterator[List[Entry]],
+    path: str,
+    on_entries: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Encode batches into a ZIP file at path, return the entry count.
+
+    on_entries is called with the running entry count after each batch.
+    """
+    writer = ZipStreamWriter()
+    count = 0
+    with open(path, "wb") as out:
+        async for entries in batches:
+            for name, data in entries:
+                await pools.run("io", out.write, writer.add(name, data))
+            count += len(entries)
+            if on_entries:
+                on_entries(count)
+        await pools.run("io", out.write, writer.close())
+    return count
+
+
+def zip_response(
+    batches: AsyncIterator[List[Entry]],
+    filename: str,
+    headers: Optional[Dict[str, str]] = None,
+    background: Optional[BackgroundTask] = None,
+    tee: Optional[str] = None,
+    on_complete: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> StreamingResponse:
+    return StreamingResponse(
+        stream_zip(batches, tee, on_complete),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            **(headers or {}),
+        },
+        background=background,
+    )